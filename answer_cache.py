@@ -0,0 +1,118 @@
+from typing import Dict, List, Optional
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class AnswerCache:
+    """Caché persistente de respuestas con expiración (TTL) y desalojo LRU"""
+
+    def __init__(self, path: str = "answer_cache.sqlite3", max_entries: int = 2000,
+                 ttl_seconds: float = 7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # El archivo se abre (y se crea) con la primera lectura o escritura, no al construir el motor
+        self._conn = None
+
+    def _connection(self, create: bool = True) -> Optional[sqlite3.Connection]:
+        """Conexión a la base; sin `create`, None si el archivo todavía no existe"""
+        if self._conn is None:
+            if not create and not os.path.exists(self.path):
+                return None
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    index_version TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    sources TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_access ON answers (last_access)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(normalized_question: str, model: str, chunk_ids: List, index_version: str) -> str:
+        """Clave: pregunta normalizada, modelo, fragmentos recuperados y versión del índice"""
+        payload = json.dumps({
+            'question': normalized_question,
+            'model': model,
+            'chunks': sorted(chunk_ids),
+            'index': index_version,
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Devuelve {'answer', 'sources'} si la entrada existe y no ha caducado"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT answer, sources, created FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[2] > self.ttl_seconds:
+                if row is not None:
+                    conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                    conn.commit()
+                self.misses += 1
+                return None
+            conn.execute("UPDATE answers SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+        return {'answer': row[0], 'sources': json.loads(row[1])}
+
+    def put(self, key: str, index_version: str, answer: str, sources: List[str]):
+        """Guarda una respuesta y desaloja las menos usadas si se supera el máximo"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                (key, index_version, answer, json.dumps(sources, ensure_ascii=False), now, now)
+            )
+            conn.execute(
+                "DELETE FROM answers WHERE key IN ("
+                "SELECT key FROM answers ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            conn.commit()
+
+    def invalidate(self, index_version: str) -> int:
+        """Elimina las respuestas generadas con otra versión del índice"""
+        with self._lock:
+            conn = self._connection(create=False)
+            if conn is None:
+                return 0
+            cursor = conn.execute("DELETE FROM answers WHERE index_version != ?", (index_version,))
+            conn.commit()
+            return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection(create=False)
+            if conn is not None:
+                conn.execute("DELETE FROM answers")
+                conn.commit()
+
+    def stats(self) -> Dict:
+        """Contadores de aciertos y fallos desde el arranque del proceso"""
+        with self._lock:
+            conn = self._connection(create=False)
+            entries = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] if conn is not None else 0
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': entries,
+        }
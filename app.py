@@ -1,6 +1,22 @@
 import streamlit as st
+import html
+import logging
 import os
-from rag_system import RAGSystem
+import tempfile
+import threading
+import time
+# Solo módulos ligeros al arrancar: rag_system (numpy, scikit-learn, Groq, PyMuPDF)
+# se importa en el hilo de carga del índice y al crear la sesión
+from conversation import ConversationContext
+from metrics import METRICS, span, start_metrics_server
+
+# Trazas detalladas desactivadas por defecto (RAG_LOG_LEVEL=INFO o DEBUG para activarlas)
+logging.basicConfig(
+    level=os.environ.get("RAG_LOG_LEVEL", "WARNING").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+# Endpoint /metrics en formato Prometheus si se define RAG_METRICS_PORT
+start_metrics_server()
 
 # Configuración de la página
 st.set_page_config(
@@ -42,17 +58,69 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource(show_spinner=False)
+def start_engine_boot():
+    """Carga el índice una vez por proceso en un hilo de fondo que arranca con la app"""
+    boot = {"engine": None, "error": None, "started": time.perf_counter(), "seconds": None}
+
+    def run():
+        try:
+            from rag_system import get_shared_engine
+            engine = get_shared_engine()
+            boot["engine"] = engine
+            engine.initialize()
+        except Exception as e:
+            logging.getLogger(__name__).exception("❌ Error cargando el índice: %s", e)
+            boot["error"] = str(e)
+        finally:
+            boot["seconds"] = time.perf_counter() - boot["started"]
+
+    threading.Thread(target=run, name="rag-boot", daemon=True).start()
+    return boot
+
+def engine_ready(boot) -> bool:
+    return boot["engine"] is not None and boot["engine"].is_ready
+
+# La carga empieza con el primer arranque del script, antes de pedir la clave API
+BOOT = start_engine_boot()
+
+def show_readiness():
+    """Estado de la carga del índice, sin volver a consultarlo"""
+    if engine_ready(BOOT):
+        st.success(f"✅ Índice listo: {len(BOOT['engine'].vector_store.documents)} fragmentos "
+                   f"({BOOT['seconds']:.1f} s)")
+    elif BOOT["error"]:
+        st.error(f"Error cargando el índice: {BOOT['error']}")
+    else:
+        st.info(f"⏳ Cargando índice... ({time.perf_counter() - BOOT['started']:.0f} s)")
+
+@st.fragment(run_every=1.0)
+def readiness_indicator():
+    """Consulta cada segundo mientras el índice se carga; al terminar, vuelve a ejecutar la app entera"""
+    if engine_ready(BOOT) or BOOT["error"]:
+        st.rerun()
+    show_readiness()
+
 def initialize_session_state():
     """Inicializa las variables de sesión"""
     if 'rag_system' not in st.session_state:
         st.session_state.rag_system = None
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
+    if 'conversation' not in st.session_state:
+        # Fragmentos e historial de la conversación, reutilizados en las preguntas de seguimiento
+        st.session_state.conversation = ConversationContext()
 
 def setup_sidebar():
     """Configura la barra lateral"""
     with st.sidebar:
         st.header("⚖️ Configuración")
+        # El fragmento con sondeo solo se dibuja durante la carga: en la ejecución
+        # siguiente se muestra el estado fijo y Streamlit deja de programarlo
+        if engine_ready(BOOT) or BOOT["error"]:
+            show_readiness()
+        else:
+            readiness_indicator()
 
         # Check for environment variable first
         env_api_key = os.environ.get("GROQ_API_KEY")
@@ -69,18 +137,28 @@ def setup_sidebar():
                 help="Ingresa tu clave API de Groq para usar el servicio"
             )
         
-        if groq_api_key and (not st.session_state.rag_system or 
+        if groq_api_key and engine_ready(BOOT) and (not st.session_state.rag_system or 
                            st.session_state.get('current_api_key') != groq_api_key):
             with st.spinner("Inicializando sistema RAG..."):
                 try:
-                    st.session_state.rag_system = RAGSystem(groq_api_key)
-                    st.session_state.rag_system.initialize()
+                    from rag_system import RAGSystem
+                    # La sesión solo guarda el cliente de Groq; el índice es compartido
+                    st.session_state.rag_system = RAGSystem(groq_api_key, engine=BOOT["engine"])
                     st.session_state.current_api_key = groq_api_key
                     st.success("Sistema inicializado correctamente")
                 except Exception as e:
                     st.error(f"Error inicializando: {str(e)}")
                     st.session_state.rag_system = None
-        
+
+        # Filtro por ley (solo con el índice por leyes, RAG_SHARDING=ley)
+        if st.session_state.rag_system and st.session_state.rag_system.engine.leyes:
+            st.session_state.rag_system.leyes = st.multiselect(
+                "📑 Buscar solo en:",
+                st.session_state.rag_system.engine.leyes,
+                format_func=lambda filename: os.path.splitext(filename)[0],
+                help="Si no eliges ninguna, se busca en todas las leyes"
+            ) or None
+
         # Información de documentos
         st.subheader("📚 Documentos Cargados")
         ref_folder = "ref"
@@ -91,11 +169,37 @@ def setup_sidebar():
         else:
             st.warning("Carpeta 'ref' no encontrada")
         
+        # Estadísticas de la caché de respuestas
+        if st.session_state.rag_system:
+            stats = st.session_state.rag_system.answer_cache.stats()
+            st.caption(
+                f"⚡ Caché de respuestas: {stats['hits']} aciertos, {stats['misses']} fallos, "
+                f"{stats['entries']} entradas"
+            )
+        
+        metrics_panel()
+        
         # Limpiar historial
         if st.button("🗑️ Limpiar Historial"):
             st.session_state.chat_history = []
+            st.session_state.conversation.clear()
             st.rerun()
 
+def metrics_panel():
+    """Panel de administración con las latencias por etapa y los contadores del proceso"""
+    with st.expander("📈 Métricas"):
+        summary = METRICS.stage_summary()
+        if summary:
+            st.dataframe(
+                [{"etapa": stage, **{key: round(value, 2) for key, value in row.items()}}
+                 for stage, row in sorted(summary.items())],
+                hide_index=True
+            )
+        else:
+            st.caption("Sin mediciones todavía")
+        for name, value in sorted(METRICS.counters().items()):
+            st.text(f"{name}: {value:g}")
+
 def main():
     """Función principal de la aplicación"""
     initialize_session_state()
@@ -107,7 +211,10 @@ def main():
     
     # Verificar si el sistema está listo
     if not st.session_state.rag_system:
-        st.warning("⚠️ Ingresa tu clave API de Groq en la barra lateral para comenzar.")
+        if not engine_ready(BOOT) and not BOOT["error"]:
+            st.info("⏳ Cargando los documentos. Puedes ir introduciendo tu clave API de Groq.")
+        else:
+            st.warning("⚠️ Ingresa tu clave API de Groq en la barra lateral para comenzar.")
         return
     
     # Tipos de consulta predefinidos
@@ -147,23 +254,78 @@ def main():
             else:
                 st.warning("Por favor, ingresa una consulta.")
     
+    # Consulta masiva desde archivo
+    batch_query_section()
+    
     # Mostrar historial de chat
     display_chat_history()
 
 def process_query(query: str):
-    """Procesa una consulta y muestra los resultados"""
-    with st.spinner("🔍 Buscando información relevante..."):
-        try:
-            result = st.session_state.rag_system.query(query)
-            
-            # Agregar al historial
-            st.session_state.chat_history.append({
-                "query": query,
-                "result": result
-            })
+    """Procesa una consulta mostrando la respuesta a medida que se genera"""
+    try:
+        stream = st.session_state.rag_system.query_stream(query, conversation=st.session_state.conversation)
+        
+        st.markdown("**💬 Respuesta:**")
+        with st.container(border=True), span("render"):
+            st.write_stream(stream)
+        
+        # Agregar al historial
+        st.session_state.chat_history.append({
+            "query": query,
+            "result": stream.result
+        })
+        
+    except Exception as e:
+        st.error(f"Error procesando la consulta: {str(e)}")
+
+def batch_query_section():
+    """Consulta masiva: responde todas las preguntas de un CSV o JSONL"""
+    with st.expander("📋 Consulta masiva"):
+        st.markdown("Sube un archivo CSV (columna `pregunta`) o JSONL con una pregunta por línea.")
+        uploaded = st.file_uploader("Archivo de preguntas", type=["csv", "jsonl"])
+        max_concurrency = st.number_input("Llamadas simultáneas a Groq", min_value=1, max_value=16, value=4)
+        
+        if uploaded and st.button("🚀 Procesar lote"):
+            extension = os.path.splitext(uploaded.name)[1].lower()
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                input_path = os.path.join(tmp_dir, f"preguntas{extension}")
+                output_path = os.path.join(tmp_dir, f"respuestas{extension}")
+                with open(input_path, 'wb') as f:
+                    f.write(uploaded.getvalue())
+                
+                with st.spinner("🔍 Respondiendo preguntas..."):
+                    try:
+                        results = st.session_state.rag_system.query_batch(
+                            input_path, output_path, max_concurrency=int(max_concurrency)
+                        )
+                        with open(output_path, 'rb') as f:
+                            output_data = f.read()
+                    except Exception as e:
+                        st.error(f"Error procesando el lote: {str(e)}")
+                        return
             
-        except Exception as e:
-            st.error(f"Error procesando la consulta: {str(e)}")
+            st.success(f"{len(results)} preguntas respondidas")
+            st.download_button(
+                "⬇️ Descargar respuestas",
+                data=output_data,
+                file_name=f"respuestas{extension}",
+                mime="text/csv" if extension == ".csv" else "application/json"
+            )
+
+def format_snippet(doc: dict) -> str:
+    """Pasaje del fragmento en HTML, con los términos de la consulta resaltados"""
+    snippet, parts, cursor = doc["snippet"], [], 0
+    for start, end in doc.get("highlights", []):
+        parts.append(html.escape(snippet[cursor:start]))
+        parts.append(f"<mark>{html.escape(snippet[start:end])}</mark>")
+        cursor = end
+    parts.append(html.escape(snippet[cursor:]))
+    text = "".join(parts).replace("\n", " ")
+    if doc.get("snippet_start", 0) > 0:
+        text = "… " + text
+    if doc.get("snippet_start", 0) + len(snippet) < len(doc["text"].rstrip()):
+        text += " …"
+    return text
 
 def display_chat_history():
     """Muestra el historial de consultas y respuestas"""
@@ -185,8 +347,10 @@ def display_chat_history():
             # Mostrar fuentes si están disponibles
             if result.get("sources"):
                 st.markdown("**📚 Fuentes consultadas:**")
+                dropped = set(result.get("dropped_sources") or [])
                 for source in result["sources"]:
-                    st.markdown(f'<div class="source-box">• {source}</div>', 
+                    note = " <em>(fuera del contexto enviado al modelo)</em>" if source in dropped else ""
+                    st.markdown(f'<div class="source-box">• {source}{note}</div>', 
                                unsafe_allow_html=True)
             
             # Mostrar la respuesta
@@ -199,7 +363,11 @@ def display_chat_history():
                     st.subheader("🔍 Fragmentos de texto utilizados:")
                     for j, doc in enumerate(result["context_docs"]):
                         with st.expander(f"Fragmento {j+1} - {doc['source']}"):
-                            st.text(doc["text"][:500] + "..." if len(doc["text"]) > 500 else doc["text"])
+                            if "snippet" in doc:
+                                st.markdown(f'<div class="source-box">{format_snippet(doc)}</div>',
+                                            unsafe_allow_html=True)
+                            else:
+                                st.text(doc["text"][:500] + "..." if len(doc["text"]) > 500 else doc["text"])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,93 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import re
+import unicodedata
+
+# Abreviaturas y nombres habituales de cada ley -> fragmento del nombre del PDF
+LEY_ALIASES = {
+    'loex': 'extranjeria',
+    'lo 4/2000': 'extranjeria',
+    'ley de extranjeria': 'extranjeria',
+    'extranjeria': 'extranjeria',
+    'lecrim': 'enjuiciamiento criminal',
+    'ley de enjuiciamiento criminal': 'enjuiciamiento criminal',
+    'cp': 'codigo penal',
+    'codigo penal': 'codigo penal',
+}
+
+# "artículo 57", "art. 2 bis", "arts. 520"
+ARTICLE_REFERENCE = re.compile(
+    r'\bart(?:iculos?|s?\.)?\s*(\d+(?:\s+(?:bis|ter|quater|quinquies|sexies|septies))?)\b'
+)
+LEY_REFERENCE = re.compile(
+    r'\b(' + '|'.join(re.escape(alias) for alias in sorted(LEY_ALIASES, key=len, reverse=True)) + r')\b'
+)
+
+
+def fold(text: str) -> str:
+    """Minúsculas y sin tildes, para comparar nombres de leyes y referencias"""
+    decomposed = unicodedata.normalize('NFD', text.lower())
+    return unicodedata.normalize('NFC', ''.join(c for c in decomposed if unicodedata.category(c) != 'Mn'))
+
+
+class ArticleIndex:
+    """Índice directo (ley, artículo) -> fragmentos, para resolver referencias sin búsqueda"""
+
+    def __init__(self):
+        self._by_article: Dict[Tuple[str, str], List[int]] = {}
+        self._filenames: List[str] = []
+
+    @classmethod
+    def from_metadata(cls, metadata: Iterable[Dict]) -> "ArticleIndex":
+        """Construye el índice a partir de los metadatos de los fragmentos (sin leer textos)"""
+        index = cls()
+        seen = set()
+        for position, doc in enumerate(metadata):
+            filename = doc['filename']
+            if filename not in seen:
+                seen.add(filename)
+                index._filenames.append(filename)
+            articulo = doc.get('articulo')
+            if articulo:
+                index._by_article.setdefault((filename, fold(articulo)), []).append(position)
+        return index
+
+    def lookup(self, articulo: str, ley: Optional[str] = None) -> List[int]:
+        """Fragmentos del artículo en la ley indicada (alias o nombre) o en todas"""
+        target = LEY_ALIASES.get(fold(ley), fold(ley)) if ley else None
+        positions = []
+        for filename in self._filenames:
+            if target and target not in fold(filename):
+                continue
+            positions.extend(self._by_article.get((filename, fold(articulo)), []))
+        return positions
+
+    @staticmethod
+    def parse_references(query: str) -> List[Tuple[str, Optional[str]]]:
+        """Extrae referencias a artículos ("artículo 57 LOEX") de una consulta, cada una con su ley
+
+        La ley de un artículo es la que se cita tras él y antes del siguiente
+        artículo ("artículo 57 LOEX y artículo 520 LECrim"); si no hay, la
+        última citada antes ("la LOEX, en su artículo 57") o, en su defecto,
+        la siguiente ("artículo 57 y artículo 58 de la LOEX").
+        """
+        folded = fold(query)
+        leyes = [(match.start(), match.group(1)) for match in LEY_REFERENCE.finditer(folded)]
+        articles = list(ARTICLE_REFERENCE.finditer(folded))
+        references = []
+        for i, match in enumerate(articles):
+            end = articles[i + 1].start() if i + 1 < len(articles) else len(folded)
+            following = [ley for position, ley in leyes if match.end() <= position < end]
+            preceding = [ley for position, ley in leyes if position < match.start()]
+            later = [ley for position, ley in leyes if position >= match.end()]
+            ley = (following or preceding[-1:] or later or [None])[0]
+            references.append((re.sub(r'\s+', ' ', match.group(1)), ley))
+        return references
+
+    def resolve(self, query: str) -> List[int]:
+        """Fragmentos de todos los artículos citados en la consulta, en orden de aparición"""
+        positions = []
+        for articulo, ley in self.parse_references(query):
+            for position in self.lookup(articulo, ley):
+                if position not in positions:
+                    positions.append(position)
+        return positions
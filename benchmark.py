@@ -0,0 +1,383 @@
+"""Benchmark de ingesta, recuperación y generación sobre el corpus de ref/.
+
+Construye el índice desde cero en un directorio temporal y mide el tiempo de
+ingesta y de guardado, el tamaño del índice (y de los metadatos de los
+fragmentos), el tiempo de carga y la memoria residente que añade cargarlo en un
+proceso nuevo. Después lanza las preguntas
+del conjunto de referencia (benchmarks/gold_questions.jsonl, con los artículos
+esperados de cada una) y mide:
+
+- la latencia de búsqueda (p50/p95/p99) y el throughput secuencial y por lotes;
+- la calidad de la recuperación, con recall@k y MRR;
+- la latencia de RAGSystem.query de extremo a extremo, con un cliente falso y
+  determinista en lugar de Groq (fake_groq.FakeGroq).
+
+También mide, en procesos nuevos, cuánto tarda en importarse cada módulo del
+arranque de la app y comprueba que no arrastra dependencias pesadas (scikit-learn,
+Groq, PyMuPDF...), que deben cargarse en segundo plano o al usarse. Si se supera el
+presupuesto de importación el proceso termina con código 1 (--imports-only hace
+solo esta comprobación).
+
+El informe se guarda en JSON. Con --compare se contrasta con un informe anterior
+y el proceso termina con código 1 si alguna métrica empeora más de la tolerancia.
+
+Uso:
+    python benchmark.py --k 5 --output bench.json
+    python benchmark.py --k 5 --compare bench.json
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from article_index import fold
+from fake_groq import FakeAsyncGroq, FakeGroq
+from import_budget import measure_imports
+from metrics import METRICS
+from rag_system import RAGSystem, RetrievalEngine
+
+DEFAULT_GOLD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "gold_questions.jsonl")
+
+# Métrica -> sentido de la mejora, para el modo de comparación
+METRIC_DIRECTIONS = {
+    'ingest.seconds': 'lower',
+    'ingest.index_bytes': 'lower',
+    'ingest.save_seconds': 'lower',
+    'ingest.chunks_bytes': 'lower',
+    'load.seconds': 'lower',
+    'load.rss_mb': 'lower',
+    'search.latency_p50_ms': 'lower',
+    'search.latency_p95_ms': 'lower',
+    'search.latency_p99_ms': 'lower',
+    'search.throughput_qps': 'higher',
+    'search.batch_throughput_qps': 'higher',
+    'search.encode_p50_ms': 'lower',
+    'quality.recall_at_k': 'higher',
+    'quality.mrr': 'higher',
+    'generation.latency_p50_ms': 'lower',
+    'generation.latency_p95_ms': 'lower',
+    'imports.rag_system_ms': 'lower',
+    'imports.app_ms': 'lower',
+}
+# Las métricas de calidad son deterministas: cualquier caída es una regresión
+QUALITY_TOLERANCE = 1e-9
+# Diferencia mínima en latencias (ms) para considerarla regresión y no ruido
+LATENCY_FLOOR_MS = 1.0
+
+def load_gold(path: str) -> List[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def is_relevant(doc: Dict, item: Dict) -> bool:
+    """El fragmento pertenece a la ley esperada y contiene alguno de sus artículos"""
+    if fold(item['ley']) not in fold(doc['filename']):
+        return False
+    if doc.get('articulo'):
+        return fold(doc['articulo']) in {fold(a) for a in item['articulos']}
+    # Fragmentación fija: buscar el encabezado del artículo en el texto
+    return any(re.search(rf'\bArt[íi]culo\s+{re.escape(a)}\b', doc['text']) for a in item['articulos'])
+
+
+def percentile_ms(latencies: List[float], q: float) -> float:
+    return float(np.percentile(latencies, q) * 1000) if latencies else 0.0
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, files in os.walk(path) for name in files)
+
+
+def chunks_size(path: str) -> int:
+    """Bytes de los metadatos de los fragmentos (columnas y tablas de cadenas, sin los textos)"""
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, files in os.walk(path) for name in files if name.startswith('chunks'))
+
+
+def current_rss_mb() -> float:
+    """Memoria residente actual del proceso (Linux), 0 si no se puede leer"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError):
+        return 0.0
+
+
+def timed(fn: Callable, *args, **kwargs) -> Tuple[float, object]:
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def index_stores(engine: RetrievalEngine) -> List:
+    """Almacenes con índice propio: los shards con el índice por leyes, o el almacén único"""
+    store = engine.vector_store
+    return list(store.shards.values()) if engine.sharding == "ley" else [store]
+
+
+def measure_ingest(ref: str, index_path: str) -> Tuple[Dict, Dict]:
+    """Construcción completa del índice, guardado y carga en frío desde disco"""
+    build_seconds, _ = timed(RetrievalEngine(ref, index_path).initialize)
+    engine = RetrievalEngine(ref, index_path)
+    load_seconds, _ = timed(engine.initialize)
+    stores = index_stores(engine)
+    ingest = {
+        'seconds': build_seconds,
+        'save_seconds': measure_save(engine),
+        'index_bytes': directory_size(index_path),
+        'chunks_bytes': chunks_size(index_path),
+        'documents': len(engine.vector_store.documents),
+        'vocabulary_terms': sum(len(store.query_encoder.vocabulary) for store in stores),
+        'matrix_nnz': sum(int(store.tfidf_matrix.nnz) for store in stores),
+    }
+    return ingest, {'seconds': load_seconds, 'rss_mb': measure_load_rss(ref, index_path), 'engine': engine}
+
+
+def measure_save(engine: RetrievalEngine) -> float:
+    """Tiempo de guardar el índice completo (todos los shards) en un directorio aparte"""
+    stores = index_stores(engine)
+    scratch = tempfile.mkdtemp(prefix="rag_benchmark_save_")
+    try:
+        start = time.perf_counter()
+        for i, shard in enumerate(stores):
+            shard.save_index(os.path.join(scratch, str(i)))
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def measure_load_rss(ref: str, index_path: str) -> float:
+    """Memoria residente (MB) que añade cargar el índice en un proceso nuevo, tras las importaciones"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    script = (
+        "import sys\n"
+        f"sys.path.insert(0, {root!r})\n"
+        "from benchmark import current_rss_mb\n"
+        # Las dependencias se importan antes de medir: según el modo de sharding se cargarían
+        # al construir el motor o al cargar el índice, y solo debe contar la carga
+        "import numpy, scipy.sparse, sklearn.feature_extraction.text\n"
+        "from rag_system import RetrievalEngine\n"
+        f"engine = RetrievalEngine({ref!r}, {index_path!r})\n"
+        "before = current_rss_mb()\n"
+        "engine.initialize()\n"
+        "print(current_rss_mb() - before)\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure_search(engine: RetrievalEngine, gold: List[Dict], k: int, repeat: int) -> Tuple[Dict, Dict]:
+    """Latencia y throughput de búsqueda, y recall@k/MRR de la primera pasada"""
+    latencies, per_question = [], []
+    for round_ in range(repeat):
+        for item in gold:
+            elapsed, results = timed(engine.search, item['question'], k)
+            latencies.append(elapsed)
+            if round_ == 0:
+                rank = next((i + 1 for i, doc in enumerate(results) if is_relevant(doc, item)), None)
+                per_question.append({
+                    'id': item['id'],
+                    'rank': rank,
+                    'retrieved': [doc['source'] for doc in results],
+                })
+
+    batch_seconds, _ = timed(engine.search_batch, [item['question'] for item in gold], k)
+    # Con el índice por leyes cada consulta se codifica una vez por shard
+    encoders = [store.query_encoder for store in index_stores(engine)]
+
+    def encode(question):
+        return [encoder.encode(question) for encoder in encoders]
+
+    encode_latencies = [timed(encode, item['question'])[0] for item in gold for _ in range(repeat)]
+    search = {
+        'queries': len(latencies),
+        'latency_p50_ms': percentile_ms(latencies, 50),
+        'latency_p95_ms': percentile_ms(latencies, 95),
+        'latency_p99_ms': percentile_ms(latencies, 99),
+        'throughput_qps': len(latencies) / sum(latencies) if latencies else 0.0,
+        'batch_throughput_qps': len(gold) / batch_seconds if batch_seconds else 0.0,
+        'encode_p50_ms': percentile_ms(encode_latencies, 50),
+    }
+    hits = [q for q in per_question if q['rank'] is not None]
+    quality = {
+        'questions': len(per_question),
+        'recall_at_k': len(hits) / len(per_question) if per_question else 0.0,
+        'mrr': sum(1.0 / q['rank'] for q in hits) / len(per_question) if per_question else 0.0,
+        'misses': [q['id'] for q in per_question if q['rank'] is None],
+        'per_question': per_question,
+    }
+    return search, quality
+
+
+def measure_generation(engine: RetrievalEngine, gold: List[Dict], llm_latency_ms: float) -> Dict:
+    """Latencia de RAGSystem.query con el cliente falso y sin caché de respuestas"""
+    rag = RAGSystem("benchmark", engine=engine)
+    rag.client = FakeGroq(latency_ms=llm_latency_ms)
+    rag.async_client = FakeAsyncGroq(latency_ms=llm_latency_ms)
+    # Se mide el sistema, no la cuota de Groq: sin limitador de ritmo
+    rag.llm.limiter = None
+    engine.answer_cache.clear()
+    latencies = []
+    for item in gold:
+        elapsed, _ = timed(rag.query, item['question'])
+        latencies.append(elapsed)
+    engine.answer_cache.clear()
+    return {
+        'queries': len(latencies),
+        'llm_latency_ms': llm_latency_ms,
+        'latency_p50_ms': percentile_ms(latencies, 50),
+        'latency_p95_ms': percentile_ms(latencies, 95),
+    }
+
+
+def get_metric(report: Dict, name: str) -> Optional[float]:
+    value = report
+    for part in name.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare_reports(current: Dict, previous: Dict, tolerance: float) -> List[Dict]:
+    """Métricas que empeoran respecto al informe anterior más allá de la tolerancia"""
+    regressions = []
+    for name, direction in METRIC_DIRECTIONS.items():
+        new, old = get_metric(current, name), get_metric(previous, name)
+        if new is None or old is None:
+            continue
+        if name.startswith('quality.'):
+            allowed = QUALITY_TOLERANCE
+        elif name.endswith('_ms'):
+            allowed = max(tolerance * abs(old), LATENCY_FLOOR_MS)
+        else:
+            allowed = tolerance * abs(old)
+        worse = new > old + allowed if direction == 'lower' else new < old - allowed
+        if worse:
+            regressions.append({'metric': name, 'previous': old, 'current': new})
+    return regressions
+
+
+def print_report(report: Dict):
+    ingest, search, quality = report['ingest'], report['search'], report['quality']
+    print(f"\n📊 Benchmark: {ingest['documents']} fragmentos, {quality['questions']} preguntas, k={report['config']['k']}")
+    print(f"Ingesta: {ingest['seconds']:.2f} s, guardado {ingest['save_seconds'] * 1000:.1f} ms, "
+          f"índice {ingest['index_bytes'] / 1e6:.1f} MB (metadatos {ingest['chunks_bytes'] / 1e3:.0f} kB), "
+          f"carga {report['load']['seconds'] * 1000:.1f} ms y {report['load']['rss_mb']:.1f} MB de RSS")
+    print(f"Análisis {report['config']['analyzer']}: {ingest['vocabulary_terms']} términos, "
+          f"{ingest['matrix_nnz']} valores no nulos en la matriz TF-IDF")
+    print(f"Búsqueda: p50 {search['latency_p50_ms']:.2f} ms, p95 {search['latency_p95_ms']:.2f} ms, "
+          f"p99 {search['latency_p99_ms']:.2f} ms, {search['throughput_qps']:.0f} q/s "
+          f"({search['batch_throughput_qps']:.0f} q/s por lotes), codificación p50 {search['encode_p50_ms'] * 1000:.0f} µs")
+    print(f"Calidad: recall@{report['config']['k']} {quality['recall_at_k']:.3f}, MRR {quality['mrr']:.3f}")
+    if quality['misses']:
+        print(f"Sin acierto: {', '.join(quality['misses'])}")
+    generation = report.get('generation')
+    if generation:
+        print(f"Generación (cliente falso, {generation['llm_latency_ms']:.0f} ms): "
+              f"p50 {generation['latency_p50_ms']:.2f} ms, p95 {generation['latency_p95_ms']:.2f} ms")
+
+
+def print_imports(imports: Dict):
+    for module, budget in imports['budget_ms'].items():
+        heavy = imports['heavy_modules'][module]
+        print(f"Importación de {module}: {imports[module + '_ms']:.0f} ms (presupuesto {budget:.0f} ms)"
+              + (f", carga {', '.join(heavy)}" if heavy else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ref', default='ref')
+    parser.add_argument('--gold', default=DEFAULT_GOLD)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5, help='Rondas de búsqueda para las latencias')
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0, help='Latencia simulada del cliente falso')
+    parser.add_argument('--skip-generation', action='store_true')
+    parser.add_argument('--index', help='Directorio del índice (por defecto, uno temporal que se borra)')
+    parser.add_argument('--output', help='Ruta donde guardar el informe JSON')
+    parser.add_argument('--compare', help='Informe JSON anterior con el que comparar')
+    parser.add_argument('--tolerance', type=float, default=0.20,
+                        help='Empeoramiento relativo admitido en tiempos y tamaños (0.20 = 20%%)')
+    parser.add_argument('--verbose', action='store_true', help='Mostrar las trazas de los módulos')
+    parser.add_argument('--imports-only', action='store_true', help='Comprobar solo el presupuesto de importación')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    imports = measure_imports()
+    print_imports(imports)
+    if args.imports_only:
+        sys.exit(1 if imports['over_budget'] else 0)
+
+    gold = load_gold(args.gold)
+    workdir = None
+    if args.index:
+        index_path = args.index
+        shutil.rmtree(index_path, ignore_errors=True)
+    else:
+        workdir = tempfile.mkdtemp(prefix="rag_benchmark_")
+        index_path = os.path.join(workdir, "vector_index")
+
+    try:
+        ingest, load = measure_ingest(args.ref, index_path)
+        engine = load.pop('engine')
+        search, quality = measure_search(engine, gold, args.k, args.repeat)
+        generation = None if args.skip_generation else measure_generation(engine, gold, args.llm_latency_ms)
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'config': {
+            'k': args.k,
+            'repeat': args.repeat,
+            'gold': os.path.basename(args.gold),
+            'retrieval': engine.retrieval,
+            'backend': engine.vector_store.backend,
+            'analyzer': engine.vector_store.analyzer_name,
+            'chunking': engine.doc_processor.chunking,
+            'ingest_mode': engine.ingest,
+            'sharding': engine.sharding,
+        },
+        'ingest': ingest,
+        'load': load,
+        'search': search,
+        'quality': quality,
+    }
+    if generation:
+        report['generation'] = generation
+    report['imports'] = imports
+    # Desglose por etapa (preprocess, vectorize, score, topk, llm_call...) de todo el proceso
+    report['stages'] = METRICS.stage_summary()
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if imports['over_budget']:
+        print(f"\n❌ Presupuesto de importación superado: {', '.join(imports['over_budget'])}")
+        sys.exit(1)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        regressions = compare_reports(report, previous, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regresiones respecto a {args.compare}:")
+            for regression in regressions:
+                print(f"  {regression['metric']}: {regression['previous']:.4g} -> {regression['current']:.4g}")
+            sys.exit(1)
+        print(f"\n✅ Sin regresiones respecto a {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
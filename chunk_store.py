@@ -0,0 +1,213 @@
+from array import array
+from collections.abc import Sequence
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional
+import io
+import json
+import os
+
+import numpy as np
+
+from document_processor import format_source
+
+# Valor de las columnas enteras cuando el fragmento no tiene ese campo
+MISSING_INT = -(2 ** 63)
+MISSING_CODE = -1
+CHUNKS_FILE = "chunks.json"
+
+
+def _derived_source(doc: Dict) -> Optional[str]:
+    """Fuente que DocumentProcessor asignaría al fragmento, si tiene los campos necesarios"""
+    if 'filename' not in doc or 'chunk_id' not in doc or 'page' not in doc:
+        return None
+    return format_source(doc['filename'], doc['chunk_id'], doc['page'], doc.get('articulo'), doc.get('part'))
+
+
+def _as_array(column: array) -> np.ndarray:
+    return np.frombuffer(column, dtype=np.int64 if column.typecode == 'q' else np.int32)
+
+
+def write_columns(dirpath: str, kinds: Dict[str, str], columns: Dict[str, np.ndarray],
+                  tables: Dict[str, List[str]], offsets: np.ndarray):
+    """Guarda desplazamientos de los textos, una columna .npy por campo y las tablas de cadenas"""
+    np.save(os.path.join(dirpath, "text_offsets.npy"), offsets)
+    for name, column in columns.items():
+        np.save(os.path.join(dirpath, f"chunks_{name}.npy"), column)
+    with open(os.path.join(dirpath, CHUNKS_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'fields': kinds, 'strings': tables}, f, ensure_ascii=False)
+
+
+class ChunkStoreWriter:
+    """Acumula fragmentos en columnas a medida que llegan: enteros, códigos de cadenas y un blob de textos
+
+    Las cadenas repetidas (archivo, libro, título, artículo...) se internan en
+    una tabla por campo y cada fragmento guarda solo su código. La fuente
+    legible no se guarda si coincide con la que se deriva del resto de campos.
+    Los textos se escriben en `texts` (un archivo o un buffer en memoria).
+    """
+
+    def __init__(self, texts: Optional[BinaryIO] = None):
+        self.texts = texts if texts is not None else io.BytesIO()
+        self.offsets = array('q', [0])
+        self.kinds: Dict[str, str] = {}
+        self.columns: Dict[str, array] = {}
+        self.tables: Dict[str, List[str]] = {}
+        self._codes: Dict[str, Dict[str, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _pad(self, name: str, length: int):
+        column = self.columns[name]
+        missing = MISSING_INT if self.kinds[name] == 'int' else MISSING_CODE
+        if len(column) < length:
+            column.extend(array(column.typecode, [missing]) * (length - len(column)))
+
+    def add(self, doc: Dict):
+        row = len(self)
+        encoded = doc['text'].encode('utf-8')
+        self.texts.write(encoded)
+        self.offsets.append(self.offsets[-1] + len(encoded))
+
+        for name, value in doc.items():
+            if name == 'text' or value is None:
+                continue
+            if name == 'source' and value == _derived_source(doc):
+                continue
+            kind = 'int' if isinstance(value, int) and not isinstance(value, bool) else \
+                'str' if isinstance(value, str) else None
+            if kind is None:
+                raise TypeError(f"Campo {name}: tipo {type(value).__name__} no soportado en el almacén de fragmentos")
+            if name not in self.kinds:
+                self.kinds[name] = kind
+                self.columns[name] = array('q' if kind == 'int' else 'i')
+                if kind == 'str':
+                    self.tables[name], self._codes[name] = [], {}
+            elif self.kinds[name] != kind:
+                raise TypeError(f"Campo {name}: mezcla de tipos {self.kinds[name]} y {kind}")
+            self._pad(name, row)
+            if kind == 'int':
+                self.columns[name].append(value)
+            else:
+                codes = self._codes[name]
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(self.tables[name])
+                    self.tables[name].append(value)
+                self.columns[name].append(code)
+
+    def extend(self, docs: Iterable[Dict]) -> "ChunkStoreWriter":
+        for doc in docs:
+            self.add(doc)
+        return self
+
+    def _finish(self):
+        for name in self.columns:
+            self._pad(name, len(self))
+
+    def to_store(self) -> "ChunkStore":
+        """Almacén en memoria (sin copiar las columnas) con los textos del buffer"""
+        self._finish()
+        texts = np.frombuffer(self.texts.getbuffer(), dtype=np.uint8)
+        columns = {name: _as_array(column) for name, column in self.columns.items()}
+        return ChunkStore(self.kinds, columns, self.tables, texts, _as_array(self.offsets))
+
+    def save_columns(self, dirpath: str):
+        """Escribe desplazamientos, columnas y tablas de cadenas (los textos ya están en texts.bin)"""
+        self._finish()
+        columns = {name: _as_array(column) for name, column in self.columns.items()}
+        write_columns(dirpath, self.kinds, columns, self.tables, _as_array(self.offsets))
+
+
+class ChunkStore(Sequence):
+    """Metadatos de los fragmentos en columnas y textos en un único blob, materializados por fila
+
+    Sustituye a la lista de diccionarios: cada fragmento ocupa unos pocos
+    enteros en lugar de un diccionario con sus cadenas, y el texto solo se
+    decodifica para los fragmentos que se devuelven. Indexar devuelve un
+    diccionario nuevo (con 'text' y 'source'), que el llamador puede modificar.
+    """
+
+    def __init__(self, kinds: Dict[str, str], columns: Dict[str, np.ndarray], tables: Dict[str, List[str]],
+                 texts: np.ndarray, offsets: np.ndarray):
+        self.kinds = kinds
+        self.columns = columns
+        self.tables = tables
+        self.texts = texts
+        self.offsets = offsets
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Dict]) -> "ChunkStore":
+        return ChunkStoreWriter().extend(documents).to_store()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def text(self, idx: int) -> str:
+        """Decodifica solo el texto del fragmento indicado"""
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return self.texts[start:end].tobytes().decode('utf-8')
+
+    def metadata(self, idx: int) -> Dict:
+        """Campos del fragmento, sin el texto"""
+        doc = {}
+        for name, kind in self.kinds.items():
+            value = int(self.columns[name][idx])
+            if kind == 'int':
+                if value != MISSING_INT:
+                    doc[name] = value
+            elif value != MISSING_CODE:
+                doc[name] = self.tables[name][value]
+        if 'source' not in doc:
+            source = _derived_source(doc)
+            if source is not None:
+                doc['source'] = source
+        return doc
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        doc = {'text': self.text(idx)}
+        doc.update(self.metadata(idx))
+        return doc
+
+    def column(self, name: str) -> List:
+        """Valores de un campo para todos los fragmentos (None donde falta), sin materializar filas"""
+        if name not in self.kinds:
+            return [None] * len(self)
+        values = self.columns[name].tolist()
+        if self.kinds[name] == 'int':
+            return [None if value == MISSING_INT else value for value in values]
+        table = self.tables[name]
+        return [None if code == MISSING_CODE else table[code] for code in values]
+
+    def iter_metadata(self, fields: List[str]) -> Iterator[Dict]:
+        """Diccionarios con solo los campos indicados, para construir índices auxiliares"""
+        columns = [self.column(name) for name in fields]
+        for values in zip(*columns):
+            yield {name: value for name, value in zip(fields, values) if value is not None}
+
+    def save(self, dirpath: str):
+        """Escribe textos, desplazamientos, columnas y tablas de cadenas en el directorio"""
+        with open(os.path.join(dirpath, "texts.bin"), 'wb') as f:
+            f.write(memoryview(self.texts))
+        write_columns(dirpath, self.kinds, self.columns, self.tables, self.offsets)
+
+    @classmethod
+    def load(cls, dirpath: str) -> "ChunkStore":
+        """Mapea en memoria columnas y textos; solo las tablas de cadenas se leen enteras"""
+        def load_array(name):
+            return np.load(os.path.join(dirpath, name), mmap_mode='r')
+
+        with open(os.path.join(dirpath, CHUNKS_FILE), 'r', encoding='utf-8') as f:
+            schema = json.load(f)
+        texts_path = os.path.join(dirpath, "texts.bin")
+        if os.path.getsize(texts_path) > 0:
+            texts = np.memmap(texts_path, dtype=np.uint8, mode='r')
+        else:
+            texts = np.zeros(0, dtype=np.uint8)
+        columns = {name: load_array(f"chunks_{name}.npy") for name in schema['fields']}
+        return cls(schema['fields'], columns, schema['strings'], texts, load_array("text_offsets.npy"))
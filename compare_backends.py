@@ -0,0 +1,166 @@
+"""Compara los backends TF-IDF y denso sobre el corpus de ref/.
+
+Usa dos conjuntos de consultas:
+
+- "elemento conocido": para una muestra de fragmentos toma su frase más larga
+  como consulta y espera recuperar ese mismo fragmento. Comparte las palabras
+  exactas del fragmento, así que favorece a TF-IDF;
+- "referencia": las preguntas parafraseadas de benchmarks/gold_questions.jsonl,
+  con los artículos esperados de cada una (el mismo criterio que benchmark.py).
+  Es donde se ve si los embeddings aportan algo frente al léxico.
+
+Para cada conjunto informa recall@k y latencia (p50/p95) de TF-IDF, del índice
+denso aproximado (HNSW/IVF) y de la búsqueda densa exacta, además del recall
+del ANN frente a la búsqueda exacta y la memoria que ocupan los vectores
+cuantizados y el índice ANN. El modelo de embeddings se descarga de
+Hugging Face; sin conexión, --model acepta la ruta de un modelo local.
+
+Uso:
+    python compare_backends.py --sample 200 --k 5 --ann hnsw --storage float16
+    python compare_backends.py --backends tfidf --k 5
+"""
+from typing import Callable, Dict, List
+import argparse
+import json
+import random
+import re
+import time
+
+import numpy as np
+
+from benchmark import DEFAULT_GOLD, is_relevant, load_gold, percentile_ms
+from dense_index import DEFAULT_MODEL, DenseIndex
+from document_processor import DocumentProcessor
+from vector_store import VectorStore
+
+BACKENDS = ('tfidf', 'dense_ann', 'dense_exact')
+
+
+def make_queries(documents: List[Dict], sample: int, seed: int = 0) -> List[Dict]:
+    """Elige fragmentos al azar y usa su frase más larga como consulta"""
+    rng = random.Random(seed)
+    candidates = list(range(len(documents)))
+    rng.shuffle(candidates)
+    queries = []
+    for idx in candidates:
+        sentences = [s.strip() for s in re.split(r'(?<=[.;:])\s+', documents[idx]['text'])]
+        sentences = [s for s in sentences if len(s.split()) >= 8]
+        if sentences:
+            queries.append({'query': max(sentences, key=len), 'text': documents[idx]['text']})
+        if len(queries) >= sample:
+            break
+    return queries
+
+
+def gold_queries(path: str) -> List[Dict]:
+    """Preguntas parafraseadas del conjunto de referencia, con la ley y los artículos esperados"""
+    return [dict(item, query=item['question']) for item in load_gold(path)]
+
+
+def is_known_item(doc: Dict, item: Dict) -> bool:
+    return doc['text'] == item['text']
+
+
+def evaluate(search, queries: List[Dict], documents: List[Dict], k: int,
+             is_hit: Callable[[Dict, Dict], bool]) -> Dict:
+    """Recall@k (algún fragmento relevante entre los k primeros) y latencias"""
+    hits, latencies, rankings = 0, [], []
+    for item in queries:
+        start = time.perf_counter()
+        indices = search(item['query'], k)
+        latencies.append(time.perf_counter() - start)
+        rankings.append(list(indices))
+        if any(is_hit(documents[i], item) for i in indices):
+            hits += 1
+    return {
+        'recall_at_k': hits / len(queries) if queries else 0.0,
+        'latency_p50_ms': percentile_ms(latencies, 50),
+        'latency_p95_ms': percentile_ms(latencies, 95),
+        'rankings': rankings,
+    }
+
+
+def compare(searches: Dict[str, Callable], queries: List[Dict], documents: List[Dict], k: int,
+            is_hit: Callable[[Dict, Dict], bool]) -> Dict:
+    """Evalúa cada backend sobre un conjunto de consultas"""
+    report = {'queries': len(queries)}
+    for name, search in searches.items():
+        report[name] = evaluate(search, queries, documents, k, is_hit)
+    if 'dense_ann' in report and 'dense_exact' in report:
+        # Recall del índice aproximado respecto a la búsqueda exacta
+        overlaps = [
+            len(set(approx) & set(exact)) / max(1, len(exact))
+            for approx, exact in zip(report['dense_ann']['rankings'], report['dense_exact']['rankings'])
+        ]
+        report['ann_recall_vs_exact'] = float(np.mean(overlaps)) if overlaps else 0.0
+    for name in searches:
+        del report[name]['rankings']
+    return report
+
+
+def print_report(title: str, report: Dict, k: int):
+    print(f"\n📊 {title}: {report['queries']} consultas, k={k}")
+    print(f"{'backend':<14}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name in BACKENDS:
+        if name in report:
+            row = report[name]
+            print(f"{name:<14}{row['recall_at_k']:>10.3f}{row['latency_p50_ms']:>10.2f}{row['latency_p95_ms']:>10.2f}")
+    if 'ann_recall_vs_exact' in report:
+        print(f"Recall ANN vs exacto: {report['ann_recall_vs_exact']:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ref', default='ref')
+    parser.add_argument('--gold', default=DEFAULT_GOLD)
+    parser.add_argument('--sample', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--backends', nargs='+', default=['tfidf', 'dense'], choices=['tfidf', 'dense'])
+    parser.add_argument('--model', default=DEFAULT_MODEL, help='Modelo de sentence-transformers (nombre o ruta local)')
+    parser.add_argument('--ann', default='hnsw', choices=['hnsw', 'ivf', 'flat'])
+    parser.add_argument('--storage', default='float16', choices=['float16', 'int8'])
+    parser.add_argument('--output', help='Ruta opcional donde guardar el informe JSON')
+    args = parser.parse_args()
+
+    documents = DocumentProcessor(args.ref).process_documents()
+    dense = 'dense' in args.backends
+    store = VectorStore(
+        backend="dense" if dense else "tfidf",
+        dense_index=DenseIndex(model_name=args.model, storage=args.storage, ann=args.ann) if dense else None
+    )
+    store.build_index(documents)
+
+    searches = {}
+    if 'tfidf' in args.backends:
+        searches['tfidf'] = lambda query, k: store.inverted_index.search(*store.query_encoder.encode(query), k)[0]
+    if dense:
+        searches['dense_ann'] = lambda query, k: store.dense_index.search(query, k)[0]
+        searches['dense_exact'] = lambda query, k: store.dense_index.search(query, k, exact=True)[0]
+
+    report = {
+        'documents': len(documents),
+        'k': args.k,
+        'backends': list(searches),
+        'known_item': compare(searches, make_queries(documents, args.sample), documents, args.k, is_known_item),
+        'gold': compare(searches, gold_queries(args.gold), documents, args.k, is_relevant),
+    }
+    if dense:
+        report.update(model=args.model, storage=args.storage,
+                      ann=args.ann if store.dense_index.ann_index is not None else 'flat',
+                      memory_bytes=store.dense_index.memory_bytes())
+
+    print(f"\n{report['documents']} fragmentos")
+    print_report("Elemento conocido (frase literal del fragmento)", report['known_item'], args.k)
+    print_report("Referencia (preguntas parafraseadas)", report['gold'], args.k)
+    if 'memory_bytes' in report:
+        memory = report['memory_bytes']
+        print(f"\nMemoria densa: vectores {memory['vectors'] / 2**20:.1f} MiB ({report['storage']}), "
+              f"índice {report['ann']} {memory['ann'] / 2**20:.1f} MiB")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
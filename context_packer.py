@@ -0,0 +1,151 @@
+from typing import Dict, List, Optional
+import math
+import os
+import re
+
+# Palabras y signos sueltos; los tokenizadores BPE parten las palabras largas en trozos
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+# Caracteres por trozo de palabra en español, aproximado para los modelos Llama
+CHARS_PER_PIECE = 4
+# Solapamiento mínimo (caracteres) para fusionar dos fragmentos contiguos sin duplicar texto
+MIN_OVERLAP = 20
+# Frases más cortas no se deduplican: fórmulas como "Artículo 5." se repiten legítimamente
+MIN_SENTENCE_CHARS = 40
+SENTENCE_SPLIT = re.compile(r'(?<=[.;:])\s+|\n+')
+CONTINUATION_HEADING = re.compile(r'^[^\n]*\(cont\.\)\n')
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación local del número de tokens, sin cargar el tokenizador del modelo"""
+    return sum(max(1, math.ceil(len(piece) / CHARS_PER_PIECE)) for piece in TOKEN_PATTERN.findall(text))
+
+
+def merge_overlapping(first: str, second: str, max_overlap: int = 400) -> Optional[str]:
+    """Une dos textos si el final del primero coincide con el principio del segundo"""
+    second = CONTINUATION_HEADING.sub('', second, count=1)
+    for length in range(min(len(first), len(second), max_overlap), MIN_OVERLAP - 1, -1):
+        if first.endswith(second[:length]):
+            return first + second[length:]
+    return None
+
+
+class ContextPacker:
+    """Empaqueta los fragmentos recuperados en un presupuesto de tokens sin texto repetido"""
+
+    def __init__(self, max_tokens: Optional[int] = None, min_block_tokens: int = 40):
+        self.max_tokens = max_tokens or int(os.environ.get("RAG_CONTEXT_TOKENS", "2500"))
+        # Un bloque que no cabe solo se recorta si queda al menos este hueco
+        self.min_block_tokens = min_block_tokens
+
+    def pack(self, docs: List[Dict]) -> Dict:
+        """Devuelve los bloques de contexto y cuántos tokens se han ahorrado
+
+        Los docs llegan ordenados por relevancia. Se eliminan los textos
+        idénticos, se fusionan los fragmentos contiguos del mismo archivo
+        que se solapan, se quitan las frases ya incluidas y se llenan los
+        bloques por orden de relevancia hasta agotar el presupuesto.
+
+        Ninguna fuente desaparece en silencio: las de bloques cuyo texto ya
+        está en otro siguen en 'sources', y las que no caben en el presupuesto
+        se devuelven en 'dropped_sources' para poder citarlas igualmente.
+        """
+        original_tokens = sum(estimate_tokens(doc['text']) for doc in docs)
+        blocks = self._merge_blocks(self._dedupe_texts(docs))
+        blocks.sort(key=lambda block: block['rank'])
+
+        packed, seen_sentences, used, covered, dropped = [], set(), 0, [], []
+        for block in blocks:
+            text = self._drop_seen_sentences(block['text'], seen_sentences)
+            if not text:
+                # Todas sus frases están ya en bloques anteriores: su fuente sigue citada
+                covered.extend(block['sources'])
+                continue
+            tokens = estimate_tokens(text)
+            remaining = self.max_tokens - used
+            if tokens > remaining:
+                if remaining < self.min_block_tokens and packed:
+                    dropped.extend(block['sources'])
+                    continue
+                # Se reservan dos tokens para la marca de recorte
+                text = self._truncate(text, remaining - 2)
+                tokens = estimate_tokens(text)
+            packed.append({'sources': block['sources'], 'text': text, 'tokens': tokens})
+            used += tokens
+
+        sources = [source for block in packed for source in block['sources']] + covered
+        return {
+            'blocks': packed,
+            'sources': list(dict.fromkeys(sources)),
+            'tokens': used,
+            'original_tokens': original_tokens,
+            'saved_tokens': max(0, original_tokens - used),
+            'dropped_sources': [source for source in dict.fromkeys(dropped) if source not in sources],
+        }
+
+    @staticmethod
+    def _dedupe_texts(docs: List[Dict]) -> List[Dict]:
+        """Fusiona los fragmentos con el mismo texto (p. ej. el mismo PDF dos veces)"""
+        by_text: Dict[str, Dict] = {}
+        for rank, doc in enumerate(docs):
+            key = re.sub(r'\s+', ' ', doc['text']).strip()
+            entry = by_text.get(key)
+            if entry is None:
+                by_text[key] = {
+                    'text': doc['text'], 'rank': rank, 'sources': [doc['source']],
+                    'filename': doc.get('filename'), 'chunk_id': doc.get('chunk_id'),
+                }
+            elif doc['source'] not in entry['sources']:
+                entry['sources'].append(doc['source'])
+        return list(by_text.values())
+
+    @staticmethod
+    def _merge_blocks(entries: List[Dict]) -> List[Dict]:
+        """Une los fragmentos consecutivos del mismo archivo cuyo texto se solapa"""
+        ordered = sorted(entries, key=lambda e: (e['filename'] is None, e['filename'] or '', e['chunk_id'] or 0))
+        blocks: List[Dict] = []
+        for entry in ordered:
+            last = blocks[-1] if blocks else None
+            if (last is not None and entry['filename'] is not None and last['filename'] == entry['filename']
+                    and last['chunk_id'] is not None and entry['chunk_id'] == last['chunk_id'] + 1):
+                merged = merge_overlapping(last['text'], entry['text'])
+                if merged is not None:
+                    last['text'] = merged
+                    last['chunk_id'] = entry['chunk_id']
+                    last['rank'] = min(last['rank'], entry['rank'])
+                    last['sources'].extend(s for s in entry['sources'] if s not in last['sources'])
+                    continue
+            blocks.append(dict(entry, sources=list(entry['sources'])))
+        return blocks
+
+    @staticmethod
+    def _drop_seen_sentences(text: str, seen: set) -> str:
+        """Quita las frases largas que ya aparecen en un bloque anterior"""
+        kept, dropped = [], False
+        for sentence in SENTENCE_SPLIT.split(text):
+            key = re.sub(r'\s+', ' ', sentence).strip().lower()
+            if len(key) >= MIN_SENTENCE_CHARS:
+                if key in seen:
+                    dropped = True
+                    continue
+                seen.add(key)
+            kept.append(sentence.strip())
+        # Sin frases repetidas se conserva el texto con su formato original
+        return " ".join(s for s in kept if s) if dropped else text
+
+    @staticmethod
+    def _truncate(text: str, max_tokens: int) -> str:
+        """Recorta el texto al presupuesto, en un final de frase si es posible"""
+        pieces = list(TOKEN_PATTERN.finditer(text))
+        used, end = 0, len(text)
+        for match in pieces:
+            used += max(1, math.ceil(len(match.group(0)) / CHARS_PER_PIECE))
+            if used > max_tokens:
+                end = match.start()
+                break
+        truncated = text[:end]
+        if end == len(text):
+            return text
+        sentence_end = max(truncated.rfind('. '), truncated.rfind('.\n'))
+        if sentence_end > len(truncated) // 2:
+            truncated = truncated[:sentence_end + 1]
+        return truncated.rstrip() + " […]"
@@ -0,0 +1,198 @@
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+import os
+import threading
+
+from article_index import ArticleIndex
+from context_packer import ContextPacker, estimate_tokens
+from metrics import inc, span
+
+logger = logging.getLogger(__name__)
+
+Vector = Dict[int, float]
+# Campos que dependen de la pregunta y no se guardan con el fragmento
+TRANSIENT_FIELDS = ('similarity_score', 'rank', 'reused', 'snippet', 'snippet_start', 'highlights')
+
+
+class ConversationContext:
+    """Conjunto de trabajo de una conversación: fragmentos recientes e historial compactado
+
+    Guarda los fragmentos recuperados en los últimos turnos (con su vector
+    TF-IDF) en un LRU acotado. Una pregunta de seguimiento cuyos términos ya
+    cubren esos fragmentos se responde con ellos, sin volver a buscar; si no,
+    se busca y se fusionan los resultados nuevos con los del conjunto de
+    trabajo que sigan siendo relevantes. Las preguntas que citan artículos
+    siempre se buscan: el codificador no ve los números ("artículo 58" y
+    "artículo 57" se codifican igual) y la consulta directa es exacta. El historial de turnos se resume en
+    un presupuesto de tokens para que el prompt no crezca con la sesión.
+    """
+
+    def __init__(self, max_chunks: int = 12, max_turns: int = 6, history_tokens: Optional[int] = None,
+                 reuse_coverage: float = 0.75, min_topic_similarity: float = 0.2):
+        self.max_chunks = max_chunks
+        self.max_turns = max_turns
+        self.history_tokens = history_tokens or int(os.environ.get("RAG_HISTORY_TOKENS", "400"))
+        # Fracción (ponderada por idf) de la consulta que debe aparecer en el conjunto para reutilizarlo
+        self.reuse_coverage = reuse_coverage
+        # Similitud mínima con la pregunta anterior para tratar la nueva como seguimiento
+        self.min_topic_similarity = min_topic_similarity
+        self._chunks: "OrderedDict[Tuple[str, int], Dict]" = OrderedDict()
+        self._turns: List[Tuple[str, str]] = []
+        self._last_question: Optional[str] = None
+        self._index_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def clear(self):
+        with self._lock:
+            self._chunks.clear()
+            self._turns.clear()
+            self._last_question = None
+
+    @staticmethod
+    def _cosine(query: Vector, vector: Vector) -> float:
+        return sum(weight * vector.get(column, 0.0) for column, weight in query.items())
+
+    @staticmethod
+    def _encode(encoder, text: str) -> Vector:
+        columns, weights = encoder.encode(text)
+        return dict(zip(columns.tolist(), weights.tolist()))
+
+    def _query(self, question: str, encoder, queries: Dict[int, Vector]) -> Vector:
+        """Vector de la pregunta con ese codificador (uno por shard), calculado una sola vez"""
+        if id(encoder) not in queries:
+            queries[id(encoder)] = self._encode(encoder, question)
+        return queries[id(encoder)]
+
+    def _vector(self, doc: Dict, encoder_for: Callable) -> Vector:
+        """Vector TF-IDF del fragmento: el guardado en el conjunto o uno nuevo"""
+        entry = self._chunks.get((doc['filename'], doc['chunk_id']))
+        if entry is not None:
+            return entry['vector']
+        return self._encode(encoder_for(doc['filename']), doc['text'])
+
+    def _topic_similarity(self, question: str, entries: List[Dict], encoder_for: Callable) -> float:
+        """Similitud con la pregunta anterior, con el codificador del fragmento más reciente"""
+        if self._last_question is None or not entries:
+            return 0.0
+        encoder = encoder_for(entries[-1]['doc']['filename'])
+        return self._cosine(self._encode(encoder, question), self._encode(encoder, self._last_question))
+
+    def _score(self, question: str, entries: List[Dict], encoder_for: Callable,
+               queries: Dict[int, Vector]) -> Tuple[List[Tuple[float, Dict]], float]:
+        """Similitud de cada fragmento con la pregunta y cobertura de la pregunta"""
+        scored, coverage = [], 0.0
+        by_encoder: Dict[int, List[Dict]] = {}
+        for entry in entries:
+            encoder = encoder_for(entry['doc']['filename'])
+            self._query(question, encoder, queries)
+            by_encoder.setdefault(id(encoder), []).append(entry)
+        for key, entries in by_encoder.items():
+            query = queries[key]
+            seen_columns = set()
+            for entry in entries:
+                scored.append((self._cosine(query, entry['vector']), entry))
+                seen_columns.update(entry['vector'])
+            # Los pesos de la consulta están normalizados (L2): la suma de cuadrados es 1
+            coverage = max(coverage, sum(weight * weight for column, weight in query.items()
+                                         if column in seen_columns))
+        return scored, coverage
+
+    def retrieve(self, question: str, k: int, search: Callable[[str, int], List[Dict]],
+                 encoder_for: Callable, index_version: str,
+                 add_snippets: Optional[Callable[[str, List[Dict]], None]] = None,
+                 filenames: Optional[List[str]] = None) -> List[Dict]:
+        """Fragmentos del conjunto de trabajo, de una búsqueda o de ambos (solo de `filenames`, si se filtra)"""
+        with self._lock:
+            if index_version != self._index_version:
+                # Otro índice: los vectores guardados ya no son comparables
+                self._chunks.clear()
+                self._index_version = index_version
+
+            allowed = set(filenames) if filenames else None
+            entries = [entry for entry in self._chunks.values()
+                       if allowed is None or entry['doc']['filename'] in allowed]
+            queries: Dict[int, Vector] = {}
+            vectors: Dict[Tuple[str, int], Vector] = {}
+            with span("conversation_reuse"):
+                scored, coverage = self._score(question, entries, encoder_for, queries) if entries else ([], 0.0)
+                topic = self._topic_similarity(question, entries, encoder_for)
+            relevant = sorted((item for item in scored if item[0] > 0), key=lambda item: -item[0])
+            self._last_question = question
+
+            if ArticleIndex.parse_references(question):
+                # Referencia explícita: se resuelve con el índice de artículos, sin el conjunto de trabajo
+                inc("rag_conversation_retrievals_total", result="fresh")
+                docs = search(question, k)
+            # Seguimiento: mismo tema que la pregunta anterior y términos ya cubiertos por el conjunto
+            elif len(relevant) >= k and coverage >= self.reuse_coverage and topic >= self.min_topic_similarity:
+                inc("rag_conversation_retrievals_total", result="reused")
+                logger.debug("♻️ Seguimiento resuelto con el conjunto de trabajo (cobertura %.2f, tema %.2f)",
+                             coverage, topic)
+                docs = [dict(entry['doc'], similarity_score=score, reused=True)
+                        for score, entry in relevant[:k]]
+            else:
+                inc("rag_conversation_retrievals_total", result="merged" if relevant else "fresh")
+                fresh = search(question, k)
+                fresh_keys = {(doc['filename'], doc['chunk_id']) for doc in fresh}
+                reused = [dict(entry['doc'], similarity_score=score, reused=True)
+                          for score, entry in relevant
+                          if (entry['doc']['filename'], entry['doc']['chunk_id']) not in fresh_keys]
+                if reused:
+                    # La búsqueda puntúa en otra escala (calibrada por shard, consulta directa o
+                    # híbrida): para fusionar, los nuevos se puntúan como los del conjunto
+                    for doc in fresh:
+                        vectors[(doc['filename'], doc['chunk_id'])] = self._vector(doc, encoder_for)
+                    fresh = [dict(doc, similarity_score=self._cosine(
+                        self._query(question, encoder_for(doc['filename']), queries),
+                        vectors[(doc['filename'], doc['chunk_id'])])) for doc in fresh]
+                docs = sorted(fresh + reused, key=lambda doc: -doc.get('similarity_score', 0.0))[:k]
+
+            for rank, doc in enumerate(docs, start=1):
+                doc['rank'] = rank
+            if add_snippets is not None:
+                # Los fragmentos reutilizados no guardan pasaje: dependía de la pregunta anterior
+                add_snippets(question, [doc for doc in docs if doc.get('reused')])
+            self._remember(docs, encoder_for, vectors)
+            return docs
+
+    def _remember(self, docs: List[Dict], encoder_for: Callable, vectors: Dict[Tuple[str, int], Vector]):
+        """Añade o refresca los fragmentos en el LRU y desaloja los menos recientes"""
+        for doc in docs:
+            key = (doc['filename'], doc['chunk_id'])
+            entry = self._chunks.pop(key, None)
+            if entry is None:
+                vector = vectors.get(key)
+                if vector is None:
+                    vector = self._encode(encoder_for(doc['filename']), doc['text'])
+                entry = {'vector': vector}
+            entry['doc'] = {field: value for field, value in doc.items() if field not in TRANSIENT_FIELDS}
+            self._chunks[key] = entry
+        while len(self._chunks) > self.max_chunks:
+            self._chunks.popitem(last=False)
+
+    def add_turn(self, question: str, answer: str):
+        with self._lock:
+            self._turns.append((question, answer))
+            del self._turns[:-self.max_turns]
+
+    def history(self) -> str:
+        """Turnos anteriores resumidos, del más reciente hacia atrás, dentro del presupuesto"""
+        with self._lock:
+            turns = list(self._turns)
+        lines, used = [], 0
+        for question, answer in reversed(turns):
+            remaining = self.history_tokens - used
+            question_tokens = estimate_tokens(question)
+            if remaining <= question_tokens + 10:
+                break
+            # La pregunta se conserva entera; la respuesta se recorta a lo que quepa
+            # (unos tokens de margen para las etiquetas y la marca de recorte)
+            answer = ContextPacker._truncate(answer, min(remaining - question_tokens - 6, self.history_tokens // 2))
+            turn = f"P: {question}\nR: {answer}"
+            lines.append(turn)
+            used += estimate_tokens(turn)
+        return "\n\n".join(reversed(lines))
@@ -0,0 +1,210 @@
+import numpy as np
+from typing import List, Optional, Tuple
+import json
+import logging
+import os
+
+from lazy_imports import optional_import
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+
+class DenseIndex:
+    """Embeddings densos de los fragmentos con búsqueda aproximada (HNSW/IVF) o exacta"""
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, storage: str = "float16",
+                 ann: str = "hnsw", batch_size: int = 64, hnsw_m: int = 32,
+                 ef_search: int = 64, ivf_nlist: int = 0, ivf_nprobe: int = 8):
+        if storage not in ("float16", "int8"):
+            raise ValueError(f"Almacenamiento no soportado: {storage}")
+        if ann not in ("hnsw", "ivf", "flat"):
+            raise ValueError(f"Índice aproximado no soportado: {ann}")
+        self.model_name = model_name
+        self.storage = storage
+        self.ann = ann
+        self.batch_size = batch_size
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.ivf_nlist = ivf_nlist
+        self.ivf_nprobe = ivf_nprobe
+        self._model = None
+        # Vectores cuantizados (float16 o int8) y escala por dimensión para int8
+        self.vectors = None
+        self.scales = None
+        self.ann_index = None
+
+    @property
+    def model(self):
+        # sentence-transformers (y torch) solo se importan si se usa el backend denso
+        sentence_transformers = optional_import("sentence_transformers")
+        if sentence_transformers is None:
+            raise ImportError("sentence-transformers no está disponible. Instálelo para usar el backend denso.")
+        if self._model is None:
+            self._model = sentence_transformers.SentenceTransformer(self.model_name, device="cpu")
+        return self._model
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Calcula embeddings normalizados (L2) por lotes en CPU"""
+        return np.asarray(self.model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True,
+            convert_to_numpy=True, show_progress_bar=False
+        ), dtype=np.float32)
+
+    def build(self, texts: List[str], cached_vectors: Optional[List[Optional[np.ndarray]]] = None):
+        """Indexa los textos; `cached_vectors[i]` permite reutilizar el embedding ya calculado"""
+        cached_vectors = cached_vectors or [None] * len(texts)
+        pending = [i for i, vector in enumerate(cached_vectors) if vector is None]
+        logger.info("🧠 Calculando embeddings de %s fragmentos (%s reutilizados)", len(pending), len(texts) - len(pending))
+
+        encoded = self.encode([texts[i] for i in pending]) if pending else None
+        dimension = encoded.shape[1] if encoded is not None else len(next(v for v in cached_vectors if v is not None))
+        vectors = np.zeros((len(texts), dimension), dtype=np.float32)
+        for i, vector in enumerate(cached_vectors):
+            if vector is not None:
+                vectors[i] = vector
+        if pending:
+            vectors[pending] = encoded
+
+        self._store(vectors)
+        self._build_ann(vectors)
+
+    def _store(self, vectors: np.ndarray):
+        """Guarda los vectores en float16 o int8 con escala simétrica por dimensión"""
+        if self.storage == "float16":
+            self.vectors = vectors.astype(np.float16)
+            self.scales = None
+        else:
+            scales = np.abs(vectors).max(axis=0) / 127.0
+            scales[scales == 0] = 1.0
+            self.vectors = np.round(vectors / scales).astype(np.int8)
+            self.scales = scales.astype(np.float32)
+
+    def vectors_float32(self, rows=slice(None)) -> np.ndarray:
+        """Devuelve los vectores (o las filas indicadas) descuantizados a float32"""
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            vectors *= self.scales
+        return vectors
+
+    def _build_ann(self, vectors: np.ndarray):
+        """Construye el índice aproximado si faiss está disponible"""
+        self.ann_index = None
+        faiss = optional_import("faiss") if self.ann != "flat" else None
+        if faiss is None:
+            if self.ann != "flat":
+                logger.warning("⚠️ faiss no está instalado: se usará búsqueda exacta")
+            return
+
+        dimension = vectors.shape[1]
+        if self.ann == "hnsw":
+            # Grafo sobre vectores de 8 bits: el índice residente no vuelve a ocupar lo de float32
+            index = faiss.IndexHNSWSQ(dimension, faiss.ScalarQuantizer.QT_8bit, self.hnsw_m,
+                                      faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.hnsw.efSearch = self.ef_search
+        else:
+            nlist = self.ivf_nlist or max(1, int(np.sqrt(len(vectors))))
+            quantizer = faiss.IndexFlatIP(dimension)
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, dimension, nlist, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
+            index.train(vectors)
+            index.nprobe = self.ivf_nprobe
+        index.add(vectors)
+        self.ann_index = index
+
+    def memory_bytes(self) -> dict:
+        """Bytes que ocupan los vectores cuantizados (con sus escalas) y el índice ANN"""
+        vectors = 0 if self.vectors is None else self.vectors.nbytes
+        if self.scales is not None:
+            vectors += self.scales.nbytes
+        ann = 0
+        if self.ann_index is not None:
+            ann = int(optional_import("faiss").serialize_index(self.ann_index).nbytes)
+        return {'vectors': vectors, 'ann': ann}
+
+    def search(self, query: str, k: int, exact: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Busca los k fragmentos más similares a la consulta"""
+        ids, scores = self.search_vectors(self.encode([query]), k, exact=exact)
+        return ids[0], scores[0]
+
+    def search_batch(self, queries: List[str], k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Codifica todas las consultas en un lote y las busca a la vez"""
+        ids, scores = self.search_vectors(self.encode(queries), k)
+        return list(zip(ids, scores))
+
+    def search_vectors(self, query_vectors: np.ndarray, k: int,
+                       exact: bool = False) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """Búsqueda aproximada con el índice ANN o exacta (plana) como alternativa"""
+        if self.vectors is None or len(self.vectors) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return [empty] * len(query_vectors), [np.zeros(0)] * len(query_vectors)
+        k = min(k, len(self.vectors))
+
+        if self.ann_index is not None and not exact:
+            scores, ids = self.ann_index.search(np.ascontiguousarray(query_vectors, dtype=np.float32), k)
+            valid = ids >= 0
+            return ([row_ids[row_valid] for row_ids, row_valid in zip(ids, valid)],
+                    [row_scores[row_valid] for row_scores, row_valid in zip(scores, valid)])
+        return self._search_flat(query_vectors, k)
+
+    def _search_flat(self, query_vectors: np.ndarray, k: int, block_size: int = 65536):
+        """Búsqueda exacta por producto escalar, recorriendo los vectores por bloques"""
+        all_scores = np.empty((len(query_vectors), len(self.vectors)), dtype=np.float32)
+        for start in range(0, len(self.vectors), block_size):
+            block = self.vectors_float32(slice(start, start + block_size))
+            all_scores[:, start:start + len(block)] = query_vectors @ block.T
+
+        ids, scores = [], []
+        for row in all_scores:
+            top = np.argpartition(-row, k - 1)[:k] if k < len(row) else np.arange(len(row))
+            top = top[np.argsort(-row[top], kind='stable')]
+            ids.append(top.astype(np.int64))
+            scores.append(row[top])
+        return ids, scores
+
+    def save(self, dirpath: str):
+        """Guarda vectores cuantizados, escalas, configuración e índice ANN"""
+        os.makedirs(dirpath, exist_ok=True)
+        np.save(os.path.join(dirpath, "vectors.npy"), self.vectors)
+        if self.scales is not None:
+            np.save(os.path.join(dirpath, "scales.npy"), self.scales)
+        if self.ann_index is not None:
+            optional_import("faiss").write_index(self.ann_index, os.path.join(dirpath, "ann.faiss"))
+        with open(os.path.join(dirpath, "dense.json"), 'w', encoding='utf-8') as f:
+            json.dump({
+                'model_name': self.model_name,
+                'storage': self.storage,
+                'ann': self.ann,
+            }, f)
+
+    def load(self, dirpath: str) -> bool:
+        """Carga el índice denso; devuelve False si no existe o no coincide la configuración"""
+        config_path = os.path.join(dirpath, "dense.json")
+        if not os.path.exists(config_path):
+            return False
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        if config.get('model_name') != self.model_name or config.get('storage') != self.storage:
+            logger.warning("⚠️ El índice denso se creó con otra configuración, se reconstruirá")
+            return False
+
+        self.vectors = np.load(os.path.join(dirpath, "vectors.npy"), mmap_mode='r')
+        scales_path = os.path.join(dirpath, "scales.npy")
+        self.scales = np.load(scales_path) if os.path.exists(scales_path) else None
+
+        self.ann_index = None
+        ann_path = os.path.join(dirpath, "ann.faiss")
+        faiss = optional_import("faiss") if self.ann != "flat" else None
+        if faiss is not None:
+            if config.get('ann') == self.ann and os.path.exists(ann_path):
+                self.ann_index = faiss.read_index(ann_path)
+                if self.ann == "hnsw":
+                    self.ann_index.hnsw.efSearch = self.ef_search
+                else:
+                    self.ann_index.nprobe = self.ivf_nprobe
+            else:
+                self._build_ann(self.vectors_float32())
+        return True
@@ -1,32 +1,206 @@
-try:
-    import fitz  # PyMuPDF
-except ImportError:
-    print("❌ PyMuPDF no está instalado. Instálelo con: pip install PyMuPDF")
-    fitz = None
-
+import hashlib
+import logging
 import os
-from typing import List, Dict
+import pickle
+import tempfile
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import re
 
+from lazy_imports import optional_import
+from metrics import inc, span
+
+logger = logging.getLogger(__name__)
+
+# Encabezados de la estructura de una ley española (en línea propia, con mayúscula inicial)
+HIERARCHY_PATTERNS = [
+    ('libro', re.compile(r'^LIBRO\b')),
+    ('titulo', re.compile(r'^T[ÍI]TULO\b')),
+    ('capitulo', re.compile(r'^CAP[ÍI]TULO\b')),
+    ('seccion', re.compile(r'^SECCI[ÓO]N\b', re.IGNORECASE)),
+]
+HIERARCHY_LEVELS = [level for level, _ in HIERARCHY_PATTERNS]
+ARTICLE_PATTERN = re.compile(
+    r'^Art[íi]culo\s+(\d+(?:\s+(?:bis|ter|quater|quinquies|sexies|septies))?)\s*(?:\.|$|\s+[A-ZÁÉÍÓÚÑ])'
+)
+PROVISION_PATTERN = re.compile(
+    r'^Disposici[óo]n\s+(adicional|transitoria|derogatoria|final)(\s+[a-záéíóúñ]+)?\b', re.IGNORECASE
+)
+# Líneas del índice con puntos de relleno ("Artículo 1. Delimitación . . . . .")
+TOC_LEADER_PATTERN = re.compile(r'(\s?\.){5,}')
+# Artículos cerrados (o fragmentos de un PDF en streaming) que se retienen en memoria antes de pasar a un archivo temporal
+UNIT_SPOOL_BYTES = 4 * 1024 * 1024
+
+
+def _fitz():
+    """PyMuPDF, importado solo cuando hay que leer un PDF (no al cargar un índice ya creado)"""
+    fitz = optional_import("fitz")
+    if fitz is None:
+        raise ImportError("PyMuPDF no está disponible. Instálelo con: pip install PyMuPDF")
+    return fitz
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> List[str]:
+    """Extrae el texto de las páginas [start, end) de un PDF (ejecutable en otro proceso)"""
+    doc = _fitz().open(pdf_path)
+    try:
+        return [doc[i].get_text() for i in range(start, min(end, doc.page_count))]
+    finally:
+        doc.close()
+
+
+def format_source(filename: str, chunk_id: int, page: int, articulo: Optional[str] = None,
+                  part: Optional[int] = None) -> str:
+    """Fuente legible de un fragmento, p. ej. ley.pdf (artículo 57, parte 2, pág. 31)"""
+    if articulo:
+        label = f"artículo {articulo}" if articulo[0].isdigit() else articulo
+        if part:
+            label = f"{label}, parte {part}"
+    else:
+        label = f"fragmento {chunk_id + 1}"
+    return f"{filename} ({label}, pág. {page})"
+
+
+class _WindowChunker:
+    """Ventanas con solapamiento sobre un texto que llega por páginas
+
+    Equivale a trocear de una vez las páginas unidas con saltos de línea, pero
+    solo retiene el texto desde el inicio de la ventana en curso: la memoria no
+    depende del tamaño del documento. Cada ventana sale en cuanto se conoce el
+    texto que necesita su punto de corte.
+    """
+
+    def __init__(self, chunk_size: int = 1000, overlap: int = 200):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self._text = ""  # texto desde la posición self._base
+        self._base = 0
+        self._start = 0
+        self._pages: List[Tuple[int, int]] = []  # (posición, página) desde la ventana en curso
+
+    @property
+    def _end(self) -> int:
+        return self._base + len(self._text)
+
+    def add(self, page_number: int, text: str) -> List[Tuple[int, str, int]]:
+        """Añade el texto de una página y devuelve las ventanas que ya pueden cerrarse"""
+        if not text:
+            return []
+        if self._end:
+            self._text += "\n"  # separador entre páginas
+        self._pages.append((self._end, page_number))
+        self._text += text
+        windows = []
+        # El corte de una ventana mira hasta dos caracteres más allá de su final
+        while self._end >= self._start + self.chunk_size + 2:
+            windows.extend(self._window())
+        return windows
+
+    def finish(self) -> List[Tuple[int, str, int]]:
+        """Ventanas restantes, con el final del texto ya conocido"""
+        if not self._end:
+            return []
+        if self._end <= self.chunk_size:
+            return [(0, self._text, self._pages[0][1])]
+        windows = []
+        while self._start < self._end:
+            windows.extend(self._window())
+        return windows
+
+    def _window(self) -> List[Tuple[int, str, int]]:
+        text, base, start, length = self._text, self._base, self._start, self._end
+        end = start + self.chunk_size
+        # Buscar hacia atrás un punto de corte natural (punto seguido de espacio o salto de línea)
+        if end < length:
+            for i in range(end, max(start + self.chunk_size // 2, end - 100), -1):
+                if text[i - base] in '.!?\n' and i + 1 < length and text[i + 1 - base] in ' \n':
+                    end = i + 1
+                    break
+        chunk = text[start - base:end - base].strip()
+        page = self._pages[bisect_right(self._pages, (start, float('inf'))) - 1][1]
+
+        self._start = end - self.overlap
+        if self._start < length:
+            # Descartar el texto y las páginas anteriores a la ventana siguiente
+            self._text = text[self._start - base:]
+            self._base = self._start
+            first = bisect_right(self._pages, (self._start, float('inf'))) - 1
+            del self._pages[:max(first, 0)]
+        return [(start, chunk, page)] if chunk else []
+
+
 class DocumentProcessor:
-    def __init__(self, ref_folder: str = "ref"):
+    def __init__(self, ref_folder: str = "ref", workers: int = None, pages_per_task: int = 16,
+                 chunking: str = None, max_article_chars: int = 3000):
         self.ref_folder = ref_folder
-    
-    def extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extrae texto de un archivo PDF"""
-        if fitz is None:
-            raise ImportError("PyMuPDF no está disponible. Instálelo para procesar PDFs.")
+        # "structural": un fragmento por artículo; "fixed": ventanas de 1000 caracteres
+        self.chunking = chunking or os.environ.get("RAG_CHUNKING", "structural")
+        if self.chunking not in ("structural", "fixed"):
+            raise ValueError(f"Modo de fragmentación no soportado: {self.chunking}")
+        self.max_article_chars = max_article_chars
+        # Número de procesos para la extracción; 1 = modo secuencial
+        if workers is None:
+            workers = int(os.environ.get("RAG_INGEST_WORKERS", "1"))
+        self.workers = max(1, workers)
+        self.pages_per_task = max(1, pages_per_task)
+
+    def list_pdf_files(self) -> List[str]:
+        """Lista los PDFs de la carpeta ref en orden determinista"""
+        if not os.path.exists(self.ref_folder):
+            return []
+        return sorted(f for f in os.listdir(self.ref_folder) if f.lower().endswith('.pdf'))
+
+    def file_fingerprint(self, filename: str) -> Dict:
+        """Calcula hash SHA-256, tamaño y fecha de modificación de un PDF"""
+        pdf_path = os.path.join(self.ref_folder, filename)
+        sha256 = hashlib.sha256()
+        with open(pdf_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha256.update(block)
+        stat = os.stat(pdf_path)
+        return {'sha256': sha256.hexdigest(), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def build_manifest(self, previous: Optional[Dict[str, Dict]] = None) -> Dict[str, Dict]:
+        """Construye el manifiesto de los PDFs actuales, reutilizando el hash si tamaño y fecha no cambian"""
+        previous = previous or {}
+        manifest = {}
+        for filename in self.list_pdf_files():
+            stat = os.stat(os.path.join(self.ref_folder, filename))
+            entry = previous.get(filename)
+            if entry and entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+                manifest[filename] = dict(entry)
+            else:
+                manifest[filename] = self.file_fingerprint(filename)
+            manifest[filename]['chunking'] = self.chunking
+        return manifest
+
+    @staticmethod
+    def diff_manifest(previous: Dict[str, Dict], current: Dict[str, Dict]) -> Tuple[List[str], List[str]]:
+        """Devuelve los PDFs nuevos o modificados y los eliminados entre dos manifiestos"""
+        changed = [f for f in sorted(current)
+                   if f not in previous
+                   or previous[f].get('sha256') != current[f]['sha256']
+                   or previous[f].get('chunking') != current[f].get('chunking')]
+        removed = [f for f in sorted(previous) if f not in current]
+        return changed, removed
+
+    def extract_pages_from_pdf(self, pdf_path: str) -> List[str]:
+        """Extrae el texto de cada página de un archivo PDF"""
+        fitz = _fitz()
 
         try:
             doc = fitz.open(pdf_path)
-            text = ""
-            for page in doc:
-                text += page.get_text()
+            pages = [page.get_text() for page in doc]
             doc.close()
-            return text
+            return pages
         except Exception as e:
-            print(f"Error procesando {pdf_path}: {e}")
-            return ""
+            logger.error("Error procesando %s: %s", pdf_path, e)
+            return []
+
+    def extract_text_from_pdf(self, pdf_path: str) -> str:
+        """Extrae texto de un archivo PDF"""
+        return "".join(self.extract_pages_from_pdf(pdf_path))
     
     def clean_text(self, text: str) -> str:
         """Limpia y normaliza el texto extraído"""
@@ -40,79 +214,286 @@ class DocumentProcessor:
     
     def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
         """Divide el texto en fragmentos con solapamiento"""
+        return [chunk for _, chunk in self.chunk_text_with_offsets(text, chunk_size, overlap)]
+
+    def chunk_text_with_offsets(self, text: str, chunk_size: int = 1000,
+                                overlap: int = 200) -> List[Tuple[int, str]]:
+        """Divide el texto en fragmentos con solapamiento, devolviendo su posición inicial"""
         if len(text) <= chunk_size:
-            return [text]
-        
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = start + chunk_size
-            
-            # Buscar un punto de corte natural (punto, salto de línea)
-            if end < len(text):
-                # Buscar hacia atrás por un punto seguido de espacio o salto de línea
-                for i in range(end, max(start + chunk_size // 2, end - 100), -1):
-                    if text[i] in '.!?\n' and i + 1 < len(text) and text[i + 1] in ' \n':
-                        end = i + 1
-                        break
-            
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            start = end - overlap
-            
-        return chunks
-    
-    def process_documents(self) -> List[Dict[str, str]]:
-        """Procesa todos los documentos PDF en la carpeta ref"""
-        print(f"📁 Procesando documentos en carpeta: {self.ref_folder}")
+            return [(0, text)]
+        chunker = _WindowChunker(chunk_size, overlap)
+        return [(start, chunk) for start, chunk, _ in chunker.add(1, text) + chunker.finish()]
+
+    def chunk_pages(self, pages: Iterable[str]) -> List[Tuple[str, int]]:
+        """Limpia y fragmenta las páginas de un documento conservando el número de página"""
+        return list(self.iter_page_chunks(pages))
+
+    def iter_page_chunks(self, pages: Iterable[str]) -> Iterator[Tuple[str, int]]:
+        """Como chunk_pages, pero página a página: solo retiene la ventana en curso"""
+        chunker = _WindowChunker()
+        for page_number, page_text in enumerate(pages, start=1):
+            for _, chunk, page in chunker.add(page_number, self.clean_text(page_text)):
+                yield chunk, page
+        for _, chunk, page in chunker.finish():
+            yield chunk, page
+
+    def chunk_structured(self, pages: Iterable[str]) -> List[Dict]:
+        """Fragmenta por la estructura de la ley: un fragmento por artículo o disposición"""
+        return list(self.iter_structured(pages))
+
+    def iter_structured(self, pages: Iterable[str]) -> Iterator[Dict]:
+        """Fragmenta por la estructura de la ley sin retener el documento entero
+
+        Cada fragmento lleva su jerarquía (libro, título, capítulo, sección) y el
+        número de artículo. Solo se dividen los artículos que superan
+        max_article_chars; el texto que no pertenece a ningún artículo
+        (preámbulo) se fragmenta por ventanas fijas según se lee. Cada artículo
+        se vuelca a un archivo temporal al cerrarse: los repetidos solo se
+        descartan al final, cuando se conocen todas sus apariciones.
+        """
+        hierarchy = {level: "" for level in HIERARCHY_LEVELS}
+        sizes: List[Tuple[str, int]] = []  # (artículo, tamaño) de cada artículo volcado
+        current = None  # {'articulo', 'heading', 'lines', 'page', jerarquía...}
+        preamble = _WindowChunker()
+        preamble_page, preamble_lines = 0, []
+        pending_level = None
+        pending_lines = 0
+
+        with tempfile.SpooledTemporaryFile(max_size=UNIT_SPOOL_BYTES) as units:
+            def flush():
+                # Las entradas del índice partidas en varias líneas no tienen cuerpo real
+                if current and len(re.sub(r'[\d\s.]', '', " ".join(current['lines'][1:]))) >= 40:
+                    sizes.append((current['articulo'], sum(len(line) for line in current['lines'])))
+                    pickle.dump(current, units, protocol=pickle.HIGHEST_PROTOCOL)
+
+            for page_number, page_text in enumerate(pages, start=1):
+                for line in self.clean_text(page_text).split('\n'):
+                    stripped = line.strip()
+                    if not stripped or TOC_LEADER_PATTERN.search(stripped):
+                        continue
+
+                    level = next((name for name, pattern in HIERARCHY_PATTERNS if pattern.match(stripped)), None)
+                    if level is not None:
+                        flush()
+                        current = None
+                        hierarchy[level] = stripped
+                        # Un nivel nuevo anula los niveles inferiores
+                        for lower in HIERARCHY_LEVELS[HIERARCHY_LEVELS.index(level) + 1:]:
+                            hierarchy[lower] = ""
+                        pending_level = level
+                        pending_lines = 0
+                        continue
+
+                    article = ARTICLE_PATTERN.match(stripped)
+                    provision = PROVISION_PATTERN.match(stripped) if not article else None
+                    if article or provision:
+                        flush()
+                        pending_level = None
+                        if article:
+                            articulo = re.sub(r'\s+', ' ', article.group(1)).lower()
+                        else:
+                            articulo = re.sub(r'\s+', ' ', provision.group(0)).strip().capitalize()
+                        current = dict(hierarchy, articulo=articulo, heading=stripped,
+                                       lines=[stripped], page=page_number)
+                        continue
+
+                    if current is not None:
+                        current['lines'].append(stripped)
+                    elif pending_level is not None and pending_lines < 2:
+                        # Rótulo del nivel en la línea siguiente: "TITULO PRIMERO" / "PRELIMINARES"
+                        if not stripped.isdigit():
+                            hierarchy[pending_level] = f"{hierarchy[pending_level]} {stripped}"
+                        pending_lines += 1
+                    else:
+                        if page_number != preamble_page:
+                            yield from self._preamble_chunks(
+                                preamble.add(preamble_page, self.clean_text("\n".join(preamble_lines))))
+                            preamble_page, preamble_lines = page_number, []
+                        preamble_lines.append(stripped)
+            flush()
+            yield from self._preamble_chunks(preamble.add(preamble_page, self.clean_text("\n".join(preamble_lines))))
+            yield from self._preamble_chunks(preamble.finish())
+
+            # Cada artículo aparece una vez por ley: si se repite (entradas del índice
+            # sin puntos de relleno), se conserva la aparición con más texto
+            longest = {}
+            for position, (articulo, size) in enumerate(sizes):
+                if articulo not in longest or size > longest[articulo][1]:
+                    longest[articulo] = (position, size)
+            keep = {position for position, _ in longest.values()}
+
+            units.seek(0)
+            for position in range(len(sizes)):
+                unit = pickle.load(units)
+                if position in keep:
+                    yield from self._unit_chunks(unit)
+
+    @staticmethod
+    def _preamble_chunks(windows: List[Tuple[int, str, int]]) -> List[Dict]:
+        empty = {level: "" for level in HIERARCHY_LEVELS}
+        return [dict(text=chunk, page=page, articulo="", heading="", **empty) for _, chunk, page in windows]
+
+    def _unit_chunks(self, unit: Dict) -> List[Dict]:
+        """Fragmentos de un artículo: uno solo o, si es demasiado largo, ventanas con el encabezado repetido"""
+        text = "\n".join(unit.pop('lines'))
+        if len(text) <= self.max_article_chars:
+            return [dict(unit, text=text)]
+        parts = self.chunk_text(text, chunk_size=self.max_article_chars, overlap=200)
+        return [dict(unit, text=part if part_number == 1 else f"{unit['heading']} (cont.)\n{part}", part=part_number)
+                for part_number, part in enumerate(parts, start=1)]
+
+    def _page_count(self, pdf_path: str) -> int:
+        """Devuelve el número de páginas de un PDF"""
+        doc = _fitz().open(pdf_path)
+        try:
+            return doc.page_count
+        finally:
+            doc.close()
+
+    def extract_pages_parallel(self, pdf_files: List[str]) -> Dict[str, List[str]]:
+        """Extrae las páginas de varios PDFs a la vez usando un pool de procesos"""
+        _fitz()
+
+        # Repartir cada PDF en rangos de páginas independientes
+        tasks = []
+        for filename in pdf_files:
+            pdf_path = os.path.join(self.ref_folder, filename)
+            try:
+                page_count = self._page_count(pdf_path)
+            except Exception as e:
+                logger.error("Error procesando %s: %s", pdf_path, e)
+                continue
+            for start in range(0, page_count, self.pages_per_task):
+                tasks.append((filename, pdf_path, start, start + self.pages_per_task))
+
+        logger.info("⚙️ Extrayendo %s bloques de páginas con %s procesos", len(tasks), self.workers)
+        pages_by_file = {filename: [] for filename in pdf_files}
+        failed = set()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(_extract_page_range, pdf_path, start, end)
+                       for _, pdf_path, start, end in tasks]
+            # Recoger en el orden de envío para mantener el orden de las páginas
+            for (filename, pdf_path, _, _), future in zip(tasks, futures):
+                try:
+                    pages_by_file[filename].extend(future.result())
+                except Exception as e:
+                    logger.error("Error procesando %s: %s", pdf_path, e)
+                    failed.add(filename)
+
+        for filename in failed:
+            pages_by_file[filename] = []
+        return pages_by_file
+
+    def _extract_all_pages(self, pdf_files: List[str]) -> Dict[str, List[str]]:
+        """Extrae las páginas de todos los PDFs en modo secuencial o paralelo"""
+        if self.workers > 1 and len(pdf_files) > 0:
+            return self.extract_pages_parallel(pdf_files)
+        return {
+            filename: self.extract_pages_from_pdf(os.path.join(self.ref_folder, filename))
+            for filename in pdf_files
+        }
+
+    def chunk_document(self, pages: Iterable[str]) -> List[Dict]:
+        """Fragmenta las páginas de un documento según el modo configurado"""
+        return list(self.iter_chunks(pages))
+
+    def iter_chunks(self, pages: Iterable[str]) -> Iterator[Dict]:
+        """Fragmenta las páginas según el modo configurado, sin retener el documento entero"""
+        if self.chunking == "structural":
+            return self.iter_structured(pages)
+        return ({'text': chunk, 'page': page} for chunk, page in self.iter_page_chunks(pages))
+
+    def _make_documents(self, filename: str, chunks: Iterable[Dict]) -> Iterator[Dict]:
+        """Añade nombre de archivo, identificador y fuente legible a cada fragmento"""
+        for i, chunk in enumerate(chunks):
+            yield dict(
+                chunk,
+                filename=filename,
+                chunk_id=i,
+                source=format_source(filename, i, chunk['page'], chunk.get('articulo'), chunk.get('part'))
+            )
+
+    def iter_pages(self, pdf_path: str) -> Iterator[str]:
+        """Genera el texto de un PDF página a página, sin cargar el documento entero"""
+        doc = _fitz().open(pdf_path)
+        try:
+            for page in doc:
+                yield page.get_text()
+        finally:
+            doc.close()
+
+    def iter_documents(self, filenames: Optional[List[str]] = None) -> Iterator[Dict]:
+        """Genera los fragmentos archivo a archivo (modo de ingesta de baja memoria)"""
+        pdf_files = self.list_pdf_files()
+        if filenames is not None:
+            wanted = set(filenames)
+            pdf_files = [f for f in pdf_files if f in wanted]
+
+        for filename in pdf_files:
+            logger.debug("🔄 Procesando en streaming: %s", filename)
+            # Los fragmentos se generan según se leen las páginas (un PDF enorme no se retiene
+            # entero) y se acumulan en un archivo temporal: solo salen si el PDF se lee completo,
+            # así un error a mitad no deja indexado un documento truncado
+            with tempfile.SpooledTemporaryFile(max_size=UNIT_SPOOL_BYTES) as spool:
+                try:
+                    chunks = self.iter_chunks(self.iter_pages(os.path.join(self.ref_folder, filename)))
+                    count = 0
+                    for document in self._make_documents(filename, chunks):
+                        pickle.dump(document, spool, protocol=pickle.HIGHEST_PROTOCOL)
+                        count += 1
+                except Exception as e:
+                    logger.exception("❌ Error procesando %s: %s", filename, e)
+                    continue
+                logger.debug("✂️ Fragmentos creados para %s: %s", filename, count)
+                spool.seek(0)
+                for _ in range(count):
+                    yield pickle.load(spool)
+
+    def process_documents(self, filenames: Optional[List[str]] = None) -> List[Dict[str, str]]:
+        """Procesa los documentos PDF de la carpeta ref (todos, o solo los indicados)"""
+        logger.debug("📁 Procesando documentos en carpeta: %s", self.ref_folder)
         documents = []
 
         if not os.path.exists(self.ref_folder):
-            print(f"❌ Carpeta {self.ref_folder} no existe")
+            logger.error("❌ Carpeta %s no existe", self.ref_folder)
             return documents
 
         all_files = os.listdir(self.ref_folder)
-        pdf_files = [f for f in all_files if f.lower().endswith('.pdf')]
+        pdf_files = self.list_pdf_files()
+        if filenames is not None:
+            wanted = set(filenames)
+            pdf_files = [f for f in pdf_files if f in wanted]
+
+        logger.debug("📁 Archivos encontrados: %s", all_files)
+        logger.debug("📄 PDFs encontrados: %s", pdf_files)
 
-        print(f"📁 Archivos encontrados: {all_files}")
-        print(f"📄 PDFs encontrados: {pdf_files}")
+        with span("extract"):
+            pages_by_file = self._extract_all_pages(pdf_files)
 
         for filename in pdf_files:
-            pdf_path = os.path.join(self.ref_folder, filename)
-            print(f"🔄 Procesando: {filename}")
+            logger.debug("🔄 Procesando: %s", filename)
 
             try:
-                text = self.extract_text_from_pdf(pdf_path)
-                print(f"📝 Texto extraído de {filename}: {len(text)} caracteres")
-
-                if text:
-                    cleaned_text = self.clean_text(text)
-                    print(f"🧹 Texto limpiado: {len(cleaned_text)} caracteres")
-
-                    chunks = self.chunk_text(cleaned_text)
-                    print(f"✂️ Fragmentos creados para {filename}: {len(chunks)}")
-
-                    for i, chunk in enumerate(chunks):
-                        documents.append({
-                            'filename': filename,
-                            'chunk_id': i,
-                            'text': chunk,
-                            'source': f"{filename} (fragmento {i+1})"
-                        })
-
-                        # Mostrar muestra del primer fragmento
-                        if i == 0:
-                            print(f"📄 Primer fragmento de {filename}: {chunk[:100]}...")
+                pages = pages_by_file.get(filename, [])
+                logger.debug("📝 Páginas extraídas de %s: %s", filename, len(pages))
+
+                if any(pages):
+                    with span("chunk"):
+                        chunks = self.chunk_document(pages)
+                    logger.debug("✂️ Fragmentos creados para %s: %s", filename, len(chunks))
+
+                    file_documents = list(self._make_documents(filename, chunks))
+                    documents.extend(file_documents)
+                    inc("rag_ingested_chunks_total", len(file_documents))
+
+                    # Mostrar muestra del primer fragmento
+                    if file_documents:
+                        logger.debug("📄 Primer fragmento de %s: %s...", filename, file_documents[0]['text'][:100])
                 else:
-                    print(f"⚠️ No se pudo extraer texto de {filename}")
+                    logger.warning("⚠️ No se pudo extraer texto de %s", filename)
 
             except Exception as e:
-                print(f"❌ Error procesando {filename}: {e}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("❌ Error procesando %s: %s", filename, e)
 
-        print(f"✅ Total de fragmentos procesados: {len(documents)}")
-        return documents
\ No newline at end of file
+        logger.info("✅ Total de fragmentos procesados: %s", len(documents))
+        return documents
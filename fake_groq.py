@@ -0,0 +1,105 @@
+"""Clientes falsos de Groq, deterministas y sin red, para benchmarks y pruebas locales.
+
+Imitan la parte del SDK que usa RAGSystem: `chat.completions.create` (con y sin
+`stream=True`) y `models.list()`. La respuesta depende solo del modelo y de los
+mensajes, así que dos ejecuciones con el mismo contexto producen el mismo texto.
+"""
+from types import SimpleNamespace
+from typing import Dict, List
+import asyncio
+import hashlib
+import time
+
+FAKE_MODELS = ["llama-3.1-70b-versatile", "llama-3.1-8b-instant"]
+
+
+def fake_answer(model: str, messages: List[Dict]) -> str:
+    """Respuesta determinista que cita el comienzo del prompt y su huella"""
+    prompt = messages[-1]['content'] if messages else ""
+    digest = hashlib.sha256(f"{model}\n{prompt}".encode('utf-8')).hexdigest()[:12]
+    return f"Respuesta simulada [{digest}] basada en: {' '.join(prompt.split()[:40])}"
+
+
+def split_tokens(answer: str) -> List[str]:
+    words = answer.split(" ")
+    return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+
+def _completion(answer: str, model: str):
+    message = SimpleNamespace(role="assistant", content=answer)
+    return SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, message=message)])
+
+
+def _chunk(token: str):
+    return SimpleNamespace(choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=token))])
+
+
+class _Completions:
+    def __init__(self, latency_ms: float, token_latency_ms: float):
+        self.latency_ms = latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.calls = 0
+
+    def create(self, model: str, messages: List[Dict], stream: bool = False, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000)
+        answer = fake_answer(model, messages)
+        if not stream:
+            return _completion(answer, model)
+        return self._stream(answer)
+
+    def _stream(self, answer: str):
+        for token in split_tokens(answer):
+            time.sleep(self.token_latency_ms / 1000)
+            yield _chunk(token)
+
+
+class _AsyncStream:
+    """Como groq.AsyncStream: se itera por fragmentos y close() libera la respuesta"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.closed = False
+
+    def __aiter__(self):
+        return self._chunks
+
+    async def close(self):
+        self.closed = True
+        await self._chunks.aclose()
+
+
+class _AsyncCompletions(_Completions):
+    async def create(self, model: str, messages: List[Dict], stream: bool = False, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        answer = fake_answer(model, messages)
+        if not stream:
+            return _completion(answer, model)
+        return _AsyncStream(self._astream(answer))
+
+    async def _astream(self, answer: str):
+        for token in split_tokens(answer):
+            await asyncio.sleep(self.token_latency_ms / 1000)
+            yield _chunk(token)
+
+
+class _Models:
+    def list(self):
+        return SimpleNamespace(data=[SimpleNamespace(id=model) for model in FAKE_MODELS])
+
+
+class FakeGroq:
+    """Sustituto de groq.Groq con latencia configurable (ms por llamada y por token)"""
+
+    completions_class = _Completions
+
+    def __init__(self, latency_ms: float = 0.0, token_latency_ms: float = 0.0, **kwargs):
+        self.chat = SimpleNamespace(completions=self.completions_class(latency_ms, token_latency_ms))
+        self.models = _Models()
+
+
+class FakeAsyncGroq(FakeGroq):
+    """Sustituto de groq.AsyncGroq"""
+
+    completions_class = _AsyncCompletions
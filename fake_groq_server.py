@@ -0,0 +1,212 @@
+"""Servidor HTTP local que imita la API de Groq, para probar la capa de reintentos sin red.
+
+Atiende las rutas que usa el SDK (compatibles con OpenAI) con las respuestas
+deterministas de fake_groq:
+
+    POST /openai/v1/chat/completions   (con y sin "stream": true, en SSE)
+    GET  /openai/v1/models
+
+y permite inyectar los fallos que se ven en producción:
+
+- límite de peticiones por minuto por modelo (429 con Retry-After);
+- errores 5xx con una probabilidad dada;
+- latencia base y una cola lenta (una fracción de peticiones tarda mucho más);
+- modelos caídos (503) y modelos desconocidos (404 model_not_found).
+
+Uso:
+    python fake_groq_server.py --port 8787 --rpm llama-3.1-70b-versatile=5 --tail-rate 0.2 --tail-ms 3000
+    GROQ_BASE_URL=http://127.0.0.1:8787 GROQ_API_KEY=fake python server.py query "¿Qué es el habeas corpus?"
+"""
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, Iterable, List, Optional
+import argparse
+import json
+import random
+import threading
+import time
+
+from fake_groq import FAKE_MODELS, fake_answer, split_tokens
+
+
+class FakeGroqServer:
+    """Servidor falso en un hilo; `calls` cuenta las peticiones recibidas por modelo y `model_lists` las de /models"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0,
+                 token_latency_ms: float = 0.0, tail_ms: float = 0.0, tail_rate: float = 0.0,
+                 error_rate: float = 0.0, rpm: Optional[Dict[str, int]] = None,
+                 down: Iterable[str] = (), seed: int = 0):
+        self.latency_ms = latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.tail_ms = tail_ms
+        self.tail_rate = tail_rate
+        self.error_rate = error_rate
+        self.rpm = dict(rpm or {})
+        self.down = set(down)
+        self.calls: Dict[str, int] = {}
+        self.model_lists = 0
+        self._random = random.Random(seed)
+        self._window: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def start(self) -> "FakeGroqServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeGroqServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def admit(self, model: str) -> Optional[Dict]:
+        """Decide el fallo inyectado para una petición: None o {'status', 'code', 'retry_after'}"""
+        with self._lock:
+            self.calls[model] = self.calls.get(model, 0) + 1
+            if model not in FAKE_MODELS:
+                return {'status': 404, 'code': 'model_not_found',
+                        'message': f"The model `{model}` does not exist or you do not have access to it."}
+            if model in self.down:
+                return {'status': 503, 'code': 'service_unavailable', 'message': f"{model} is over capacity"}
+            limit = self.rpm.get(model)
+            if limit:
+                # Ventana deslizante de 60 s por modelo, como los límites RPM de Groq
+                now = time.monotonic()
+                window = self._window.setdefault(model, deque())
+                while window and now - window[0] >= 60:
+                    window.popleft()
+                if len(window) >= limit:
+                    return {'status': 429, 'code': 'rate_limit_exceeded', 'retry_after': 60 - (now - window[0]),
+                            'message': f"Rate limit reached for model `{model}`: {limit} requests per minute"}
+                window.append(now)
+            if self._random.random() < self.error_rate:
+                return {'status': 500, 'code': 'internal_server_error', 'message': "Internal server error"}
+            slow = self._random.random() < self.tail_rate
+        time.sleep((self.tail_ms if slow else self.latency_ms) / 1000)
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeGroq/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def fake(self) -> FakeGroqServer:
+        return self.server.fake
+
+    def do_GET(self):
+        if self.path.rstrip('/') == "/openai/v1/models":
+            with self.fake._lock:
+                self.fake.model_lists += 1
+            data = [{'id': model, 'object': 'model', 'created': 0, 'owned_by': 'fake'} for model in FAKE_MODELS]
+            self._send_json(200, {'object': 'list', 'data': data})
+        else:
+            self._send_json(404, {'error': {'message': f"Unknown path {self.path}", 'type': 'invalid_request_error'}})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != "/openai/v1/chat/completions":
+            self._send_json(404, {'error': {'message': f"Unknown path {self.path}", 'type': 'invalid_request_error'}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        model = body.get('model', '')
+        failure = self.fake.admit(model)
+        if failure is not None:
+            headers = {}
+            if failure.get('retry_after') is not None:
+                headers['retry-after'] = f"{failure['retry_after']:.3f}"
+            self._send_json(failure['status'], {'error': {
+                'message': failure['message'], 'type': 'invalid_request_error', 'code': failure['code']
+            }}, headers)
+            return
+
+        answer = fake_answer(model, body.get('messages') or [])
+        created = int(time.time())
+        if not body.get('stream'):
+            self._send_json(200, {
+                'id': f"chatcmpl-fake-{created}", 'object': 'chat.completion', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer}, 'finish_reason': 'stop'}],
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        for token in split_tokens(answer) + [None]:
+            time.sleep(self.fake.token_latency_ms / 1000 if token is not None else 0)
+            delta = {'content': token} if token is not None else {}
+            chunk = {'id': f"chatcmpl-fake-{created}", 'object': 'chat.completion.chunk', 'created': created,
+                     'model': model, 'choices': [{'index': 0, 'delta': delta,
+                                                  'finish_reason': None if token is not None else 'stop'}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def parse_rpm(values: List[str]) -> Dict[str, int]:
+    """'modelo=5' -> {'modelo': 5}"""
+    limits = {}
+    for value in values or []:
+        model, _, limit = value.partition('=')
+        limits[model] = int(limit)
+    return limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--token-latency-ms', type=float, default=0.0)
+    parser.add_argument('--tail-ms', type=float, default=0.0, help='Latencia de las peticiones lentas')
+    parser.add_argument('--tail-rate', type=float, default=0.0, help='Fracción de peticiones lentas')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fracción de respuestas 500')
+    parser.add_argument('--rpm', action='append', help='Límite por minuto de un modelo: modelo=N (repetible)')
+    parser.add_argument('--down', action='append', default=[], help='Modelo que responde 503 (repetible)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = FakeGroqServer(args.host, args.port, args.latency_ms, args.token_latency_ms, args.tail_ms,
+                            args.tail_rate, args.error_rate, parse_rpm(args.rpm), args.down, args.seed)
+    print(f"🧪 Groq falso en {server.url} (GROQ_BASE_URL={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
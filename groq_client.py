@@ -0,0 +1,403 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+
+from metrics import inc
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODELS = ["llama-3.1-70b-versatile", "llama-3.1-8b-instant"]
+# Modelo pedido -> modelos de respaldo, en orden, si está saturado o no disponible
+FALLBACK_MODELS = {"llama-3.1-70b-versatile": ["llama-3.1-8b-instant"]}
+# Estados HTTP transitorios: se reintenta (429 con la espera que indique el servidor)
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+MODEL_ERROR_CODES = {"model_not_found", "model_decommissioned"}
+
+
+def _status(error: Exception) -> Optional[int]:
+    return getattr(error, 'status_code', None)
+
+
+def _error_code(error: Exception) -> Optional[str]:
+    body = getattr(error, 'body', None)
+    if isinstance(body, dict):
+        details = body.get('error', body)
+        if isinstance(details, dict):
+            return details.get('code')
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Errores transitorios: límite de ritmo, 5xx, tiempos de espera y fallos de conexión"""
+    status = _status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(error, (TimeoutError, ConnectionError)) or \
+        type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def is_model_error(error: Exception) -> bool:
+    """El modelo no existe o está retirado: no tiene sentido reintentar, sí pasar al de respaldo"""
+    return _status(error) == 404 or _error_code(error) in MODEL_ERROR_CODES
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Segundos de espera que indica el servidor (Retry-After / retry-after-ms), si los indica"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after') is not None:
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class TokenBucket:
+    """Limitador de ritmo: `rate` permisos por segundo con ráfagas de hasta `capacity`
+
+    `reserve` toma un permiso aunque no lo haya (queda a deber) y devuelve cuánto
+    hay que esperar para usarlo, de modo que sirve igual para hilos y corrutinas
+    y las esperas quedan repartidas en orden de llegada. `pause` bloquea el cubo
+    el tiempo que indique un 429 del servidor, para todas las llamadas del proceso
+    a ese modelo.
+    """
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens -= 1
+            wait_seconds = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait_seconds, self._blocked_until - now)
+
+    def try_acquire(self) -> bool:
+        """Toma un permiso solo si hay uno libre ahora mismo (para peticiones opcionales)"""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if self._tokens < 1 or now < self._blocked_until:
+                return False
+            self._tokens -= 1
+            return True
+
+    def refund(self):
+        """Devuelve un permiso reservado que no se ha llegado a usar"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+
+class RateLimiter:
+    """Un TokenBucket por modelo: Groq limita las peticiones por minuto de cada modelo por separado"""
+
+    def __init__(self, requests_per_minute: float, burst: float):
+        self.rate = requests_per_minute / 60
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, model: str) -> TokenBucket:
+        with self._lock:
+            if model not in self._buckets:
+                self._buckets[model] = TokenBucket(self.rate, self.burst)
+            return self._buckets[model]
+
+
+_shared_limiter: Optional[RateLimiter] = None
+_shared_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """Limitador común a todas las sesiones del proceso (la cuota de Groq es por clave)"""
+    global _shared_limiter
+    rpm = float(os.environ.get("RAG_GROQ_RPM", "30"))
+    if rpm <= 0:
+        return None
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter(rpm, float(os.environ.get("RAG_GROQ_BURST", "10")))
+        return _shared_limiter
+
+
+_models_cache: Dict[str, Tuple[float, List[str]]] = {}
+_models_lock = threading.Lock()
+# Hilos para las peticiones cubiertas (la original y la de respaldo corren a la vez)
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="groq-hedge")
+
+
+def _discard_stream(task: "asyncio.Future"):
+    """Cancela o cierra un stream que ha perdido la carrera y recoge su excepción
+
+    Sin recogerla, asyncio avisaría de una excepción nunca recuperada al
+    destruir la tarea.
+    """
+    if not task.done():
+        task.cancel()
+        task.add_done_callback(_discard_stream)
+    elif not task.cancelled() and task.exception() is None:
+        _, tokens, stream = task.result()
+        asyncio.ensure_future(_close_stream(tokens, stream))
+
+
+async def _close_stream(tokens: AsyncIterator[str], stream):
+    """Cierra el iterador de tokens y el stream del SDK, que libera la conexión HTTP"""
+    await tokens.aclose()
+    await stream.close()
+
+
+class ResilientGroq:
+    """Capa sobre los clientes de Groq: límite de ritmo, reintentos, peticiones cubiertas y modelo de respaldo
+
+    Cada llamada espera su permiso en el limitador y se reintenta ante errores
+    transitorios con backoff exponencial y jitter (respetando Retry-After). Si
+    la respuesta tarda más que el umbral de cobertura y queda cuota libre, se
+    lanza una segunda petición idéntica y se usa la que llegue antes. Cuando un
+    modelo agota sus reintentos, o el servidor pide esperar más de lo admitido,
+    se pasa al siguiente de FALLBACK_MODELS (del 70B al 8B instant). En
+    streaming todo esto se aplica hasta el primer token; después los errores se
+    propagan, porque reintentar duplicaría el texto ya emitido.
+    """
+
+    def __init__(self, client=None, async_client=None, limiter: Optional[RateLimiter] = None,
+                 max_retries: Optional[int] = None, base_delay: float = 0.5, max_delay: float = 8.0,
+                 hedge_ms: Optional[float] = None, fallbacks: Optional[Dict[str, List[str]]] = None,
+                 models_ttl: Optional[float] = None):
+        self.client = client
+        self.async_client = async_client
+        self.limiter = limiter
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get("RAG_GROQ_RETRIES", "3"))
+        self.base_delay = base_delay
+        # Espera máxima entre reintentos; un Retry-After mayor hace pasar al modelo de respaldo
+        self.max_delay = max_delay
+        hedge_ms = hedge_ms if hedge_ms is not None else float(os.environ.get("RAG_GROQ_HEDGE_MS", "4000"))
+        self.hedge_after = hedge_ms / 1000 if hedge_ms > 0 else None
+        self.fallbacks = FALLBACK_MODELS if fallbacks is None else fallbacks
+        self.models_ttl = models_ttl if models_ttl is not None else float(os.environ.get("RAG_GROQ_MODELS_TTL", "600"))
+
+    def models_for(self, model: str) -> List[str]:
+        """El modelo pedido seguido de sus modelos de respaldo"""
+        return [model] + [fallback for fallback in self.fallbacks.get(model, []) if fallback != model]
+
+    def _next_delay(self, model: str, attempt: int, error: Exception, last_model: bool) -> Optional[float]:
+        """Espera antes del siguiente intento, o None si hay que pasar al siguiente modelo (o fallar)"""
+        if is_model_error(error) or not is_retryable(error) or attempt >= self.max_retries:
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        server_delay = retry_after(error)
+        if server_delay is not None:
+            if self.limiter is not None and _status(error) == 429:
+                self.limiter.bucket(model).pause(server_delay)
+            if server_delay > self.max_delay and not last_model:
+                logger.warning("⏳ %s pide esperar %.1f s: se pasa al modelo de respaldo", model, server_delay)
+                return None
+            delay = max(delay, server_delay)
+        inc("rag_llm_retries_total", model=model, error=type(error).__name__)
+        logger.warning("🔁 Reintento %s/%s con %s en %.2f s (%s)", attempt + 1, self.max_retries, model,
+                       delay, type(error).__name__)
+        return delay
+
+    def _admission_wait(self, model: str, last_model: bool) -> Optional[float]:
+        """Espera del limitador para el modelo, o None si es excesiva y queda un modelo de respaldo"""
+        if self.limiter is None:
+            return 0.0
+        bucket = self.limiter.bucket(model)
+        wait_seconds = bucket.reserve()
+        if wait_seconds > self.max_delay and not last_model:
+            bucket.refund()
+            inc("rag_llm_fallbacks_total", model=model)
+            logger.warning("⏳ %s limitado durante %.1f s: se usa el modelo de respaldo", model, wait_seconds)
+            return None
+        return wait_seconds
+
+    def _give_up(self, model: str, error: Exception, last_model: bool) -> bool:
+        """El error no se resuelve cambiando de modelo (o no quedan modelos)"""
+        if last_model or not (is_retryable(error) or is_model_error(error)):
+            return True
+        inc("rag_llm_fallbacks_total", model=model)
+        logger.warning("↪️ %s no disponible (%s), se usa el modelo de respaldo", model, type(error).__name__)
+        return False
+
+    def complete(self, model: str, messages: List[Dict], **kwargs) -> Tuple[str, str]:
+        """Texto de la respuesta y modelo que la ha generado (el pedido o uno de respaldo)"""
+        candidates = self.models_for(model)
+        for position, candidate in enumerate(candidates):
+            last_model = position == len(candidates) - 1
+            attempt = 0
+            while True:
+                wait_seconds = self._admission_wait(candidate, last_model)
+                if wait_seconds is None:
+                    break
+                time.sleep(wait_seconds)
+                try:
+                    response = self._hedged(candidate, partial(self.client.chat.completions.create,
+                                                               model=candidate, messages=messages, **kwargs))
+                    return response.choices[0].message.content, candidate
+                except Exception as error:
+                    delay = self._next_delay(candidate, attempt, error, last_model)
+                    if delay is None:
+                        if self._give_up(candidate, error, last_model):
+                            raise
+                        break
+                    time.sleep(delay)
+                    attempt += 1
+
+    def _hedged(self, model: str, call: Callable):
+        """Lanza una segunda petición si la primera supera el umbral y queda cuota libre
+
+        La petición que pierde no se puede cancelar (el SDK es bloqueante): termina
+        en segundo plano y su respuesta se descarta.
+        """
+        if self.hedge_after is None:
+            return call()
+        primary = _hedge_pool.submit(call)
+        try:
+            return primary.result(timeout=self.hedge_after)
+        except FutureTimeout:
+            pass
+        if self.limiter is not None and not self.limiter.bucket(model).try_acquire():
+            return primary.result()
+        inc("rag_llm_hedges_total", result="sent")
+        hedge = _hedge_pool.submit(call)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        inc("rag_llm_hedges_total", result="won")
+                    return future.result()
+        return primary.result()
+
+    async def aopen_stream(self, model: str, messages: List[Dict], **kwargs) -> Tuple[str, AsyncIterator[str]]:
+        """Abre el stream (con reintentos, cobertura y respaldo hasta el primer token)
+
+        Devuelve el modelo que responde y un iterador de los tokens de texto.
+        """
+        candidates = self.models_for(model)
+        for position, candidate in enumerate(candidates):
+            last_model = position == len(candidates) - 1
+            attempt = 0
+            while True:
+                wait_seconds = self._admission_wait(candidate, last_model)
+                if wait_seconds is None:
+                    break
+                await asyncio.sleep(wait_seconds)
+                try:
+                    first, tokens, _ = await self._ahedged(candidate, messages, kwargs)
+                    return candidate, self._replay(first, tokens)
+                except Exception as error:
+                    delay = self._next_delay(candidate, attempt, error, last_model)
+                    if delay is None:
+                        if self._give_up(candidate, error, last_model):
+                            raise
+                        break
+                    await asyncio.sleep(delay)
+                    attempt += 1
+
+    async def _aopen(self, model: str, messages: List[Dict], kwargs: Dict):
+        """Primer token, iterador del resto y stream del SDK (para poder cerrarlo si se descarta)"""
+        stream = await self.async_client.chat.completions.create(model=model, messages=messages, stream=True, **kwargs)
+        tokens = self._tokens(stream)
+        try:
+            first = await anext(tokens, None)
+        except BaseException:
+            # Cancelada (perdió la carrera) o fallida antes del primer token: la conexión no queda abierta
+            await _close_stream(tokens, stream)
+            raise
+        return first, tokens, stream
+
+    @staticmethod
+    async def _tokens(stream) -> AsyncIterator[str]:
+        async for chunk in stream:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if token:
+                yield token
+
+    @staticmethod
+    async def _replay(first: Optional[str], tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+        if first is not None:
+            yield first
+            async for token in tokens:
+                yield token
+
+    async def _ahedged(self, model: str, messages: List[Dict], kwargs: Dict):
+        """Primer token del stream; si tarda más que el umbral, compite con un segundo stream"""
+        primary = asyncio.ensure_future(self._aopen(model, messages, kwargs))
+        if self.hedge_after is None:
+            return await primary
+        hedge = winner = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+            if done or (self.limiter is not None and not self.limiter.bucket(model).try_acquire()):
+                result = await primary
+                winner = primary
+                return result
+            inc("rag_llm_hedges_total", result="sent")
+            hedge = asyncio.ensure_future(self._aopen(model, messages, kwargs))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        if task is hedge:
+                            inc("rag_llm_hedges_total", result="won")
+                        return task.result()
+            return primary.result()
+        finally:
+            # También si se cancela la llamada: las peticiones que pierden no deben quedar sueltas
+            for task in (primary, hedge):
+                if task is not None and task is not winner:
+                    _discard_stream(task)
+
+    def _cache_key(self) -> str:
+        api_key = getattr(self.client, 'api_key', None) or ""
+        return f"{getattr(self.client, 'base_url', '')}|{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]}"
+
+    def list_models(self) -> List[str]:
+        """Identificadores de los modelos disponibles, en caché durante models_ttl segundos"""
+        key = self._cache_key()
+        now = time.monotonic()
+        with _models_lock:
+            cached = _models_cache.get(key)
+        if cached is not None and cached[0] > now:
+            return list(cached[1])
+        try:
+            models = [model.id for model in self.client.models.list().data]
+        except Exception as error:
+            if cached is None:
+                raise
+            # Mejor una lista algo antigua que ninguna; se vuelve a intentar pasado el TTL
+            logger.warning("⚠️ No se pudo refrescar la lista de modelos (%s), se usa la anterior", error)
+            models = cached[1]
+        with _models_lock:
+            _models_cache[key] = (now + self.models_ttl, models)
+        return list(models)
@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Tuple
+import logging
+import math
+import re
+import time
+
+from lazy_imports import optional_import
+from metrics import STAGE_HISTOGRAM, observe
+
+logger = logging.getLogger(__name__)
+
+# Encabezados de artículo y disposición: "Artículo 57. Expulsión del territorio."
+HEADER_PATTERN = re.compile(
+    r'^\s*(art[íi]culo\s+\d+(\s*(bis|ter|quater|quinquies))?\.?.*|disposici[óo]n\s+\w+.*)$',
+    re.IGNORECASE | re.MULTILINE
+)
+
+
+class BM25FReranker:
+    """Reordena candidatos con BM25F, dando más peso a los encabezados de artículo"""
+
+    def __init__(self, vector_store, header_weight: float = 3.0, body_weight: float = 1.0,
+                 k1: float = 1.2, b: float = 0.75):
+        self.vector_store = vector_store
+        self.header_weight = header_weight
+        self.body_weight = body_weight
+        self.k1 = k1
+        self.b = b
+
+    def _terms(self, text: str) -> List[str]:
+        encoder = self.vector_store.query_encoder
+        return [term for term in encoder.analyze(text) if term in encoder.vocabulary]
+
+    def _idf(self, term: str) -> float:
+        """idf BM25 a partir de la longitud de la lista de postings del término"""
+        index = self.vector_store.inverted_index
+        column = self.vector_store.query_encoder.vocabulary[term]
+        df = int(index.indptr[column + 1] - index.indptr[column])
+        return math.log(1 + (index.n_docs - df + 0.5) / (df + 0.5))
+
+    def score(self, query: str, docs: List[Dict], deadline: float) -> List[float]:
+        """Puntúa los candidatos en orden hasta agotar el plazo; el resto queda sin puntuar"""
+        query_terms = set(self._terms(query))
+        if not query_terms:
+            return []
+        idf = {term: self._idf(term) for term in query_terms}
+
+        fields = []
+        for doc in docs:
+            headers = "\n".join(match.group(0) for match in HEADER_PATTERN.finditer(doc['text']))
+            fields.append((self._terms(headers), self._terms(doc['text'])))
+            if time.perf_counter() > deadline:
+                break
+        if not fields:
+            return []
+        avg_header = max(1.0, sum(len(h) for h, _ in fields) / len(fields))
+        avg_body = max(1.0, sum(len(b) for _, b in fields) / len(fields))
+
+        scores = []
+        for header_terms, body_terms in fields:
+            score = 0.0
+            for term in query_terms:
+                # Frecuencia combinada por campos con normalización de longitud por campo
+                tf = (self.header_weight * header_terms.count(term)
+                      / (1 - self.b + self.b * len(header_terms) / avg_header)
+                      + self.body_weight * body_terms.count(term)
+                      / (1 - self.b + self.b * len(body_terms) / avg_body))
+                score += idf[term] * tf / (self.k1 + tf)
+            scores.append(score)
+        return scores
+
+
+class CrossEncoderReranker:
+    """Reordena candidatos con un cross-encoder local (requiere sentence-transformers)"""
+
+    def __init__(self, model_name: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1", batch_size: int = 8):
+        sentence_transformers = optional_import("sentence_transformers")
+        if sentence_transformers is None:
+            raise ImportError("sentence-transformers no está disponible. Instálelo para usar el cross-encoder.")
+        self.model = sentence_transformers.CrossEncoder(model_name, device="cpu")
+        self.batch_size = batch_size
+
+    def score(self, query: str, docs: List[Dict], deadline: float) -> List[float]:
+        """Puntúa por lotes mientras quede plazo"""
+        scores = []
+        for start in range(0, len(docs), self.batch_size):
+            if time.perf_counter() > deadline:
+                break
+            batch = docs[start:start + self.batch_size]
+            scores.extend(float(s) for s in self.model.predict([(query, doc['text']) for doc in batch]))
+        return scores
+
+
+class HybridRetriever:
+    """Recuperación híbrida: candidatos de varios recuperadores, fusión RRF y reordenación acotada"""
+
+    def __init__(self, vector_store, candidates: int = 30, rrf_k: int = 60, rerank_top_n: int = 20,
+                 candidate_budget_ms: float = 200.0, rerank_budget_ms: float = 50.0, reranker=None):
+        self.vector_store = vector_store
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.rerank_top_n = rerank_top_n
+        self.candidate_budget_ms = candidate_budget_ms
+        self.rerank_budget_ms = rerank_budget_ms
+        self.reranker = reranker if reranker is not None else BM25FReranker(vector_store)
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid")
+
+    def retrievers(self) -> Dict[str, Callable[[str, int], List[Dict]]]:
+        """Recuperadores disponibles: léxico siempre y denso si su índice está construido"""
+        # Los pasajes destacados solo se calculan para los resultados finales
+        retrievers = {'tfidf': lambda q, n: self.vector_store.search(q, k=n, backend="tfidf", snippets=False)}
+        dense = self.vector_store.dense_index
+        if dense is not None and dense.vectors is not None:
+            retrievers['dense'] = lambda q, n: self.vector_store.search(q, k=n, backend="dense", snippets=False)
+        return retrievers
+
+    @staticmethod
+    def _key(doc: Dict) -> Tuple[str, int]:
+        return doc['filename'], doc['chunk_id']
+
+    def search(self, query: str, k: int = 3) -> List[Dict]:
+        return self.search_with_timings(query, k)[0]
+
+    def search_with_timings(self, query: str, k: int = 3) -> Tuple[List[Dict], Dict[str, float]]:
+        """Devuelve los k mejores fragmentos y el tiempo (ms) empleado en cada etapa"""
+        timings = {}
+
+        # 1. Generación de candidatos en paralelo; el presupuesto solo limita a los opcionales
+        start = time.perf_counter()
+        futures = {name: self._executor.submit(retrieve, query, self.candidates)
+                   for name, retrieve in self.retrievers().items()}
+        wait(futures.values(), timeout=self.candidate_budget_ms / 1000)
+        lexical = futures['tfidf']
+        if not lexical.done():
+            # Sin el léxico no habría candidatos (carga, mmap en frío): se espera aunque se pase
+            logger.warning("⏱️ Recuperador 'tfidf' fuera de presupuesto, se espera igualmente")
+            wait([lexical])
+        done = {name for name, future in futures.items() if future.done()}
+        rankings = {name: futures[name].result() for name in done}
+        for name in futures.keys() - done:
+            logger.warning("⏱️ Recuperador '%s' fuera de presupuesto, se ignora", name)
+        timings['candidates_ms'] = (time.perf_counter() - start) * 1000
+
+        # 2. Fusión por rango recíproco (RRF)
+        start = time.perf_counter()
+        fused: Dict[Tuple[str, int], float] = {}
+        docs: Dict[Tuple[str, int], Dict] = {}
+        for results in rankings.values():
+            for rank, doc in enumerate(results, start=1):
+                key = self._key(doc)
+                fused[key] = fused.get(key, 0.0) + 1.0 / (self.rrf_k + rank)
+                docs.setdefault(key, doc)
+        ordered = sorted(fused, key=lambda key: -fused[key])
+        for key in ordered:
+            docs[key]['fusion_score'] = fused[key]
+        timings['fusion_ms'] = (time.perf_counter() - start) * 1000
+
+        # 3. Reordenación de los N primeros dentro de su presupuesto
+        start = time.perf_counter()
+        head = [docs[key] for key in ordered[:self.rerank_top_n]]
+        tail = [docs[key] for key in ordered[self.rerank_top_n:]]
+        if head and self.rerank_budget_ms > 0:
+            scores = self.reranker.score(query, head, start + self.rerank_budget_ms / 1000)
+            for doc, score in zip(head, scores):
+                doc['rerank_score'] = score
+            # Los candidatos sin puntuar (plazo agotado) conservan el orden de la fusión
+            reranked = sorted(head[:len(scores)], key=lambda doc: -doc['rerank_score'])
+            head = reranked + head[len(scores):]
+        timings['rerank_ms'] = (time.perf_counter() - start) * 1000
+
+        for name, elapsed_ms in timings.items():
+            observe(STAGE_HISTOGRAM, elapsed_ms / 1000, stage="hybrid_" + name[:-len("_ms")])
+
+        results = (head + tail)[:k]
+        for rank, doc in enumerate(results, start=1):
+            doc['rank'] = rank
+        self.vector_store.add_snippets(query, results)
+        logger.debug("🔀 Híbrido: %s candidatos de %s, tiempos %s", len(fused), list(rankings), timings)
+        return results, timings
@@ -0,0 +1,139 @@
+import numpy as np
+from typing import TYPE_CHECKING, Tuple
+import os
+
+from metrics import span
+
+if TYPE_CHECKING:
+    from scipy.sparse import csr_matrix
+
+
+class InvertedIndex:
+    """Listas de postings (término -> fragmentos, peso) sobre la matriz TF-IDF"""
+
+    def __init__(self, indptr: np.ndarray, doc_ids: np.ndarray, weights: np.ndarray,
+                 term_max: np.ndarray, n_docs: int):
+        # Postings del término t: doc_ids[indptr[t]:indptr[t + 1]], ordenados por fragmento
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        # Peso máximo de cada término: cota superior de su contribución (MaxScore)
+        self.term_max = term_max
+        self.n_docs = n_docs
+
+    @classmethod
+    def from_matrix(cls, matrix: "csr_matrix") -> "InvertedIndex":
+        """Construye el índice invertido trasponiendo la matriz TF-IDF (CSR -> CSC)"""
+        csc = matrix.tocsc()
+        csc.sort_indices()
+        term_max = np.zeros(csc.shape[1], dtype=csc.data.dtype)
+        non_empty = np.diff(csc.indptr) > 0
+        if non_empty.any():
+            term_max[non_empty] = np.maximum.reduceat(csc.data, csc.indptr[:-1][non_empty])
+        return cls(csc.indptr, csc.indices, csc.data, term_max, csc.shape[0])
+
+    def save(self, dirpath: str):
+        """Guarda los postings como arrays .npy"""
+        np.save(os.path.join(dirpath, "postings_indptr.npy"), self.indptr)
+        np.save(os.path.join(dirpath, "postings_docs.npy"), self.doc_ids)
+        np.save(os.path.join(dirpath, "postings_weights.npy"), self.weights)
+        np.save(os.path.join(dirpath, "postings_term_max.npy"), self.term_max)
+
+    @classmethod
+    def load(cls, dirpath: str, n_docs: int) -> "InvertedIndex":
+        """Carga los postings mapeándolos en memoria"""
+        def load_array(name):
+            return np.load(os.path.join(dirpath, name), mmap_mode='r')
+
+        return cls(load_array("postings_indptr.npy"), load_array("postings_docs.npy"),
+                   load_array("postings_weights.npy"), load_array("postings_term_max.npy"), n_docs)
+
+    def _postings(self, term: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.indptr[term], self.indptr[term + 1]
+        return self.doc_ids[start:end], self.weights[start:end]
+
+    def search(self, terms: np.ndarray, query_weights: np.ndarray, k: int,
+               prune: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Devuelve los k fragmentos con mayor producto escalar con la consulta
+
+        Solo se recorren los postings de los términos de la consulta. Con
+        prune=True se aplica una poda tipo MaxScore que da el mismo resultado.
+        El orden es por puntuación descendente y, a igual puntuación, por
+        índice descendente, como np.argsort(scores, kind='stable')[::-1].
+        """
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        if k <= 0 or len(terms) == 0:
+            return empty
+
+        with span("score"):
+            if prune:
+                candidates, scores = self._score_maxscore(terms, query_weights, k)
+            else:
+                candidates, scores = self._score_exhaustive(terms, query_weights)
+        if len(candidates) == 0:
+            return empty
+        with span("topk"):
+            return self.top_k(candidates, scores, k)
+
+    def _score_exhaustive(self, terms: np.ndarray, query_weights: np.ndarray):
+        """Acumula la puntuación de todos los fragmentos que contienen algún término"""
+        doc_parts, weight_parts = [], []
+        for term, query_weight in zip(terms, query_weights):
+            doc_ids, weights = self._postings(term)
+            doc_parts.append(doc_ids)
+            weight_parts.append(weights * query_weight)
+        doc_ids = np.concatenate(doc_parts)
+        if len(doc_ids) == 0:
+            return doc_ids, np.zeros(0)
+        candidates, inverse = np.unique(doc_ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weight_parts), minlength=len(candidates))
+        return candidates, scores
+
+    def _score_maxscore(self, terms: np.ndarray, query_weights: np.ndarray, k: int):
+        """Puntuación con poda MaxScore: los términos de cota baja solo puntúan candidatos ya vistos"""
+        bounds = query_weights * self.term_max[terms]
+        order = np.argsort(-bounds, kind='stable')
+        # remaining_after[i]: suma de cotas de los términos posteriores al i-ésimo
+        remaining_after = np.append(np.cumsum(bounds[order][::-1])[::-1][1:], 0.0)
+
+        candidates = np.zeros(0, dtype=self.doc_ids.dtype)
+        scores = np.zeros(0, dtype=np.float64)
+        pruning = False
+        for step, position in enumerate(order):
+            remaining = float(remaining_after[step])
+            doc_ids, weights = self._postings(terms[position])
+            weights = weights * query_weights[position]
+
+            if not pruning:
+                # Fase esencial: cualquier fragmento puede entrar en el top k
+                merged, inverse = np.unique(np.concatenate([candidates, doc_ids]), return_inverse=True)
+                scores = np.bincount(inverse, weights=np.concatenate([scores, weights]),
+                                     minlength=len(merged))
+                candidates = merged
+            else:
+                # Fase no esencial: solo se actualizan los candidatos existentes
+                slots = np.searchsorted(candidates, doc_ids)
+                found = slots < len(candidates)
+                found[found] = candidates[slots[found]] == doc_ids[found]
+                np.add.at(scores, slots[found], weights[found])
+
+            if len(candidates) >= k:
+                threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+                # Un fragmento no visto suma como mucho `remaining`: si no alcanza
+                # el umbral actual, ya no puede entrar en el top k
+                if remaining < threshold:
+                    pruning = True
+                    alive = scores + remaining >= threshold
+                    candidates, scores = candidates[alive], scores[alive]
+        return candidates, scores
+
+    @staticmethod
+    def top_k(candidates: np.ndarray, scores: np.ndarray, k: int):
+        """Selección parcial del top k (np.partition) y orden final solo de esos k"""
+        if len(scores) > k:
+            kth_score = np.partition(scores, len(scores) - k)[len(scores) - k]
+            # Incluir los empates con el k-ésimo para desempatar por índice
+            selected = np.flatnonzero(scores >= kth_score)
+            candidates, scores = candidates[selected], scores[selected]
+        order = np.lexsort((-candidates.astype(np.int64), -scores))[:k]
+        return candidates[order].astype(np.int64), scores[order]
@@ -0,0 +1,13 @@
+from functools import lru_cache
+from types import ModuleType
+from typing import Optional
+import importlib
+
+
+@lru_cache(maxsize=None)
+def optional_import(name: str) -> Optional[ModuleType]:
+    """Importa un módulo la primera vez que se usa; None si no está instalado"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
@@ -0,0 +1,287 @@
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
+import re
+import zlib
+
+import numpy as np
+
+from query_encoder import TOKEN_PATTERN
+
+# Mismo patrón de tokens, sobre el texto original: los desplazamientos son los del texto mostrado
+WORD_PATTERN = re.compile(TOKEN_PATTERN.pattern, re.IGNORECASE)
+# Fin de frase: signo de cierre seguido de espacio (los saltos de línea del PDF no cortan frases)
+SENTENCE_BREAK = re.compile(r'(?<=[.;:!?])\s+')
+WHITESPACE = re.compile(r'\s')
+# Los términos presentes en más de un tercio de los fragmentos (idf < 2) no se resaltan
+MIN_HIGHLIGHT_IDF = 2.0
+SNIPPET_CHARS = 320
+# Contexto que se deja antes de la primera coincidencia al recortar una frase larga
+SNIPPET_LEAD = 40
+
+DTYPES = {'q': np.int64, 'i': np.int32, 'I': np.uint32}
+FILES = {
+    'indptr': 'q',          # fragmento -> rango de sus términos
+    'keys': 'I',            # clave de cada término, ordenadas dentro de cada fragmento
+    'span_indptr': 'q',     # término de un fragmento -> rango de sus apariciones
+    'spans': 'i',           # (inicio, fin) de cada aparición, en caracteres
+    'sentence_indptr': 'q', # fragmento -> rango de sus inicios de frase
+    'sentences': 'i',       # inicio de cada frase, en caracteres
+}
+
+Match = Tuple[int, int, float, int]
+
+
+def term_key(term: str) -> int:
+    """Clave estable de un término (crc32 en minúsculas); una colisión solo resalta de más"""
+    return zlib.crc32(term.lower().encode('utf-8'))
+
+
+def scan(text: str, analyzer=None) -> Tuple[Dict[int, List[int]], List[int]]:
+    """Apariciones de cada término (inicio y fin, aplanados) e inicios de frase de un texto
+
+    Con un analizador (SpanishAnalyzer) los términos son los suyos (stems,
+    normas protegidas), así que "prisiones" se resalta al buscar "prisión".
+    """
+    positions: Dict[int, List[int]] = {}
+    if analyzer is not None:
+        for term, start, end in analyzer.terms_with_spans(text):
+            positions.setdefault(term_key(term), []).extend((start, end))
+    else:
+        for match in WORD_PATTERN.finditer(text):
+            positions.setdefault(term_key(match.group()), []).extend(match.span())
+    sentences = [0] + [match.end() for match in SENTENCE_BREAK.finditer(text) if match.end() < len(text)]
+    return positions, sentences
+
+
+def query_weights(query: str, encoder) -> Dict[int, float]:
+    """Clave -> idf de los términos de la consulta que merece la pena resaltar
+
+    Los términos fuera del vocabulario (raros, por debajo de max_features) se
+    tratan como los más raros del índice.
+    """
+    weights = {}
+    if encoder.analyzer is not None:
+        tokens = [term for term, _, _ in encoder.analyzer.terms_with_spans(query)]
+    else:
+        tokens = TOKEN_PATTERN.findall(query.lower())
+    for token in tokens:
+        column = encoder.vocabulary.get(token)
+        idf = encoder.idf[column] if column is not None else encoder.max_idf
+        if idf >= MIN_HIGHLIGHT_IDF:
+            weights[term_key(token)] = idf
+    return weights
+
+
+def best_window(matches: List[Match], sentences: List[int], length: int,
+                max_chars: int = SNIPPET_CHARS) -> Tuple[int, int]:
+    """Ventana (inicio, fin) de hasta max_chars: la frase con más peso de términos distintos y sus vecinas"""
+    if not matches:
+        return 0, min(length, max_chars)
+    bounds = sentences + [length]
+    per_sentence: Dict[int, Dict[int, float]] = {}
+    for start, _, weight, key in matches:
+        per_sentence.setdefault(bisect_right(sentences, start) - 1, {})[key] = weight
+    best = min(per_sentence, key=lambda s: (-sum(per_sentence[s].values()), s))
+
+    # Ampliar con las frases siguientes (o anteriores) mientras quepan enteras
+    lo, hi = best, best + 1
+    start, end = bounds[lo], bounds[hi]
+    while True:
+        if hi < len(sentences) and bounds[hi + 1] - start <= max_chars:
+            hi += 1
+            end = bounds[hi]
+        elif lo > 0 and end - bounds[lo - 1] <= max_chars:
+            lo -= 1
+            start = bounds[lo]
+        else:
+            break
+    if end - start <= max_chars:
+        return start, end
+
+    # Frase más larga que la ventana: el tramo con más peso, empezando poco antes de una coincidencia
+    inside = [match for match in matches if start <= match[0] < end]
+    best_start, best_score = start, -1.0
+    for anchor, _, _, _ in inside:
+        window_start = max(start, anchor - SNIPPET_LEAD)
+        covered = {key: weight for match_start, match_end, weight, key in inside
+                   if match_start >= window_start and match_end <= window_start + max_chars}
+        score = sum(covered.values())
+        if score > best_score:
+            best_start, best_score = window_start, score
+    return best_start, min(end, best_start + max_chars)
+
+
+def _snap(text: str, start: int, end: int) -> Tuple[int, int]:
+    """Lleva a un espacio cercano los cortes que caen dentro de una palabra"""
+    if 0 < start < end and text[start - 1].isalnum() and text[start].isalnum():
+        space = WHITESPACE.search(text, start, min(end, start + SNIPPET_LEAD))
+        if space:
+            start = space.end()
+    if start < end < len(text) and text[end - 1].isalnum() and text[end].isalnum():
+        space = max(text.rfind(' ', max(start, end - SNIPPET_LEAD), end),
+                    text.rfind('\n', max(start, end - SNIPPET_LEAD), end))
+        if space > start:
+            end = space
+    return start, end
+
+
+def make_snippet(text: str, matches: List[Match], sentences: List[int],
+                 max_chars: int = SNIPPET_CHARS) -> Dict:
+    """Pasaje del texto y desplazamientos de los términos resaltados, relativos al pasaje"""
+    matches = sorted(matches)
+    start, end = _snap(text, *best_window(matches, sentences, len(text), max_chars))
+    snippet = text[start:end].rstrip()
+    highlights = [[match_start - start, match_end - start] for match_start, match_end, _, _ in matches
+                  if match_start >= start and match_end <= start + len(snippet)]
+    return {'snippet': snippet, 'snippet_start': start, 'highlights': highlights}
+
+
+class _Sink:
+    """Array que crece en memoria o, con ruta, se vuelca a un archivo por bloques"""
+
+    BLOCK = 1 << 20
+
+    def __init__(self, typecode: str, path: Optional[str] = None):
+        self.typecode = typecode
+        self.path = path
+        self.buffer = array(typecode)
+        self.flushed = 0
+        self.file = open(path, 'wb') if path else None
+
+    def __len__(self) -> int:
+        return self.flushed + len(self.buffer)
+
+    def extend(self, values):
+        self.buffer.extend(values)
+        if self.file is not None and len(self.buffer) >= self.BLOCK:
+            self._flush()
+
+    def _flush(self):
+        self.buffer.tofile(self.file)
+        self.flushed += len(self.buffer)
+        self.buffer = array(self.typecode)
+
+    def to_array(self) -> np.ndarray:
+        return np.frombuffer(self.buffer, dtype=DTYPES[self.typecode])
+
+    def save(self, npy_path: str):
+        """Escribe el .npy; si había volcado, lo copia por bloques y lo borra"""
+        if self.file is None:
+            np.save(npy_path, self.to_array())
+            return
+        self._flush()
+        self.file.close()
+        dtype = DTYPES[self.typecode]
+        target = np.lib.format.open_memmap(npy_path, mode='w+', dtype=dtype, shape=(self.flushed,))
+        if self.flushed:
+            source = np.memmap(self.path, dtype=dtype, mode='r', shape=(self.flushed,))
+            for start in range(0, self.flushed, self.BLOCK):
+                target[start:start + self.BLOCK] = source[start:start + self.BLOCK]
+            del source
+        target.flush()
+        del target
+        os.remove(self.path)
+
+
+class PositionalIndexWriter:
+    """Añade los fragmentos de uno en uno; con `dirpath`, los arrays grandes se vuelcan a disco"""
+
+    def __init__(self, dirpath: Optional[str] = None, analyzer=None):
+        self.analyzer = analyzer
+        # Los arrays por fragmento son pequeños; los de términos y apariciones crecen con el corpus
+        on_disk = {'keys', 'span_indptr', 'spans', 'sentences'} if dirpath else set()
+        self.sinks = {name: _Sink(typecode, os.path.join(dirpath, f"positions_{name}.raw") if name in on_disk else None)
+                      for name, typecode in FILES.items()}
+        for name in ('indptr', 'span_indptr', 'sentence_indptr'):
+            self.sinks[name].extend([0])
+
+    def add(self, text: str):
+        positions, sentences = scan(text, self.analyzer)
+        sinks = self.sinks
+        span_count = len(sinks['spans']) // 2
+        keys = sorted(positions)
+        span_ends = []
+        for key in keys:
+            span_count += len(positions[key]) // 2
+            span_ends.append(span_count)
+            sinks['spans'].extend(positions[key])
+        sinks['keys'].extend(keys)
+        sinks['span_indptr'].extend(span_ends)
+        sinks['indptr'].extend([len(sinks['keys'])])
+        sinks['sentences'].extend(sentences)
+        sinks['sentence_indptr'].extend([len(sinks['sentences'])])
+
+    def to_index(self) -> "PositionalIndex":
+        return PositionalIndex(**{name: sink.to_array() for name, sink in self.sinks.items()})
+
+    def save(self, dirpath: str):
+        for name, sink in self.sinks.items():
+            sink.save(os.path.join(dirpath, f"positions_{name}.npy"))
+
+
+class PositionalIndex:
+    """Posiciones de cada término en cada fragmento e inicios de frase, calculados al indexar
+
+    Permite devolver con cada resultado el pasaje que mejor casa con la
+    consulta y qué palabras resaltar sin volver a recorrer el texto: por
+    cada término de la consulta basta una búsqueda binaria entre las claves
+    del fragmento. Las claves son el crc32 del término en minúsculas, así
+    que no hace falta vocabulario propio y cubre también los términos que
+    quedan fuera del vocabulario TF-IDF.
+    """
+
+    def __init__(self, indptr: np.ndarray, keys: np.ndarray, span_indptr: np.ndarray, spans: np.ndarray,
+                 sentence_indptr: np.ndarray, sentences: np.ndarray):
+        self.indptr = indptr
+        self.keys = keys
+        self.span_indptr = span_indptr
+        self.spans = spans
+        self.sentence_indptr = sentence_indptr
+        self.sentences = sentences
+
+    @classmethod
+    def build(cls, texts: Iterable[str], analyzer=None) -> "PositionalIndex":
+        writer = PositionalIndexWriter(analyzer=analyzer)
+        for text in texts:
+            writer.add(text)
+        return writer.to_index()
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def matches(self, idx: int, weights: Dict[int, float]) -> List[Match]:
+        """Apariciones (inicio, fin, peso, clave) de los términos de la consulta en el fragmento"""
+        if not weights:
+            return []
+        start, end = self.indptr[idx:idx + 2].tolist()
+        keys = self.keys[start:end]
+        query_keys = np.fromiter(weights, dtype=keys.dtype, count=len(weights))
+        # Búsqueda binaria sobre el array (sin copiarlo); solo se leen las apariciones de los términos que están
+        positions = np.searchsorted(keys, query_keys)
+        found = positions < len(keys)
+        found[found] = keys[positions[found]] == query_keys[found]
+        matches = []
+        for key, position in zip(query_keys[found].tolist(), positions[found].tolist()):
+            span_start, span_end = self.span_indptr[start + position:start + position + 2].tolist()
+            spans = self.spans[2 * span_start:2 * span_end].tolist()
+            matches.extend((spans[i], spans[i + 1], weights[key], key) for i in range(0, len(spans), 2))
+        return matches
+
+    def sentence_starts(self, idx: int) -> List[int]:
+        return self.sentences[int(self.sentence_indptr[idx]):int(self.sentence_indptr[idx + 1])].tolist()
+
+    def snippet(self, idx: int, text: str, weights: Dict[int, float], max_chars: int = SNIPPET_CHARS) -> Dict:
+        """Pasaje del fragmento idx para la consulta, con los desplazamientos a resaltar"""
+        return make_snippet(text, self.matches(idx, weights), self.sentence_starts(idx), max_chars)
+
+    def save(self, dirpath: str):
+        for name in FILES:
+            np.save(os.path.join(dirpath, f"positions_{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, dirpath: str) -> "PositionalIndex":
+        """Mapea los arrays en memoria; se usan como ndarray (sin la sobrecarga de np.memmap por acceso)"""
+        return cls(**{name: np.asarray(np.load(os.path.join(dirpath, f"positions_{name}.npy"), mmap_mode='r'))
+                      for name in FILES})
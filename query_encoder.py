@@ -0,0 +1,84 @@
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+import math
+import re
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from scipy.sparse import csr_matrix
+
+# Mismo patrón de tokens que el TfidfVectorizer de VectorStore
+TOKEN_PATTERN = re.compile(r'\b[a-záéíóúüñ]+\b')
+
+
+class QueryEncoder:
+    """Vectoriza consultas con el vocabulario y el idf congelados del índice, sin pasar por sklearn
+
+    Da exactamente el mismo vector que VectorStore._preprocess_text seguido de
+    TfidfVectorizer.transform: unigramas y bigramas, frecuencia por idf y
+    normalización L2. La limpieza de _preprocess_text solo cambia signos por
+    espacios, que ya son límites de palabra para el patrón de tokens, así que
+    basta con pasar a minúsculas y aplicar el patrón una vez. Con un
+    analizador propio (SpanishAnalyzer) se usa el mismo que al indexar.
+    """
+
+    def __init__(self, vocabulary: Dict[str, int], idf: Sequence[float], ngram_range: Tuple[int, int] = (1, 2),
+                 analyzer=None):
+        self.vocabulary = vocabulary
+        # Lista de floats de Python: el acceso escalar es más rápido que en un array
+        self.idf = [float(value) for value in idf]
+        self.max_idf = max(self.idf, default=1.0)
+        self.ngram_range = ngram_range
+        self.analyzer = analyzer
+
+    @classmethod
+    def from_vectorizer(cls, vectorizer, analyzer=None) -> "QueryEncoder":
+        """Congela el vocabulario y el idf de un TfidfVectorizer ya ajustado"""
+        return cls(vectorizer.vocabulary_, vectorizer.idf_, vectorizer.ngram_range, analyzer)
+
+    def analyze(self, text: str) -> List[str]:
+        """Términos (n-gramas) del texto en el mismo orden que el analizador de sklearn"""
+        if self.analyzer is not None:
+            return self.analyzer.analyze(text)
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        min_n, max_n = self.ngram_range
+        terms = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(tokens)) + 1):
+            terms.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return terms
+
+    def encode(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Columnas (ordenadas) y pesos TF-IDF normalizados de la consulta"""
+        counts: Dict[int, int] = {}
+        vocabulary = self.vocabulary
+        for term in self.analyze(text):
+            column = vocabulary.get(term)
+            if column is not None:
+                counts[column] = counts.get(column, 0) + 1
+        columns = sorted(counts)
+        weights = [counts[column] * self.idf[column] for column in columns]
+        # Suma en orden de columna, como la normalización de sklearn (sum() compensa
+        # el redondeo en Python 3.12 y no daría el mismo resultado bit a bit)
+        norm = 0.0
+        for weight in weights:
+            norm += weight * weight
+        if norm > 0.0:
+            norm = math.sqrt(norm)
+            weights = [weight / norm for weight in weights]
+        return np.array(columns, dtype=np.int32), np.array(weights, dtype=np.float64)
+
+    def encode_batch(self, texts: List[str]) -> "csr_matrix":
+        """Matriz dispersa (consultas x términos) con una fila por consulta"""
+        from scipy.sparse import csr_matrix
+
+        indptr, indices, data = [0], [], []
+        for text in texts:
+            columns, weights = self.encode(text)
+            indices.append(columns)
+            data.append(weights)
+            indptr.append(indptr[-1] + len(columns))
+        return csr_matrix(
+            (np.concatenate(data) if data else np.zeros(0), np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32),
+             np.array(indptr, dtype=np.int64)),
+            shape=(len(texts), len(self.vocabulary))
+        )
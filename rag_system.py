@@ -1,72 +1,424 @@
-from groq import Groq
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, List, Dict, Optional, Tuple
+import asyncio
+import csv
+import json
+import os
+import queue
+import logging
+import threading
+import time
+from answer_cache import AnswerCache
+from context_packer import ContextPacker
+from conversation import ConversationContext
+from groq_client import DEFAULT_MODELS, ResilientGroq, get_rate_limiter
+from hybrid_retriever import HybridRetriever
+from metrics import STAGE_HISTOGRAM, inc, observe, span
+from sharded_store import ShardedVectorStore
 from vector_store import VectorStore
 from document_processor import DocumentProcessor
+from streaming_index import StreamingIndexBuilder
+
+logger = logging.getLogger(__name__)
+
+QUESTION_FIELDS = ("pregunta", "question", "consulta")
+
+
+def read_questions(path: str) -> List[str]:
+    """Lee preguntas de un CSV (columna pregunta/question o la primera) o de un JSONL"""
+    questions = []
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith('.jsonl'):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                if isinstance(item, dict):
+                    item = next((item[field] for field in QUESTION_FIELDS if field in item), "")
+                questions.append(str(item))
+        else:
+            reader = csv.DictReader(f)
+            fields = reader.fieldnames or []
+            column = next((c for c in fields if c.strip().lower() in QUESTION_FIELDS), fields[0] if fields else None)
+            if column is None:
+                return []
+            questions = [row[column] or "" for row in reader]
+    return [q.strip() for q in questions if q and q.strip()]
+
+
+def write_batch_results(path: str, questions: List[str], results: List[Dict]):
+    """Escribe preguntas, respuestas y fuentes en CSV o JSONL según la extensión"""
+    rows = [
+        {"pregunta": question, "respuesta": result["answer"], "fuentes": result.get("sources", [])}
+        for question, result in zip(questions, results)
+    ]
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.jsonl'):
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        else:
+            writer = csv.DictWriter(f, fieldnames=["pregunta", "respuesta", "fuentes"])
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(dict(row, fuentes="; ".join(row["fuentes"])))
+
+
+class RetrievalEngine:
+    """Índice de documentos compartido por todas las sesiones de un proceso"""
+
+    def __init__(self, ref_folder: str = "ref", index_path: str = "vector_index", retrieval: str = None,
+                 ingest: str = None, sharding: str = None):
+        self.ref_folder = ref_folder
+        self.index_path = index_path
+        # "none": un único índice; "ley": un índice por documento fuente, con búsqueda en paralelo
+        self.sharding = sharding or os.environ.get("RAG_SHARDING", "none")
+        if self.sharding not in ("none", "ley"):
+            raise ValueError(f"Modo de sharding no soportado: {self.sharding}")
+        self.vector_store = ShardedVectorStore() if self.sharding == "ley" else VectorStore()
+        # "memory": todo el corpus en memoria; "streaming": ingesta en disco con memoria acotada
+        self.ingest = ingest or os.environ.get("RAG_INGEST_MODE", "memory")
+        # "simple": un único backend; "hybrid": varios recuperadores + RRF + reordenación
+        self.retrieval = retrieval or os.environ.get("RAG_RETRIEVAL", "simple")
+        if self.retrieval == "hybrid" and self.sharding == "ley":
+            raise ValueError("La recuperación híbrida no admite el índice por leyes")
+        self.hybrid = HybridRetriever(self.vector_store) if self.retrieval == "hybrid" else None
+        self.doc_processor = DocumentProcessor(ref_folder)
+        self.answer_cache = AnswerCache(f"{index_path}_answers.sqlite3")
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @property
+    def is_ready(self) -> bool:
+        return self._initialized
+
+    @property
+    def leyes(self) -> List[str]:
+        """Documentos fuente por los que se puede filtrar (solo con el índice por leyes)"""
+        return self.vector_store.shard_names if self.sharding == "ley" else []
 
-class RAGSystem:
-    def __init__(self, groq_api_key: str):
-        self.client = Groq(api_key=groq_api_key)
-        self.vector_store = VectorStore()
-        self.doc_processor = DocumentProcessor()
-        
     def initialize(self):
-        """Inicializa el sistema RAG cargando o creando el índice"""
+        """Carga o crea el índice una sola vez, aunque lo llamen varias sesiones a la vez"""
+        with self._lock:
+            if self._initialized:
+                return
+            self._initialize()
+            # Las respuestas generadas con otra versión del índice ya no son válidas
+            removed = self.answer_cache.invalidate(self.vector_store.index_version)
+            if removed:
+                logger.info("🗑️ Respuestas en caché invalidadas: %s", removed)
+            self._initialized = True
+
+    def _initialize(self):
+        """Inicializa el índice cargándolo de disco o creándolo desde los PDFs"""
         try:
-            print("🔄 Iniciando sistema RAG...")
+            logger.info("🔄 Iniciando sistema RAG...")
 
             # Verificar que existe la carpeta de documentos
-            import os
-            ref_folder = "ref"
+            ref_folder = self.ref_folder
             if not os.path.exists(ref_folder):
-                print(f"❌ Carpeta {ref_folder} no existe")
+                logger.error("❌ Carpeta %s no existe", ref_folder)
                 raise Exception(f"Carpeta {ref_folder} no encontrada")
 
             pdf_files = [f for f in os.listdir(ref_folder) if f.lower().endswith('.pdf')]
-            print(f"📄 PDFs encontrados: {pdf_files}")
+            logger.debug("📄 PDFs encontrados: %s", pdf_files)
 
             # Intentar cargar índice existente
-            if not self.vector_store.load_index():
-                print("🔨 Creando nuevo índice...")
+            if not self.vector_store.load_index(self.index_path):
+                logger.info("🔨 Creando nuevo índice...")
+                if self.ingest == "streaming":
+                    self._streaming_rebuild(self.doc_processor.build_manifest())
+                    return
+                manifest = self.doc_processor.build_manifest()
                 documents = self.doc_processor.process_documents()
-                print(f"📚 Documentos procesados: {len(documents)}")
+                logger.debug("📚 Documentos procesados: %s", len(documents))
 
                 if documents:
                     # Mostrar una muestra del primer documento
                     if len(documents) > 0:
-                        print(f"📝 Muestra del primer documento: {documents[0]['text'][:100]}...")
+                        logger.debug("📝 Muestra del primer documento: %s...", documents[0]['text'][:100])
 
                     self.vector_store.build_index(documents)
-                    self.vector_store.save_index()
-                    print("✅ Índice creado y guardado exitosamente")
+                    self.vector_store.manifest = self._indexed_manifest(manifest, {}, documents)
+                    self.vector_store.save_index(self.index_path)
+                    logger.info("✅ Índice creado y guardado exitosamente")
                 else:
-                    print("❌ No se encontraron documentos para procesar")
+                    logger.error("❌ No se encontraron documentos para procesar")
                     raise Exception("No se pudieron procesar los documentos PDF. Verifique que PyMuPDF esté instalado.")
             else:
-                print("✅ Índice cargado correctamente")
-                print(f"📊 Documentos en índice: {len(self.vector_store.documents)}")
+                logger.info("✅ Índice cargado correctamente")
+                self._refresh_index()
+                logger.debug("📊 Documentos en índice: %s", len(self.vector_store.documents))
 
         except Exception as e:
-            print(f"❌ Error en inicialización RAG: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("❌ Error en inicialización RAG: %s", e)
             raise e
     
-    def retrieve_context(self, query: str, k: int = 3) -> List[Dict]:
-        """Recupera contexto relevante para la consulta"""
-        return self.vector_store.search(query, k=k)
+    def _refresh_index(self):
+        """Reindexa solo los PDFs nuevos, modificados o eliminados desde el último guardado"""
+        manifest = self.doc_processor.build_manifest(self.vector_store.manifest)
+        changed, removed = self.doc_processor.diff_manifest(self.vector_store.manifest, manifest)
+
+        if not changed and not removed:
+            if manifest != self.vector_store.manifest:
+                # Solo cambió la fecha de modificación: actualizar el manifiesto
+                self.vector_store.manifest = manifest
+                self.vector_store.save_index(self.index_path)
+            return
+
+        logger.info("🔄 PDFs nuevos o modificados: %s", changed)
+        logger.info("🗑️ PDFs eliminados: %s", removed)
+        if self.ingest == "streaming":
+            # En streaming no se retienen los fragmentos: se reconstruye desde los PDFs
+            # (con el índice por leyes, solo los shards de los PDFs que cambian)
+            self._streaming_rebuild(manifest, changed)
+            return
+        new_documents = self.doc_processor.process_documents(changed) if changed else []
+        indexed = {doc['filename'] for doc in new_documents}
+        # Un PDF que no da fragmentos conserva los que tenía: no se sustituyen por nada
+        self.vector_store.update_documents(new_documents, [f for f in changed if f in indexed] + removed)
+
+        if not self.vector_store.documents:
+            raise Exception("No se pudieron procesar los documentos PDF. Verifique que PyMuPDF esté instalado.")
+
+        self.vector_store.manifest = self._indexed_manifest(manifest, self.vector_store.manifest, new_documents,
+                                                            changed)
+        self.vector_store.save_index(self.index_path)
+        logger.info("✅ Índice actualizado incrementalmente")
+
+    @staticmethod
+    def _indexed_manifest(manifest: Dict, previous: Dict, documents: List[Dict],
+                          changed: Optional[List[str]] = None) -> Dict:
+        """Manifiesto en el que solo constan como al día los PDFs procesados que han dado fragmentos
+
+        Los que fallan conservan su entrada anterior (si la había), así que
+        siguen apareciendo como modificados y se reintentan en la próxima carga.
+        """
+        indexed = {doc['filename'] for doc in documents}
+        manifest = dict(manifest)
+        for filename in (manifest if changed is None else changed):
+            if filename in indexed:
+                continue
+            logger.warning("⚠️ %s no ha producido fragmentos; se reintentará en la próxima carga", filename)
+            if filename in previous:
+                manifest[filename] = previous[filename]
+            else:
+                manifest.pop(filename, None)
+        return manifest
+
+    def _streaming_rebuild(self, manifest: Dict, changed: Optional[List[str]] = None):
+        """Reconstruye el índice en disco fragmento a fragmento, sin cargar el corpus en memoria"""
+        if self.sharding == "ley":
+            built = self.vector_store.build_streaming(self.doc_processor, manifest, self.index_path, changed)
+        else:
+            built = StreamingIndexBuilder(self.vector_store).build(
+                self.doc_processor.iter_documents(), self.index_path, manifest
+            )
+        if not built:
+            raise Exception("No se pudieron procesar los documentos PDF. Verifique que PyMuPDF esté instalado.")
+        logger.info("✅ Índice creado en streaming: %s fragmentos", len(self.vector_store.documents))
+
+    def _filter(self, leyes: Optional[List[str]]) -> Dict:
+        """Argumentos de filtrado por ley para el almacén (vacío si no se filtra)"""
+        if not leyes:
+            return {}
+        if self.hybrid is not None:
+            # Los recuperadores del híbrido buscan en todo el índice: no se devuelven otras leyes en silencio
+            raise ValueError("La recuperación híbrida no admite el filtro por ley (RAG_RETRIEVAL=hybrid)")
+        if self.sharding != "ley":
+            raise ValueError("El filtro por ley requiere el índice por leyes (RAG_SHARDING=ley)")
+        return {'filenames': list(leyes)}
+
+    def search(self, query: str, k: int = 3, leyes: Optional[List[str]] = None) -> List[Dict]:
+        """Busca en el índice compartido (solo lectura, seguro entre hilos), opcionalmente en unas leyes"""
+        with span("retrieve"):
+            restrict = self._filter(leyes)
+            # Las referencias explícitas a artículos se resuelven sin búsqueda por similitud
+            direct = self.vector_store.lookup_articles(query, limit=k, **restrict)
+            if direct:
+                inc("rag_searches_total", path="articulo")
+                return direct
+            if self.hybrid is not None:
+                inc("rag_searches_total", path="hybrid")
+                return self.hybrid.search(query, k=k)
+            inc("rag_searches_total", path="vector")
+            return self.vector_store.search(query, k=k, **restrict)
+
+    def search_batch(self, queries: List[str], k: int = 3, leyes: Optional[List[str]] = None) -> List[List[Dict]]:
+        """Busca varias consultas en el índice compartido en una sola pasada
+
+        Como en `search`, las referencias explícitas a artículos se resuelven
+        directamente; solo el resto pasa por la búsqueda por similitud.
+        """
+        with span("retrieve"):
+            restrict = self._filter(leyes)
+            results = [self.vector_store.lookup_articles(query, limit=k, **restrict) for query in queries]
+            pending = [i for i, direct in enumerate(results) if not direct]
+            if len(pending) < len(queries):
+                inc("rag_searches_total", len(queries) - len(pending), path="articulo")
+            if not pending:
+                return results
+            if self.hybrid is not None:
+                inc("rag_searches_total", len(pending), path="hybrid")
+                found = [self.hybrid.search(queries[i], k=k) for i in pending]
+            else:
+                inc("rag_searches_total", len(pending), path="vector")
+                found = self.vector_store.search_batch([queries[i] for i in pending], k=k, **restrict)
+            for i, docs in zip(pending, found):
+                results[i] = docs
+            return results
+
+
+_engines: Dict[tuple, RetrievalEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_shared_engine(ref_folder: str = "ref", index_path: str = "vector_index") -> RetrievalEngine:
+    """Devuelve el motor de recuperación único del proceso para esa carpeta e índice"""
+    key = (os.path.abspath(ref_folder), os.path.abspath(index_path))
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = RetrievalEngine(ref_folder, index_path)
+        return _engines[key]
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Bucle de eventos del proceso, en un hilo propio, que atiende todas las consultas en streaming"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="rag-event-loop", daemon=True).start()
+        return _loop
+
+
+class StreamingAnswer:
+    """Iterador síncrono de tokens; al agotarse, `result` contiene la respuesta completa"""
+
+    _DONE = object()
+
+    def __init__(self, rag_system: "RAGSystem", question: str, model: str,
+                 conversation: Optional[ConversationContext] = None):
+        self.result: Dict = {}
+        self._tokens = queue.Queue()
+        asyncio.run_coroutine_threadsafe(
+            self._pump(rag_system.aquery_stream(question, model, self.result, conversation)),
+            get_event_loop()
+        )
+
+    async def _pump(self, tokens: AsyncIterator[str]):
+        try:
+            async for token in tokens:
+                self._tokens.put(token)
+        finally:
+            self._tokens.put(self._DONE)
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            token = self._tokens.get()
+            if token is self._DONE:
+                return
+            yield token
+
+
+class RAGSystem:
+    def __init__(self, groq_api_key: str, engine: RetrievalEngine = None):
+        # El SDK de Groq se importa al crear la primera sesión, no al arrancar la app
+        from groq import AsyncGroq, Groq
+
+        # Por sesión solo se guarda el cliente de Groq; el índice es compartido. Los
+        # reintentos los hace ResilientGroq (con límite de ritmo común al proceso),
+        # no el SDK, para no multiplicar las peticiones bajo un 429
+        timeout = float(os.environ.get("RAG_GROQ_TIMEOUT", "30"))
+        self.llm = ResilientGroq(
+            Groq(api_key=groq_api_key, max_retries=0, timeout=timeout),
+            AsyncGroq(api_key=groq_api_key, max_retries=0, timeout=timeout),
+            limiter=get_rate_limiter()
+        )
+        self.engine = engine or get_shared_engine()
+        self.context_packer = ContextPacker()
+        # Leyes a las que se restringen las búsquedas de la sesión (None: todas)
+        self.leyes: Optional[List[str]] = None
+
+    @property
+    def client(self):
+        return self.llm.client
+
+    @client.setter
+    def client(self, client):
+        self.llm.client = client
+
+    @property
+    def async_client(self):
+        return self.llm.async_client
+
+    @async_client.setter
+    def async_client(self, client):
+        self.llm.async_client = client
+
+    @property
+    def vector_store(self) -> VectorStore:
+        return self.engine.vector_store
+
+    @property
+    def doc_processor(self) -> DocumentProcessor:
+        return self.engine.doc_processor
+
+    @property
+    def answer_cache(self) -> AnswerCache:
+        return self.engine.answer_cache
+
+    def initialize(self):
+        """Inicializa el sistema RAG cargando o creando el índice compartido"""
+        self.engine.initialize()
+
+    def retrieve_context(self, query: str, k: int = 3,
+                         conversation: Optional[ConversationContext] = None) -> List[Dict]:
+        """Recupera contexto relevante para la consulta (reutilizando el de la conversación, si la hay)"""
+        if conversation is None:
+            return self.engine.search(query, k=k, leyes=self.leyes)
+        return conversation.retrieve(
+            query, k,
+            search=lambda q, n: self.engine.search(q, k=n, leyes=self.leyes),
+            encoder_for=self.vector_store.query_encoder_for,
+            index_version=self.vector_store.index_version,
+            add_snippets=self.vector_store.add_snippets,
+            filenames=self.leyes
+        )
     
-    def generate_prompt(self, query: str, context_docs: List[Dict]) -> str:
-        """Genera el prompt para el modelo con contexto recuperado"""
+    def pack_context(self, context_docs: List[Dict]) -> Dict:
+        """Fusiona y deduplica los fragmentos y los ajusta al presupuesto de tokens"""
+        with span("context_pack"):
+            packed = self.context_packer.pack(context_docs)
+        inc("rag_context_tokens_saved_total", packed['saved_tokens'])
+        logger.debug("📦 Contexto: %s tokens (%s ahorrados de %s)",
+                     packed['tokens'], packed['saved_tokens'], packed['original_tokens'])
+        return packed
+
+    @staticmethod
+    def _cited_sources(packed: Dict) -> List[str]:
+        """Fuentes de la respuesta: las del contexto y, al final, las que no cupieron en el presupuesto"""
+        return packed['sources'] + packed['dropped_sources']
+
+    def generate_prompt(self, query: str, context_docs: List[Dict], packed: Optional[Dict] = None,
+                        history: str = "") -> str:
+        """Genera el prompt para el modelo con contexto recuperado y, si lo hay, el historial resumido"""
+        packed = packed or self.pack_context(context_docs)
         context_text = "\n\n".join([
-            f"[Fuente: {doc['source']}]\n{doc['text']}"
-            for doc in context_docs
+            f"[Fuente: {'; '.join(block['sources'])}]\n{block['text']}"
+            for block in packed['blocks']
         ])
+        history_text = f"\nCONVERSACIÓN PREVIA (resumida):\n{history}\n" if history else ""
         
         prompt = f"""Eres un asistente jurídico especializado en derecho español. Responde de manera precisa y profesional basándote únicamente en la información proporcionada.
 
 CONTEXTO LEGAL:
 {context_text}
-
+{history_text}
 PREGUNTA: {query}
 
 INSTRUCCIONES:
@@ -80,92 +432,279 @@ RESPUESTA:"""
         
         return prompt
     
-    def query(self, question: str, model: str = "llama-3.1-70b-versatile") -> Dict:
-        """Procesa una consulta usando RAG"""
+    def _build_messages(self, prompt: str) -> List[Dict]:
+        return [
+            {
+                "role": "system",
+                "content": "Eres un asistente jurídico especializado en derecho español."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+
+    def _call_llm(self, prompt: str, model: str) -> Tuple[str, str]:
+        """Envía el prompt a Groq y devuelve el texto de la respuesta y el modelo que la generó"""
+        logger.debug("🌐 Realizando llamada a Groq API con modelo: %s", model)
+        try:
+            with span("llm_call"):
+                answer, used_model = self.llm.complete(
+                    model,
+                    self._build_messages(prompt),
+                    temperature=0.3,
+                    max_tokens=1500
+                )
+            logger.debug("✅ Respuesta recibida de Groq API (%s)", used_model)
+            logger.debug("📄 Longitud de la respuesta: %s caracteres", len(answer))
+            return answer, used_model
+
+        except Exception as api_error:
+            inc("rag_llm_errors_total", error=type(api_error).__name__)
+            logger.exception("❌ Error en llamada a Groq API (%s): %s", type(api_error).__name__, api_error)
+            raise api_error
+
+    def answer_with_context(self, question: str, context_docs: List[Dict],
+                            model: str = "llama-3.1-70b-versatile",
+                            conversation: Optional[ConversationContext] = None) -> Dict:
+        """Genera la respuesta a partir de fragmentos ya recuperados"""
+        if not context_docs:
+            logger.warning("⚠️ No se encontraron documentos relevantes")
+            return {
+                "answer": "No se encontró información relevante en los documentos disponibles.",
+                "sources": [],
+                "context_used": False
+            }
+
+        # Mostrar información de los documentos encontrados
+        for i, doc in enumerate(context_docs):
+            score = doc.get('similarity_score', 0)
+            logger.debug("📄 Doc %s: %s (score: %.3f)", i+1, doc['source'], score)
+
+        history = conversation.history() if conversation is not None else ""
+        cache_key = self._cache_key(question, context_docs, model, history)
+        cached = self.answer_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("⚡ Respuesta servida desde caché")
+            inc("rag_answer_cache_total", result="hit")
+            if conversation is not None:
+                conversation.add_turn(question, cached["answer"])
+            return self._result_from_cache(cached, context_docs)
+        inc("rag_answer_cache_total", result="miss")
+        
+        # Generar prompt con contexto
+        logger.debug("🤖 Generando prompt con contexto...")
+        packed = self.pack_context(context_docs)
+        with span("prompt_build"):
+            prompt = self.generate_prompt(question, context_docs, packed, history)
+        logger.debug("📝 Longitud del prompt: %s caracteres", len(prompt))
+
+        # Consultar al modelo
+        answer, used_model = self._call_llm(prompt, model)
+        # Una respuesta del modelo de respaldo no se guarda con la clave del modelo pedido
+        if used_model == model:
+            self.answer_cache.put(cache_key, self.vector_store.index_version, answer, self._cited_sources(packed))
+        if conversation is not None:
+            conversation.add_turn(question, answer)
+        
+        return {
+            "answer": answer,
+            "sources": self._cited_sources(packed),
+            "dropped_sources": packed['dropped_sources'],
+            "context_used": True,
+            "context_docs": context_docs,
+            "context_tokens": packed['tokens'],
+            "tokens_saved": packed['saved_tokens'],
+            "model": used_model
+        }
+
+    def _cache_key(self, question: str, context_docs: List[Dict], model: str, history: str = "") -> str:
+        """Clave de caché: pregunta normalizada (con el historial, si lo hay), modelo y fragmentos"""
+        chunk_ids = [[doc['filename'], doc['chunk_id']] for doc in context_docs]
+        normalized = self.vector_store._preprocess_text(question)
+        if history:
+            normalized = f"{normalized}\n{self.vector_store._preprocess_text(history)}"
+        return AnswerCache.make_key(normalized, model, chunk_ids, self.vector_store.index_version)
+
+    def _result_from_cache(self, cached: Dict, context_docs: List[Dict]) -> Dict:
+        return {
+            "answer": cached["answer"],
+            "sources": cached["sources"],
+            "context_used": True,
+            "context_docs": context_docs,
+            "cached": True
+        }
+
+    def _not_initialized_result(self) -> Dict:
+        logger.error("❌ No hay documentos cargados en el vector store")
+        return {
+            "answer": "Sistema no inicializado correctamente. No hay documentos disponibles para consulta.",
+            "sources": [],
+            "context_used": False
+        }
+
+    def query(self, question: str, model: str = "llama-3.1-70b-versatile",
+              conversation: Optional[ConversationContext] = None) -> Dict:
+        """Procesa una consulta usando RAG (como seguimiento de `conversation`, si se pasa)"""
+        inc("rag_queries_total", mode="sync")
         try:
-            print(f"🔍 Procesando consulta: {question}")
+            logger.debug("🔍 Procesando consulta: %s", question)
 
             # Verificar que el sistema esté inicializado
             if not self.vector_store.documents:
-                print("❌ No hay documentos cargados en el vector store")
-                return {
-                    "answer": "Sistema no inicializado correctamente. No hay documentos disponibles para consulta.",
-                    "sources": [],
-                    "context_used": False
-                }
+                return self._not_initialized_result()
 
-            print(f"📊 Documentos disponibles en vector store: {len(self.vector_store.documents)}")
+            logger.debug("📊 Documentos disponibles en vector store: %s", len(self.vector_store.documents))
 
             # Recuperar contexto relevante
-            context_docs = self.retrieve_context(question)
-            print(f"🎯 Documentos relevantes encontrados: {len(context_docs)}")
+            context_docs = self.retrieve_context(question, conversation=conversation)
+            logger.debug("🎯 Documentos relevantes encontrados: %s", len(context_docs))
 
-            if not context_docs:
-                print("❌ No se encontraron documentos relevantes")
+            return self.answer_with_context(question, context_docs, model, conversation)
+            
+        except Exception as e:
+            inc("rag_query_errors_total")
+            return {
+                "answer": f"Error procesando la consulta: {str(e)}",
+                "sources": [],
+                "context_used": False
+            }
+
+    def answer_batch(self, questions: List[str], model: str = "llama-3.1-70b-versatile",
+                     k: int = 3, max_concurrency: int = 4) -> List[Dict]:
+        """Responde una lista de preguntas: recuperación en lote y llamadas a Groq concurrentes"""
+        logger.debug("📋 Consulta masiva: %s preguntas", len(questions))
+        if not self.vector_store.documents:
+            return [self._not_initialized_result() for _ in questions]
+
+        contexts = self.engine.search_batch(questions, k=k, leyes=self.leyes)
+
+        def answer(item):
+            question, context_docs = item
+            try:
+                return self.answer_with_context(question, context_docs, model)
+            except Exception as e:
                 return {
-                    "answer": "No se encontró información relevante en los documentos disponibles.",
+                    "answer": f"Error procesando la consulta: {str(e)}",
                     "sources": [],
                     "context_used": False
                 }
 
-            # Mostrar información de los documentos encontrados
-            for i, doc in enumerate(context_docs):
-                score = doc.get('similarity_score', 0)
-                print(f"📄 Doc {i+1}: {doc['source']} (score: {score:.3f})")
-            
-            # Generar prompt con contexto
-            print("🤖 Generando prompt con contexto...")
-            prompt = self.generate_prompt(question, context_docs)
-            print(f"📝 Longitud del prompt: {len(prompt)} caracteres")
+        # Límite de llamadas simultáneas a Groq; map conserva el orden de las preguntas
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+            return list(pool.map(answer, zip(questions, contexts)))
 
-            # Consultar al modelo
-            print(f"🌐 Realizando llamada a Groq API con modelo: {model}")
-            try:
-                response = self.client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "Eres un asistente jurídico especializado en derecho español."
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    temperature=0.3,
-                    max_tokens=1500
-                )
-                print("✅ Respuesta recibida de Groq API")
+    def query_batch(self, input_path: str, output_path: str,
+                    model: str = "llama-3.1-70b-versatile", k: int = 3,
+                    max_concurrency: int = 4) -> List[Dict]:
+        """Responde las preguntas de un CSV/JSONL y escribe respuestas y fuentes en output_path"""
+        questions = read_questions(input_path)
+        results = self.answer_batch(questions, model=model, k=k, max_concurrency=max_concurrency)
+        write_batch_results(output_path, questions, results)
+        logger.info("✅ Resultados guardados en %s", output_path)
+        return results
+    
+    async def aretrieve_context(self, query: str, k: int = 3,
+                                conversation: Optional[ConversationContext] = None) -> List[Dict]:
+        """Recupera contexto en un hilo aparte para no bloquear el bucle de eventos"""
+        return await asyncio.to_thread(self.retrieve_context, query, k, conversation)
 
-                answer = response.choices[0].message.content
-                print(f"📄 Longitud de la respuesta: {len(answer)} caracteres")
+    async def aquery_stream(self, question: str, model: str = "llama-3.1-70b-versatile",
+                            result: Optional[Dict] = None,
+                            conversation: Optional[ConversationContext] = None) -> AsyncIterator[str]:
+        """Procesa una consulta emitiendo los tokens de la respuesta según llegan de Groq
 
-            except Exception as api_error:
-                print(f"❌ Error en llamada a Groq API: {api_error}")
-                print(f"❌ Tipo de error: {type(api_error).__name__}")
-                import traceback
-                traceback.print_exc()
-                raise api_error
-            
-            return {
-                "answer": answer,
-                "sources": [doc['source'] for doc in context_docs],
+        Al terminar, `result` (si se pasa) contiene el mismo diccionario que devuelve query().
+        """
+        result = result if result is not None else {}
+        inc("rag_queries_total", mode="stream")
+        try:
+            logger.debug("🔍 Procesando consulta en streaming: %s", question)
+            if not self.vector_store.documents:
+                result.update(self._not_initialized_result())
+                yield result["answer"]
+                return
+
+            context_docs = await self.aretrieve_context(question, conversation=conversation)
+            logger.debug("🎯 Documentos relevantes encontrados: %s", len(context_docs))
+            if not context_docs:
+                result.update(self.answer_with_context(question, context_docs, model, conversation))
+                yield result["answer"]
+                return
+
+            history = conversation.history() if conversation is not None else ""
+            cache_key = self._cache_key(question, context_docs, model, history)
+            # SQLite y el empaquetado (tokenización) fuera del bucle, como la recuperación:
+            # una espera por el bloqueo de la base no debe parar los demás streams
+            cached = await asyncio.to_thread(self.answer_cache.get, cache_key)
+            if cached is not None:
+                logger.debug("⚡ Respuesta servida desde caché")
+                inc("rag_answer_cache_total", result="hit")
+                if conversation is not None:
+                    conversation.add_turn(question, cached["answer"])
+                result.update(self._result_from_cache(cached, context_docs))
+                yield result["answer"]
+                return
+            inc("rag_answer_cache_total", result="miss")
+
+            packed = await asyncio.to_thread(self.pack_context, context_docs)
+            with span("prompt_build"):
+                prompt = self.generate_prompt(question, context_docs, packed, history)
+            result.update({
+                "answer": "",
+                "sources": self._cited_sources(packed),
+                "dropped_sources": packed['dropped_sources'],
                 "context_used": True,
-                "context_docs": context_docs
-            }
-            
+                "context_docs": context_docs,
+                "context_tokens": packed['tokens'],
+                "tokens_saved": packed['saved_tokens']
+            })
+
+            logger.debug("🌐 Abriendo stream con Groq API, modelo: %s", model)
+            # En streaming se miden el tiempo hasta el primer token y la duración total
+            llm_start = time.perf_counter()
+            used_model, tokens = await self.llm.aopen_stream(
+                model,
+                self._build_messages(prompt),
+                temperature=0.3,
+                max_tokens=1500
+            )
+            result["model"] = used_model
+            parts = []
+            async for token in tokens:
+                if not parts:
+                    observe(STAGE_HISTOGRAM, time.perf_counter() - llm_start, stage="llm_first_token")
+                parts.append(token)
+                yield token
+            observe(STAGE_HISTOGRAM, time.perf_counter() - llm_start, stage="llm_call")
+            result["answer"] = "".join(parts)
+            logger.debug("📄 Longitud de la respuesta: %s caracteres", len(result['answer']))
+            if used_model == model:
+                await asyncio.to_thread(self.answer_cache.put, cache_key, self.vector_store.index_version,
+                                        result["answer"], result["sources"])
+            if conversation is not None:
+                conversation.add_turn(question, result["answer"])
+
         except Exception as e:
-            return {
+            inc("rag_query_errors_total")
+            logger.exception("❌ Error en consulta en streaming: %s", e)
+            result.clear()
+            result.update({
                 "answer": f"Error procesando la consulta: {str(e)}",
                 "sources": [],
                 "context_used": False
-            }
-    
+            })
+            yield result["answer"]
+
+    def query_stream(self, question: str, model: str = "llama-3.1-70b-versatile",
+                     conversation: Optional[ConversationContext] = None) -> "StreamingAnswer":
+        """Versión síncrona de aquery_stream para Streamlit, servida por el bucle compartido"""
+        return StreamingAnswer(self, question, model, conversation)
+
     def get_available_models(self):
-        """Obtiene lista de modelos disponibles en Groq"""
+        """Obtiene lista de modelos disponibles en Groq (en caché durante RAG_GROQ_MODELS_TTL segundos)"""
         try:
-            models = self.client.models.list()
-            return [model.id for model in models.data if 'llama' in model.id.lower()]
-        except:
-            return ["llama-3.1-70b-versatile", "llama-3.1-8b-instant"]
\ No newline at end of file
+            return [model for model in self.llm.list_models() if 'llama' in model.lower()]
+        except Exception as e:
+            logger.warning("⚠️ No se pudo obtener la lista de modelos de Groq: %s", e)
+            return list(DEFAULT_MODELS)
\ No newline at end of file
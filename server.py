@@ -0,0 +1,373 @@
+"""Servicio HTTP y CLI sobre el índice compartido, sin Streamlit.
+
+Uso:
+    python server.py serve --port 8000
+    python server.py query "¿Cuándo puede acordarse la prisión provisional?"
+    python server.py search "prisión provisional" --k 5
+
+Endpoints (JSON):
+    GET  /health
+    GET  /metrics                (formato de Prometheus)
+    GET  /search?q=...&k=5
+    POST /search  {"query": "...", "k": 5, "leyes": ["extranjería.pdf"]}
+    POST /query   {"question": "...", "model": "...", "k": 3, "leyes": [...]}
+
+Las peticiones idénticas que llegan mientras otra igual está en curso no se
+repiten: esperan el resultado de la primera. La cola de peticiones está
+acotada (RAG_SERVER_QUEUE): si se llena, el servidor responde 503 en lugar de
+acumular trabajo. Las llamadas simultáneas a Groq tienen su propio límite
+(RAG_GROQ_CONCURRENCY), de modo que las búsquedas no esperan a las respuestas.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+
+from metrics import METRICS, inc, span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "llama-3.1-70b-versatile"
+
+
+class Overloaded(Exception):
+    """La cola de peticiones está llena"""
+
+
+class RequestCoalescer:
+    """Agrupa las peticiones idénticas en curso: solo la primera se ejecuta"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+
+    def run(self, key: str, submit: Callable[[], Future]) -> Tuple[Future, bool]:
+        """Devuelve el futuro de la petición y si se comparte con otra ya en curso"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, True
+            future = submit()
+            self._inflight[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future, False
+
+    def _forget(self, key: str, future: Future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+
+def jsonable(value):
+    """Convierte los escalares de numpy (puntuaciones, ids) a tipos de JSON"""
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+class RAGService:
+    """Búsqueda y respuesta sobre el índice compartido, con cola acotada y agrupación de peticiones"""
+
+    def __init__(self, rag, workers: Optional[int] = None, queue_size: Optional[int] = None,
+                 llm_concurrency: Optional[int] = None, timeout: Optional[float] = None):
+        self.rag = rag
+        self.engine = rag.engine
+        workers = workers or int(os.environ.get("RAG_SERVER_WORKERS", "8"))
+        # Peticiones admitidas (en ejecución o esperando un hilo) antes de responder 503
+        self.queue_size = queue_size or int(os.environ.get("RAG_SERVER_QUEUE", "64"))
+        self.timeout = timeout or float(os.environ.get("RAG_SERVER_TIMEOUT", "60"))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-server")
+        self._llm_slots = threading.BoundedSemaphore(
+            llm_concurrency or int(os.environ.get("RAG_GROQ_CONCURRENCY", "4"))
+        )
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self.coalescer = RequestCoalescer()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _submit(self, fn: Callable, *args) -> Future:
+        with self._pending_lock:
+            if self._pending >= self.queue_size:
+                raise Overloaded(f"Cola llena ({self.queue_size} peticiones en curso)")
+            self._pending += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future: Future):
+        with self._pending_lock:
+            self._pending -= 1
+
+    def _run(self, endpoint: str, key_parts: List, fn: Callable, *args) -> Dict:
+        """Ejecuta la petición en la cola o se une a una idéntica en curso"""
+        key = json.dumps([endpoint] + key_parts, ensure_ascii=False, default=jsonable)
+        try:
+            future, shared = self.coalescer.run(key, lambda: self._submit(fn, *args))
+        except Overloaded:
+            inc("rag_server_rejected_total", endpoint=endpoint)
+            raise
+        if shared:
+            inc("rag_server_coalesced_total", endpoint=endpoint)
+        return future.result(timeout=self.timeout)
+
+    def _filter_key(self, leyes: Optional[List[str]]) -> List[str]:
+        return sorted(leyes or [])
+
+    def search(self, query: str, k: int = 5, leyes: Optional[List[str]] = None) -> Dict:
+        normalized = self.engine.vector_store._preprocess_text(query)
+        return self._run("search", [normalized, k, self._filter_key(leyes)], self._search, query, k, leyes)
+
+    def _search(self, query: str, k: int, leyes: Optional[List[str]]) -> Dict:
+        results = self.engine.search(query, k=k, leyes=leyes)
+        return {'query': query, 'results': results}
+
+    def query(self, question: str, model: str = DEFAULT_MODEL, k: int = 3,
+              leyes: Optional[List[str]] = None) -> Dict:
+        normalized = self.engine.vector_store._preprocess_text(question)
+        return self._run("query", [normalized, model, k, self._filter_key(leyes)],
+                         self._query, question, model, k, leyes)
+
+    def _query(self, question: str, model: str, k: int, leyes: Optional[List[str]]) -> Dict:
+        context_docs = self.engine.search(question, k=k, leyes=leyes)
+        # La recuperación no ocupa plaza de Groq; la respuesta (o la caché) sí
+        with self._llm_slots:
+            result = self.rag.answer_with_context(question, context_docs, model)
+        return {
+            'question': question,
+            'answer': result['answer'],
+            'sources': result.get('sources', []),
+            # Fuentes recuperadas que no cupieron en el presupuesto de contexto
+            'dropped_sources': result.get('dropped_sources', []),
+            'context': [{'source': doc['source'], 'similarity_score': doc.get('similarity_score')}
+                        for doc in context_docs],
+            'context_tokens': result.get('context_tokens'),
+            'tokens_saved': result.get('tokens_saved'),
+            # Puede ser el modelo de respaldo si el pedido estaba saturado
+            'model': result.get('model', model),
+            'cached': result.get('cached', False),
+        }
+
+    def health(self) -> Dict:
+        store = self.engine.vector_store
+        return {
+            'ready': self.engine.is_ready,
+            'documents': len(store.documents),
+            'index_version': store.index_version,
+            'leyes': self.engine.leyes,
+            'pending': self.pending,
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "RinconesLey/1.0"
+
+    @property
+    def service(self) -> RAGService:
+        return self.server.service
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            self._send_json(200, self.service.health())
+        elif url.path == "/metrics":
+            self._send(200, METRICS.render_prometheus().encode('utf-8'), "text/plain; version=0.0.4; charset=utf-8")
+        elif url.path == "/search":
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            params['leyes'] = parse_qs(url.query).get('ley')
+            self._dispatch("search", params)
+        else:
+            self._send_json(404, {'error': f"Ruta no encontrada: {url.path}"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path not in ("/search", "/query"):
+            self._send_json(404, {'error': f"Ruta no encontrada: {path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("el cuerpo debe ser un objeto JSON")
+        except ValueError as e:
+            self._send_json(400, {'error': f"JSON no válido: {e}"})
+            return
+        self._dispatch(path[1:], body)
+
+    def _dispatch(self, endpoint: str, params: Dict):
+        status = 200
+        try:
+            with span(f"http_{endpoint}"):
+                if endpoint == "search":
+                    payload = self.service.search(self._text(params, 'query', 'q'), self._k(params, 5),
+                                                  self._leyes(params))
+                else:
+                    payload = self.service.query(self._text(params, 'question', 'query'),
+                                                 params.get('model') or DEFAULT_MODEL,
+                                                 self._k(params, 3), self._leyes(params))
+        except Overloaded as e:
+            status, payload = 503, {'error': str(e)}
+        except FutureTimeout:
+            status, payload = 504, {'error': "Tiempo de espera agotado"}
+        except ValueError as e:
+            status, payload = 400, {'error': str(e)}
+        except Exception as e:
+            logger.exception("❌ Error atendiendo /%s: %s", endpoint, e)
+            status, payload = 502 if endpoint == "query" else 500, {'error': f"{type(e).__name__}: {e}"}
+        inc("rag_server_requests_total", endpoint=endpoint, status=status)
+        self._send_json(status, payload, retry_after=1 if status == 503 else None)
+
+    @staticmethod
+    def _text(params: Dict, *names: str) -> str:
+        text = next((params[name] for name in names if params.get(name)), "")
+        if not isinstance(text, str) or not text.strip():
+            raise ValueError(f"Falta el campo '{names[0]}'")
+        return text.strip()
+
+    @staticmethod
+    def _k(params: Dict, default: int) -> int:
+        k = params.get('k')
+        if k is None or k == "":
+            return default
+        # En la URL llega como texto; en JSON debe ser un entero (no 2.5 ni true)
+        if isinstance(k, bool) or not isinstance(k, (int, str)):
+            raise ValueError("k debe ser un entero")
+        try:
+            k = int(k)
+        except ValueError:
+            raise ValueError("k debe ser un entero") from None
+        if not 1 <= k <= 50:
+            raise ValueError("k debe estar entre 1 y 50")
+        return k
+
+    @staticmethod
+    def _leyes(params: Dict) -> Optional[List[str]]:
+        leyes = params.get('leyes')
+        if leyes is None:
+            return None
+        if not isinstance(leyes, list) or not all(isinstance(ley, str) for ley in leyes):
+            raise ValueError("leyes debe ser una lista de nombres de archivo")
+        return leyes
+
+    def _send_json(self, status: int, payload: Dict, retry_after: Optional[int] = None):
+        body = json.dumps(payload, ensure_ascii=False, default=jsonable).encode('utf-8')
+        self._send(status, body, "application/json; charset=utf-8", retry_after)
+
+    def _send(self, status: int, body: bytes, content_type: str, retry_after: Optional[int] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if retry_after is not None:
+            self.send_header("Retry-After", str(retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("🌐 %s - %s", self.address_string(), format % args)
+
+
+def make_server(service: RAGService, host: str = "127.0.0.1", port: int = 8000) -> ThreadingHTTPServer:
+    """Servidor HTTP (un hilo por conexión) que delega en el servicio"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def build_rag(args):
+    """RAGSystem sobre el motor compartido, con Groq o con el cliente falso"""
+    api_key = os.environ.get("GROQ_API_KEY")
+    if not api_key and not args.fake_llm:
+        raise SystemExit("Falta GROQ_API_KEY (o usa --fake-llm para un cliente simulado)")
+
+    from rag_system import RAGSystem, RetrievalEngine
+
+    engine = RetrievalEngine(args.ref, args.index)
+    if args.fake_llm:
+        from answer_cache import AnswerCache
+
+        # Las respuestas simuladas no van a la caché persistente del índice: una ejecución
+        # real posterior las serviría como aciertos
+        engine.answer_cache = AnswerCache(":memory:")
+    engine.initialize()
+    if args.fake_llm:
+        from fake_groq import FakeAsyncGroq, FakeGroq
+
+        rag = RAGSystem("fake", engine=engine)
+        rag.client, rag.async_client = FakeGroq(), FakeAsyncGroq()
+        # El cliente simulado no tiene cuota que respetar
+        rag.llm.limiter = None
+        return rag
+    return RAGSystem(api_key, engine=engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ref', default='ref')
+    parser.add_argument('--index', default='vector_index')
+    parser.add_argument('--fake-llm', action='store_true', help='Responder con un cliente de Groq simulado')
+    parser.add_argument('--verbose', action='store_true', help='Mostrar las trazas de los módulos')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='Servir /search y /query por HTTP')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=int(os.environ.get("PORT", "8000")))
+
+    for name, help_text in (('query', 'Responder una pregunta'), ('search', 'Buscar fragmentos')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('text')
+        command.add_argument('--k', type=int, default=3 if name == 'query' else 5)
+        command.add_argument('--ley', action='append', dest='leyes', help='Restringir a una ley (repetible)')
+        command.add_argument('--json', action='store_true', help='Imprimir la respuesta en JSON')
+        if name == 'query':
+            command.add_argument('--model', default=DEFAULT_MODEL)
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else os.environ.get("RAG_LOG_LEVEL", "WARNING").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+
+    if args.command == 'search':
+        from rag_system import RetrievalEngine
+
+        engine = RetrievalEngine(args.ref, args.index)
+        engine.initialize()
+        results = engine.search(args.text, k=args.k, leyes=args.leyes)
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2, default=jsonable))
+        for doc in [] if args.json else results:
+            print(f"{doc['rank']}. [{doc.get('similarity_score', 0):.3f}] {doc['source']}")
+        return
+
+    service = RAGService(build_rag(args))
+    if args.command == 'query':
+        result = service.query(args.text, args.model, args.k, args.leyes)
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False, indent=2, default=jsonable))
+        else:
+            print(result['answer'])
+            if result['sources']:
+                print("\nFuentes:\n" + "\n".join(f"• {source}" for source in result['sources']))
+        return
+
+    server = make_server(service, args.host, args.port)
+    print(f"⚖️ Servidor en http://{args.host}:{args.port} ({service.health()['documents']} fragmentos)",
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
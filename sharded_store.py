@@ -0,0 +1,349 @@
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import shutil
+
+from article_index import fold
+from metrics import span
+from spanish_analyzer import ANALYZERS
+from streaming_index import StreamingIndexBuilder
+from vector_store import BACKENDS, INDEX_FORMAT_VERSION, VectorStore
+
+logger = logging.getLogger(__name__)
+
+SHARDING_FILE = "sharding.json"
+
+
+class ShardedDocuments(Sequence):
+    """Vista de solo lectura de los fragmentos de todos los shards, en orden de shard"""
+
+    def __init__(self, shards: List[VectorStore]):
+        self.shards = shards
+        self.starts = [0]
+        for shard in shards:
+            self.starts.append(self.starts[-1] + len(shard.documents))
+
+    def __len__(self) -> int:
+        return self.starts[-1]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        for shard, start, end in zip(self.shards, self.starts, self.starts[1:]):
+            if idx < end:
+                return shard.documents[idx - start]
+
+
+def shard_dirname(filename: str) -> str:
+    """Nombre de directorio estable para el shard de un PDF (el hash distingue NFC/NFD)"""
+    slug = re.sub(r'[^a-z0-9]+', '_', fold(os.path.splitext(filename)[0])).strip('_')[:40]
+    return f"{slug or 'ley'}-{hashlib.sha1(filename.encode('utf-8')).hexdigest()[:8]}"
+
+
+class ShardedVectorStore:
+    """Un VectorStore por documento fuente (ley), con búsqueda en paralelo y fusión calibrada.
+
+    Cada ley tiene su propio vocabulario e idf, así que añadir una ley no
+    diluye el vocabulario de las demás y solo se reconstruyen los shards de
+    los PDFs que cambian. Las búsquedas se lanzan en paralelo en los shards
+    elegidos (todos, o los indicados en `filenames`) y se fusionan por
+    puntuación calibrada.
+    """
+
+    # Misma limpieza de texto que el almacén único (clave de la caché de respuestas)
+    _preprocess_text = VectorStore._preprocess_text
+
+    def __init__(self, backend: str = None, max_workers: int = 4, analyzer: str = None):
+        backend = backend or os.environ.get("RAG_BACKEND", "tfidf")
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend no soportado: {backend}")
+        self.backend = backend
+        self.analyzer_name = analyzer or os.environ.get("RAG_ANALYZER", "simple")
+        if self.analyzer_name not in ANALYZERS:
+            raise ValueError(f"Analizador no soportado: {self.analyzer_name}")
+        # Shards por nombre de archivo, en orden alfabético como el almacén único
+        self.shards: Dict[str, VectorStore] = {}
+        self._manifest: Dict[str, Dict] = {}
+        # Shards pendientes de guardar (o de borrar, si ya no existen)
+        self._dirty = set()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard")
+
+    @property
+    def shard_names(self) -> List[str]:
+        return list(self.shards)
+
+    @property
+    def documents(self) -> ShardedDocuments:
+        return ShardedDocuments(list(self.shards.values()))
+
+    @property
+    def dense_index(self):
+        # Cada shard tiene su propio índice denso; no hay uno global
+        return None
+
+    @property
+    def manifest(self) -> Dict[str, Dict]:
+        return self._manifest
+
+    @manifest.setter
+    def manifest(self, manifest: Dict[str, Dict]):
+        """Reparte el manifiesto entre los shards y marca los que cambian"""
+        self._manifest = dict(manifest)
+        for filename, shard in self.shards.items():
+            entry = {filename: manifest[filename]} if filename in manifest else {}
+            if shard.manifest != entry:
+                shard.manifest = entry
+                self._dirty.add(filename)
+
+    @property
+    def index_version(self) -> str:
+        """Identificador del contenido indexado, calculado igual que en el almacén único"""
+        content = json.dumps(
+            {filename: [entry.get('sha256'), entry.get('chunking')] for filename, entry in self._manifest.items()},
+            sort_keys=True
+        )
+        key = f"{INDEX_FORMAT_VERSION}:{self.analyzer_name}:{content}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+    def query_encoder_for(self, filename: str):
+        """Codificador del shard del archivo (cada ley tiene su propio vocabulario)"""
+        return self.shards[filename].query_encoder
+
+    def _new_shard(self) -> VectorStore:
+        return VectorStore(backend=self.backend, analyzer=self.analyzer_name)
+
+    def _set_shard(self, filename: str, shard: Optional[VectorStore]):
+        """Añade, sustituye o (con None) quita el shard de un archivo, manteniendo el orden"""
+        shards = dict(self.shards)
+        if shard is None:
+            shards.pop(filename, None)
+        else:
+            shards[filename] = shard
+        self.shards = {name: shards[name] for name in sorted(shards)}
+        self._dirty.add(filename)
+
+    @staticmethod
+    def _group(documents: Iterable[Dict]) -> Dict[str, List[Dict]]:
+        groups: Dict[str, List[Dict]] = {}
+        for doc in documents:
+            groups.setdefault(doc['filename'], []).append(doc)
+        return groups
+
+    def build_index(self, documents: List[Dict[str, str]], cached_vectors: List = None):
+        """Construye un shard por archivo con sus fragmentos"""
+        for filename in list(self.shards):
+            self._set_shard(filename, None)
+        self._build_shards(self._group(documents))
+
+    def _build_shards(self, groups: Dict[str, List[Dict]]):
+        def build(group):
+            shard = self._new_shard()
+            shard.build_index(group)
+            return shard
+
+        # Los shards son independientes: se construyen en paralelo
+        for filename, shard in zip(groups, self._executor.map(build, groups.values())):
+            self._set_shard(filename, shard)
+        logger.info("Índice por leyes: %s shards, %s fragmentos", len(self.shards), len(self.documents))
+
+    def update_documents(self, new_documents: List[Dict[str, str]], replaced_filenames: List[str]):
+        """Reconstruye solo los shards de los archivos nuevos, modificados o eliminados"""
+        for filename in replaced_filenames:
+            self._set_shard(filename, None)
+        groups = self._group(new_documents)
+        logger.info("♻️ Reutilizando %s shards, %s nuevos", len(self.shards), len(groups))
+        self._build_shards(groups)
+
+    def build_streaming(self, doc_processor, manifest: Dict[str, Dict], filepath: str,
+                        filenames: Optional[List[str]] = None) -> bool:
+        """Reconstruye en streaming los shards indicados (por defecto, todos) directamente en disco"""
+        previous, manifest = self._manifest, dict(manifest)
+        for filename in [f for f in self.shards if f not in manifest]:
+            self._set_shard(filename, None)
+        for filename in (filenames if filenames is not None else sorted(manifest)):
+            shard = self._new_shard()
+            built = StreamingIndexBuilder(shard).build(
+                doc_processor.iter_documents([filename]),
+                self._shard_path(filepath, filename),
+                {filename: manifest[filename]}
+            )
+            if built:
+                self._set_shard(filename, shard)
+                # Los shards construidos en streaming ya están en disco
+                self._dirty.discard(filename)
+            elif filename in previous and filename in self.shards:
+                # Sin fragmentos nuevos se conserva el shard anterior; se reintentará en la próxima carga
+                manifest[filename] = previous[filename]
+            else:
+                self._set_shard(filename, None)
+                del manifest[filename]
+        self.manifest = manifest
+        self.save_index(filepath)
+        return bool(self.shards)
+
+    @staticmethod
+    def _shard_path(filepath: str, filename: str) -> str:
+        return os.path.join(filepath, "shards", shard_dirname(filename))
+
+    def save_index(self, filepath: str = "vector_index"):
+        """Guarda los shards modificados y después la lista de shards"""
+        os.makedirs(os.path.join(filepath, "shards"), exist_ok=True)
+        for filename in sorted(self._dirty):
+            if filename in self.shards:
+                self.shards[filename].save_index(self._shard_path(filepath, filename))
+            else:
+                shutil.rmtree(self._shard_path(filepath, filename), ignore_errors=True)
+        self._dirty.clear()
+
+        # La lista de shards se sustituye la última: marca el índice como completo
+        tmp_path = os.path.join(filepath, f"{SHARDING_FILE}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'format_version': INDEX_FORMAT_VERSION,
+                'manifest': self._manifest,
+                'shards': {filename: shard_dirname(filename) for filename in self.shards},
+            }, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, os.path.join(filepath, SHARDING_FILE))
+        logger.info("Índice por leyes guardado en %s", filepath)
+
+    def load_index(self, filepath: str = "vector_index") -> bool:
+        """Carga todos los shards; si falta alguno, el índice se reconstruye"""
+        sharding_path = os.path.join(filepath, SHARDING_FILE)
+        if not os.path.exists(sharding_path):
+            return False
+        with open(sharding_path, 'r', encoding='utf-8') as f:
+            sharding = json.load(f)
+        if sharding.get('format_version') != INDEX_FORMAT_VERSION:
+            logger.warning("⚠️ Formato de índice %s no compatible, se reconstruirá", sharding.get('format_version'))
+            return False
+
+        shards = {}
+        for filename, dirname in sharding['shards'].items():
+            shard = self._new_shard()
+            if not shard.load_index(os.path.join(filepath, "shards", dirname)):
+                logger.warning("⚠️ Shard de %s no disponible, se reconstruirá el índice", filename)
+                return False
+            shards[filename] = shard
+        self.shards = {name: shards[name] for name in sorted(shards)}
+        self._manifest = sharding['manifest']
+        self._dirty.clear()
+        logger.info("Índice por leyes cargado desde %s: %s shards", filepath, len(self.shards))
+        return True
+
+    def _select(self, filenames: Optional[List[str]]) -> List[VectorStore]:
+        if filenames is None:
+            return list(self.shards.values())
+        unknown = [f for f in filenames if f not in self.shards]
+        if unknown:
+            logger.warning("⚠️ Leyes sin índice: %s", unknown)
+        return [self.shards[f] for f in filenames if f in self.shards]
+
+    @staticmethod
+    def _calibration(shard: VectorStore, query: str) -> float:
+        """Factor que hace comparables las similitudes coseno de shards distintos
+
+        Cada shard normaliza la consulta solo con los términos de su
+        vocabulario: un shard que conoce un único término de la consulta le
+        da peso 1 e infla su similitud. Multiplicar por la norma de la parte
+        conocida entre la norma de la consulta completa (los términos
+        desconocidos con el idf de un término sin documentos) equivale a
+        normalizar la consulta entera.
+        """
+        encoder = shard.query_encoder
+        unseen_idf = math.log(1 + shard.inverted_index.n_docs) + 1
+        counts: Dict[str, int] = {}
+        for term in encoder.analyze(query):
+            counts[term] = counts.get(term, 0) + 1
+        known = full = 0.0
+        for term, count in counts.items():
+            column = encoder.vocabulary.get(term)
+            weight = count * (encoder.idf[column] if column is not None else unseen_idf)
+            full += weight * weight
+            if column is not None:
+                known += weight * weight
+        return math.sqrt(known / full) if full else 0.0
+
+    def _calibrate(self, shard: VectorStore, query: str, results: List[Dict], backend: str) -> List[Dict]:
+        """Ajusta las puntuaciones de un shard; la original queda en shard_score"""
+        # Los embeddings densos ya son comparables entre shards (mismo modelo)
+        factor = 1.0
+        if (backend or self.backend) != "dense" and results:
+            factor = self._calibration(shard, query)
+        for result in results:
+            result['shard_score'] = result['similarity_score']
+            result['similarity_score'] *= factor
+        return results
+
+    def _search_shard(self, shard: VectorStore, query: str, k: int, prune: bool, backend: str,
+                      snippets: bool) -> List[Dict]:
+        results = shard.search(query, k=k, prune=prune, backend=backend, snippets=snippets)
+        return self._calibrate(shard, query, results, backend)
+
+    @staticmethod
+    def _merge(results: List[Dict], k: int) -> List[Dict]:
+        merged = sorted(results, key=lambda doc: -doc['similarity_score'])[:k]
+        for rank, doc in enumerate(merged, start=1):
+            doc['rank'] = rank
+        return merged
+
+    def search(self, query: str, k: int = 5, prune: bool = False, backend: str = None,
+               filenames: Optional[List[str]] = None, snippets: bool = True) -> List[Dict]:
+        """Busca en paralelo en los shards elegidos y fusiona los k mejores"""
+        shards = self._select(filenames)
+        if not shards:
+            logger.error("❌ Vector store no inicializado o sin documentos")
+            return []
+        futures = [self._executor.submit(self._search_shard, shard, query, k, prune, backend, snippets)
+                   for shard in shards]
+        results = [doc for future in futures for doc in future.result()]
+        with span("shard_merge"):
+            return self._merge(results, k)
+
+    def search_batch(self, queries: List[str], k: int = 5, backend: str = None,
+                     filenames: Optional[List[str]] = None, snippets: bool = True) -> List[List[Dict]]:
+        """Busca varias consultas: un lote por shard, en paralelo, y fusión por consulta"""
+        shards = self._select(filenames)
+        if not shards or not queries:
+            return [[] for _ in queries]
+        futures = [self._executor.submit(shard.search_batch, queries, k, backend, snippets) for shard in shards]
+        per_shard = [future.result() for future in futures]
+        all_results = []
+        for row, query in enumerate(queries):
+            results = []
+            for shard, shard_results in zip(shards, per_shard):
+                results.extend(self._calibrate(shard, query, shard_results[row], backend))
+            all_results.append(self._merge(results, k))
+        return all_results
+
+    def add_snippets(self, query: str, docs: List[Dict]):
+        """Pasaje destacado de cada fragmento, calculado en el shard de su archivo"""
+        by_filename: Dict[str, List[Dict]] = {}
+        for doc in docs:
+            by_filename.setdefault(doc.get('filename'), []).append(doc)
+        for filename, shard_docs in by_filename.items():
+            if filename in self.shards:
+                self.shards[filename].add_snippets(query, shard_docs)
+
+    def lookup_articles(self, query: str, limit: int = 6, filenames: Optional[List[str]] = None) -> List[Dict]:
+        """Resuelve referencias explícitas a artículos en los shards elegidos, sin textos repetidos"""
+        results, texts = [], set()
+        for shard in self._select(filenames):
+            if len(results) >= limit:
+                break
+            for result in shard.lookup_articles(query, limit=limit):
+                if result['text'] not in texts and len(results) < limit:
+                    texts.add(result['text'])
+                    results.append(result)
+        for rank, result in enumerate(results, start=1):
+            result['rank'] = rank
+        return results
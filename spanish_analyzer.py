@@ -0,0 +1,131 @@
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple
+import re
+
+ANALYZERS = ("simple", "spanish")
+
+# Referencias a normas y abreviaturas que se conservan como un solo término
+# (el patrón de palabras las partiría o las perdería: "LO 4/2000" quedaría en "lo").
+# Cada alternativa tiene nombre: el término es "<tipo>-<número>" (p. ej. "lo-4/2000").
+PROTECTED = r"""
+      (?P<lo>\b(?:l\.?\s?o\.?|ley\s+org[aá]nica)\s+(?P<lo_n>\d+/\d{2,4})\b)
+    | (?P<rd>\b(?:r\.?\s?d\.?|real\s+decreto)\s+(?P<rd_n>\d+/\d{2,4})\b)
+    | (?P<ley>\bley\s+(?P<ley_n>\d+/\d{2,4})\b)
+    | (?P<abbr>\b(?:arts?|apdos?|n[uú]ms?)\.)
+"""
+WORD = r"\b[a-záéíóúüñ]+\b"
+TOKEN_REGEX = re.compile(f"{PROTECTED} | (?P<word>{WORD})", re.IGNORECASE | re.VERBOSE)
+# Filtro previo barato: todo término protegido lleva "número/año" o una abreviatura con punto
+PROTECTED_HINT = re.compile(r"\d/\d|\b(?:arts?|apdos?|n[uú]ms?)\.")
+WORD_REGEX = re.compile(WORD)
+
+# Abreviaturas frecuentes en los textos legales, expandidas antes de normalizar
+ABBREVIATIONS = {
+    'art.': 'artículo', 'arts.': 'artículos', 'apdo.': 'apartado', 'apdos.': 'apartados',
+    'núm.': 'número', 'núms.': 'números', 'num.': 'número', 'nums.': 'números',
+}
+
+# Tildes y diéresis fuera; la ñ se conserva (año y ano no son lo mismo)
+FOLD = str.maketrans("áéíóúüàèìòù", "aeiouuaeiou")
+
+# Palabras vacías del español (sin tildes) y muletillas de la redacción legal. "muy", "no",
+# "sin" y "contra" se conservan: distinguen categorías ("muy grave") y tipos ("delitos contra...")
+STOP_WORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aquel aquella aquellas aquellos aqui asi
+bajo cada como con cual cuales cualquier cuando cuanto de del desde donde durante e el
+ella ellas ello ellos en entre era eran es esa esas ese eso esos esta estan estas este esto estos
+fue fueron ha han hasta hay la las le les lo los mas me mi mismo misma mismos mismas ni
+nos o os otra otras otro otros para pero por porque que quien quienes se sea sean segun ser si
+sido siempre sino sobre son su sus tal tambien tan tanto te todo toda todos todas tras u un
+una unas uno unos y ya
+dicho dicha dichos dichas presente presentes asimismo cuyo cuya cuyos cuyas conforme mediante
+podra podran debera deberan sera seran haya hayan hubiera hubieran cuanta cuantos cuantas demas
+""".split())
+
+
+def light_stem(word: str) -> str:
+    """Stemmer ligero: solo quita el plural ("prescripciones" -> "prescripcion", "leyes" -> "ley")
+
+    No toca el género ni los sufijos derivativos: en los textos legales
+    distinguen conceptos ("plazo" y "plaza", "detención" y "detenido"), y
+    recortarlos empeoraba el MRR del conjunto de referencia.
+    """
+    if len(word) < 5 or word[-1] != 's':
+        return word
+    if word.endswith('eses'):
+        return word[:-2]
+    if word.endswith('ces'):
+        return word[:-3] + 'z'
+    if word.endswith('es') and word[-3] in 'lrndzjy':
+        return word[:-2]
+    if word[-2] in 'aeiou':
+        return word[:-1]
+    return word
+
+
+class SpanishAnalyzer:
+    """Analizador para textos legales en español: normas protegidas, tildes plegadas, stemming y palabras vacías
+
+    Sustituye al patrón de palabras de TfidfVectorizer cuando RAG_ANALYZER=spanish.
+    El tokenizador es una única expresión regular precompilada y el plegado un
+    str.translate; la normalización de cada palabra (plegado, palabra vacía,
+    stem) se cachea, porque en un corpus legal unas pocas miles de palabras
+    distintas cubren casi todas las apariciones. Los bigramas se forman tras
+    quitar las palabras vacías ("prisión provisional", no "de la").
+    """
+
+    def __init__(self, ngram_range: Tuple[int, int] = (1, 2), cache_size: int = 100000):
+        self.ngram_range = ngram_range
+        self._normalize = lru_cache(maxsize=cache_size)(self._normalize_word)
+
+    @staticmethod
+    def _normalize_word(word: str) -> Optional[str]:
+        """Término de una palabra en minúsculas, o None si es una palabra vacía"""
+        folded = word.translate(FOLD)
+        if folded in STOP_WORDS:
+            return None
+        return light_stem(folded)
+
+    def _term(self, match: "re.Match") -> Optional[str]:
+        kind = match.lastgroup
+        if kind == 'word':
+            return self._normalize(match.group().lower())
+        if kind == 'abbr':
+            return self._normalize(ABBREVIATIONS[match.group().lower()])
+        return f"{kind}-{match.group(kind + '_n')}"
+
+    def terms_with_spans(self, text: str) -> Iterator[Tuple[str, int, int]]:
+        """Términos (unigramas) del texto con su posición, sin las palabras vacías"""
+        for match in TOKEN_REGEX.finditer(text):
+            term = self._term(match)
+            if term is not None:
+                yield term, match.start(), match.end()
+
+    def tokens(self, text: str) -> List[str]:
+        """Términos del texto; sin normas ni abreviaturas basta findall y la caché, sin objetos Match"""
+        text = text.lower()
+        normalize = self._normalize
+        if PROTECTED_HINT.search(text) is None:
+            return list(filter(None, map(normalize, WORD_REGEX.findall(text))))
+        tokens = []
+        for match in TOKEN_REGEX.finditer(text):
+            term = normalize(match.group()) if match.lastgroup == 'word' else self._term(match)
+            if term is not None:
+                tokens.append(term)
+        return tokens
+
+    def analyze(self, text: str) -> List[str]:
+        """Unigramas y n-gramas del texto, en el orden en que los daría TfidfVectorizer"""
+        tokens = self.tokens(text)
+        min_n, max_n = self.ngram_range
+        terms = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(tokens)) + 1):
+            terms.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return terms
+
+
+def get_analyzer(name: str) -> Optional[SpanishAnalyzer]:
+    """Analizador con ese nombre; None para el patrón de palabras de TfidfVectorizer ("simple")"""
+    if name not in ANALYZERS:
+        raise ValueError(f"Analizador no soportado: {name}")
+    return SpanishAnalyzer() if name == "spanish" else None
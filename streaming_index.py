@@ -0,0 +1,206 @@
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import logging
+import os
+
+import numpy as np
+
+from chunk_store import ChunkStoreWriter
+from positional_index import PositionalIndexWriter
+from vector_store import prepare_index_dir, publish_index, write_vocabulary
+
+logger = logging.getLogger(__name__)
+
+# Memoria aproximada que ocupa cada término en los contadores del primer pase
+BYTES_PER_TERM = 400
+
+
+class StreamingIndexBuilder:
+    """Construye el índice TF-IDF en disco en dos pasadas, con memoria acotada.
+
+    Los fragmentos se vuelcan a disco a medida que llegan (texts.bin, las
+    columnas de metadatos y las posiciones de sus términos); el primer pase cuenta frecuencias para elegir vocabulario
+    e idf igual que TfidfVectorizer y el segundo vectoriza por lotes releyendo
+    los textos del disco. La matriz CSR y los postings se escriben directamente
+    en arrays .npy con el mismo formato que VectorStore.save_index.
+    """
+
+    def __init__(self, vector_store, memory_budget_mb: Optional[int] = None):
+        if vector_store.dense_index is not None:
+            raise ValueError("La ingesta en streaming solo admite el backend TF-IDF")
+        self.vector_store = vector_store
+        memory_budget_mb = memory_budget_mb or int(os.environ.get("RAG_INGEST_MEMORY_MB", "256"))
+        budget = memory_budget_mb * 1024 * 1024
+        # Mitad del presupuesto para los contadores de términos, un dieciseisavo por lote
+        self.max_terms = max(10000, budget // 2 // BYTES_PER_TERM)
+        self.batch_bytes = max(1024 * 1024, budget // 16)
+        self.approximate = False
+
+    def build(self, documents: Iterable[Dict], filepath: str = "vector_index",
+              manifest: Optional[Dict] = None) -> bool:
+        """Indexa los fragmentos (un iterable, normalmente un generador) y carga el resultado"""
+        tmp_path = prepare_index_dir(filepath)
+        analyzer = self.vector_store.vectorizer.build_analyzer()
+        self.approximate = False
+
+        # 1. Volcado de fragmentos a disco y recuento de frecuencias
+        n_docs, tf, df, filenames = self._spill(documents, tmp_path, analyzer)
+        if n_docs == 0:
+            logger.warning("⚠️ No hay fragmentos que indexar")
+            return False
+        # Los PDFs sin fragmentos no constan en el manifiesto: se reintentan en la próxima carga
+        manifest = {filename: entry for filename, entry in (manifest or {}).items() if filename in filenames}
+        vocabulary, idf = self._select_vocabulary(tf, df, n_docs)
+        del tf, df
+        write_vocabulary(tmp_path, vocabulary, idf)
+        logger.info("📚 Vocabulario: %s términos de %s fragmentos%s", len(vocabulary), n_docs,
+                    " (aproximado por poda)" if self.approximate else "")
+
+        # 2. Vectorización por lotes y escritura de la matriz CSR
+        vectorizer = self.vector_store._make_vectorizer(vocabulary=vocabulary)
+        vectorizer.idf_ = idf
+        nnz = self._write_matrix(tmp_path, vectorizer, n_docs)
+
+        # 3. Postings (CSC) trasponiendo la matriz por bloques
+        self._write_postings(tmp_path, n_docs, len(vocabulary), nnz)
+
+        publish_index(tmp_path, filepath, manifest, (n_docs, len(vocabulary)), nnz,
+                      self.vector_store.analyzer_name)
+        logger.info("Índice guardado en %s (streaming)", filepath)
+        return self.vector_store.load_index(filepath)
+
+    def _spill(self, documents: Iterable[Dict], tmp_path: str, analyzer) -> Tuple[int, Counter, Counter, Set[str]]:
+        """Escribe textos, metadatos y posiciones a disco y acumula tf/df de cada término"""
+        tf, df = Counter(), Counter()
+        n_docs = 0
+        filenames = set()
+        with open(os.path.join(tmp_path, "texts.bin"), 'wb') as texts:
+            # Metadatos en columnas (unos pocos enteros por fragmento); se escriben al final
+            writer = ChunkStoreWriter(texts)
+            positions = PositionalIndexWriter(tmp_path, self.vector_store.analyzer)
+            for doc in documents:
+                writer.add(doc)
+                positions.add(doc['text'])
+                filenames.add(doc['filename'])
+                n_docs += 1
+
+                terms = analyzer(self.vector_store._analyzer_input(doc['text']))
+                tf.update(terms)
+                df.update(set(terms))
+                if len(tf) > self.max_terms:
+                    self._prune(tf, df)
+        writer.save_columns(tmp_path)
+        positions.save(tmp_path)
+        return n_docs, tf, df, filenames
+
+    def _prune(self, tf: Counter, df: Counter):
+        """Descarta la mitad menos frecuente de los términos para respetar el presupuesto"""
+        keep = set(term for term, _ in tf.most_common(self.max_terms // 2))
+        for term in [term for term in tf if term not in keep]:
+            del tf[term]
+            del df[term]
+        self.approximate = True
+
+    def _select_vocabulary(self, tf: Counter, df: Counter, n_docs: int) -> Tuple[Dict[str, int], np.ndarray]:
+        """Mismo criterio que TfidfVectorizer: max_features términos más frecuentes e idf suavizado"""
+        terms = sorted(tf)
+        limit = self.vector_store.vectorizer.max_features
+        if limit is not None and len(terms) > limit:
+            tfs = np.array([tf[term] for term in terms], dtype=np.int64)
+            kept = np.sort((-tfs).argsort()[:limit])
+            terms = [terms[i] for i in kept]
+        dfs = np.array([df[term] for term in terms], dtype=np.float64)
+        idf = np.log((1 + n_docs) / (1 + dfs)) + 1
+        return {term: i for i, term in enumerate(terms)}, idf
+
+    def _iter_batches(self, tmp_path: str, n_docs: int) -> Iterator[List[str]]:
+        """Relee los textos volcados en lotes de tamaño acotado"""
+        offsets = np.load(os.path.join(tmp_path, "text_offsets.npy"), mmap_mode='r')
+        with open(os.path.join(tmp_path, "texts.bin"), 'rb') as f:
+            batch, batch_size = [], 0
+            for i in range(n_docs):
+                length = int(offsets[i + 1] - offsets[i])
+                batch.append(f.read(length).decode('utf-8'))
+                batch_size += length
+                if batch_size >= self.batch_bytes:
+                    yield batch
+                    batch, batch_size = [], 0
+            if batch:
+                yield batch
+
+    def _write_matrix(self, tmp_path: str, vectorizer, n_docs: int) -> int:
+        """Vectoriza por lotes y escribe data/indices/indptr de la matriz CSR"""
+        indptr = np.zeros(n_docs + 1, dtype=np.int64)
+        row = 0
+        data_raw = os.path.join(tmp_path, "tfidf_data.raw")
+        indices_raw = os.path.join(tmp_path, "tfidf_indices.raw")
+        with open(data_raw, 'wb') as data_file, open(indices_raw, 'wb') as indices_file:
+            for batch in self._iter_batches(tmp_path, n_docs):
+                matrix = vectorizer.transform([self.vector_store._analyzer_input(text) for text in batch])
+                matrix.sort_indices()
+                data_file.write(matrix.data.astype(np.float64).tobytes())
+                indices_file.write(matrix.indices.astype(np.int32).tobytes())
+                indptr[row + 1:row + len(batch) + 1] = indptr[row] + matrix.indptr[1:]
+                row += len(batch)
+
+        nnz = int(indptr[-1])
+        self._raw_to_npy(data_raw, os.path.join(tmp_path, "tfidf_data.npy"), np.float64, nnz)
+        self._raw_to_npy(indices_raw, os.path.join(tmp_path, "tfidf_indices.npy"), np.int32, nnz)
+        np.save(os.path.join(tmp_path, "tfidf_indptr.npy"), indptr)
+        return nnz
+
+    def _raw_to_npy(self, raw_path: str, npy_path: str, dtype, length: int):
+        """Copia por bloques un volcado binario a un .npy y borra el volcado"""
+        target = np.lib.format.open_memmap(npy_path, mode='w+', dtype=dtype, shape=(length,))
+        if length:
+            source = np.memmap(raw_path, dtype=dtype, mode='r', shape=(length,))
+            step = max(1, self.batch_bytes // np.dtype(dtype).itemsize)
+            for start in range(0, length, step):
+                target[start:start + step] = source[start:start + step]
+            del source
+        target.flush()
+        del target
+        os.remove(raw_path)
+
+    def _write_postings(self, tmp_path: str, n_docs: int, n_terms: int, nnz: int):
+        """Traspone la matriz CSR a postings por término sin cargarla entera"""
+        def load_array(name):
+            return np.load(os.path.join(tmp_path, name), mmap_mode='r')
+
+        data, indices, indptr = load_array("tfidf_data.npy"), load_array("tfidf_indices.npy"), load_array("tfidf_indptr.npy")
+        step = max(1, self.batch_bytes // 12)
+
+        # Longitud de cada lista de postings y peso máximo por término
+        counts = np.zeros(n_terms, dtype=np.int64)
+        term_max = np.zeros(n_terms, dtype=np.float64)
+        for start in range(0, nnz, step):
+            columns = np.asarray(indices[start:start + step])
+            counts += np.bincount(columns, minlength=n_terms)
+            np.maximum.at(term_max, columns, data[start:start + step])
+        postings_indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(counts, out=postings_indptr[1:])
+
+        # Reparto por recuento: los fragmentos se recorren en orden, así que cada
+        # lista de postings queda ordenada por fragmento como en tocsc()
+        doc_ids = np.lib.format.open_memmap(os.path.join(tmp_path, "postings_docs.npy"),
+                                            mode='w+', dtype=np.int32, shape=(nnz,))
+        weights = np.lib.format.open_memmap(os.path.join(tmp_path, "postings_weights.npy"),
+                                            mode='w+', dtype=np.float64, shape=(nnz,))
+        cursor = postings_indptr[:-1].copy()
+        for start in range(0, nnz, step):
+            end = min(nnz, start + step)
+            columns = np.asarray(indices[start:end])
+            rows = np.searchsorted(indptr, np.arange(start, end), side='right') - 1
+            order = np.argsort(columns, kind='stable')
+            sorted_columns = columns[order]
+            group_start = np.searchsorted(sorted_columns, sorted_columns, side='left')
+            positions = cursor[sorted_columns] + (np.arange(len(order)) - group_start)
+            doc_ids[positions] = rows[order]
+            weights[positions] = data[start:end][order]
+            cursor += np.bincount(columns, minlength=n_terms)
+        doc_ids.flush()
+        weights.flush()
+        del doc_ids, weights
+
+        np.save(os.path.join(tmp_path, "postings_indptr.npy"), postings_indptr)
+        np.save(os.path.join(tmp_path, "postings_term_max.npy"), term_max)
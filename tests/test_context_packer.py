@@ -0,0 +1,33 @@
+"""El empaquetado de contexto no pierde fuentes al pasarse del presupuesto."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_packer import ContextPacker  # noqa: E402
+
+
+def _doc(name: str, topic: str) -> dict:
+    text = " ".join(f"Artículo {i}. El régimen de {topic} se aplica en el supuesto número {i} de esta ley."
+                    for i in range(1, 30))
+    return {'filename': f"{name}.pdf", 'chunk_id': 0, 'source': f"{name}.pdf (frag. 1)", 'text': text}
+
+
+def test_sources_over_budget_are_reported_as_dropped():
+    docs = [_doc("extranjeria", "extranjería"), _doc("asilo", "protección internacional"),
+            _doc("nacionalidad", "nacionalidad")]
+    packed = ContextPacker(max_tokens=300).pack(docs)
+
+    assert packed['tokens'] <= 300
+    assert packed['dropped_sources']
+    assert set(packed['sources']) | set(packed['dropped_sources']) == {doc['source'] for doc in docs}
+    assert not set(packed['sources']) & set(packed['dropped_sources'])
+
+
+def test_sources_of_repeated_text_stay_cited():
+    first = _doc("extranjeria", "extranjería")
+    repeated = dict(first, filename="copia.pdf", source="copia.pdf (frag. 1)", text=first['text'] + " ")
+    packed = ContextPacker(max_tokens=2000).pack([first, repeated])
+
+    assert packed['sources'] == [first['source'], repeated['source']]
+    assert packed['dropped_sources'] == []
@@ -0,0 +1,223 @@
+"""ResilientGroq contra el servidor falso de Groq: reintentos, respaldo, cobertura y caché de modelos."""
+import asyncio
+import gc
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from groq import AsyncGroq, Groq, NotFoundError  # noqa: E402
+
+from fake_groq_server import FakeGroqServer  # noqa: E402
+from groq_client import ResilientGroq  # noqa: E402
+
+PRIMARY = "llama-3.1-70b-versatile"
+FALLBACK = "llama-3.1-8b-instant"
+MESSAGES = [{"role": "user", "content": "¿Qué dice el artículo 5?"}]
+
+
+def seed_for(outcomes, error_rate=0.0, tail_rate=0.0):
+    """Semilla con la que las peticiones sucesivas admitidas dan 'error', 'slow' o 'fast' en ese orden
+
+    Reproduce los sorteos de FakeGroqServer.admit: primero el error y, si no
+    lo hay, la cola de latencia.
+    """
+    for seed in range(10000):
+        rng = random.Random(seed)
+        drawn = []
+        for _ in outcomes:
+            if rng.random() < error_rate:
+                drawn.append('error')
+            else:
+                drawn.append('slow' if rng.random() < tail_rate else 'fast')
+        if drawn == list(outcomes):
+            return seed
+    raise AssertionError(f"Ninguna semilla produce {outcomes}")
+
+
+def make_client(server, **kwargs):
+    kwargs.setdefault('max_retries', 2)
+    kwargs.setdefault('base_delay', 0.01)
+    kwargs.setdefault('hedge_ms', 0)
+    return ResilientGroq(Groq(api_key="fake", base_url=server.url, max_retries=0),
+                         AsyncGroq(api_key="fake", base_url=server.url, max_retries=0), **kwargs)
+
+
+async def read_stream(client, model):
+    model, tokens = await client.aopen_stream(model, MESSAGES)
+    return model, "".join([token async for token in tokens])
+
+
+def ask(client, model, streaming):
+    """Modelo que responde y texto, por complete() o por aopen_stream()"""
+    if streaming:
+        return asyncio.run(read_stream(client, model))
+    text, model = client.complete(model, MESSAGES)
+    return model, text
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_5xx_retries_then_falls_back(streaming):
+    with FakeGroqServer(down=[PRIMARY]) as server:
+        client = make_client(server)
+        model, text = ask(client, PRIMARY, streaming)
+    assert model == FALLBACK
+    assert text.startswith("Respuesta simulada")
+    # El intento original y sus dos reintentos contra el 70B, luego el 8B
+    assert server.calls == {PRIMARY: 3, FALLBACK: 1}
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_429_with_long_retry_after_falls_back_without_sleeping(streaming):
+    with FakeGroqServer(rpm={PRIMARY: 1}) as server:
+        client = make_client(server)
+        assert client.complete(PRIMARY, MESSAGES)[1] == PRIMARY
+        start = time.perf_counter()
+        model, _ = ask(client, PRIMARY, streaming)
+        elapsed = time.perf_counter() - start
+    assert model == FALLBACK
+    # Retry-After ≈ 60 s supera max_delay: se cambia de modelo sin esperar ni reintentar
+    assert elapsed < 2.0
+    assert server.calls == {PRIMARY: 2, FALLBACK: 1}
+
+
+def test_missing_model_is_not_retried():
+    with FakeGroqServer() as server:
+        client = make_client(server)
+        with pytest.raises(NotFoundError):
+            client.complete("no-such-model", MESSAGES)
+    assert server.calls == {"no-such-model": 1}
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_slow_request_is_hedged_once(streaming):
+    seed = seed_for(['slow', 'fast'], tail_rate=0.5)
+    with FakeGroqServer(tail_ms=3000, tail_rate=0.5, seed=seed) as server:
+        client = make_client(server, hedge_ms=200)
+        start = time.perf_counter()
+        model, _ = ask(client, PRIMARY, streaming)
+        elapsed = time.perf_counter() - start
+    assert model == PRIMARY
+    # Gana la petición de respaldo lanzada a los 200 ms, sin esperar la cola de 3 s
+    assert elapsed < 2.0
+    assert server.calls == {PRIMARY: 2}
+
+
+def test_hedged_stream_retrieves_losing_errors():
+    seed = seed_for(['slow', 'error'], error_rate=0.5, tail_rate=0.5)
+    reported = []
+
+    async def main():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: reported.append(context))
+        with FakeGroqServer(tail_ms=500, error_rate=0.5, tail_rate=0.5, seed=seed) as server:
+            client = make_client(server, hedge_ms=100, max_retries=0)
+            model, _ = await read_stream(client, PRIMARY)
+        del client
+        gc.collect()
+        await asyncio.sleep(0)
+        return model, server.calls
+
+    model, calls = asyncio.run(main())
+    assert model == PRIMARY
+    assert calls == {PRIMARY: 2}
+    assert not reported, reported
+
+
+def test_cancelled_hedged_stream_cancels_both_requests():
+    seed = seed_for(['slow', 'slow'], tail_rate=0.5)
+    reported = []
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(lambda loop, context: reported.append(context))
+        with FakeGroqServer(tail_ms=1000, tail_rate=0.5, seed=seed) as server:
+            client = make_client(server, hedge_ms=100)
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.aopen_stream(PRIMARY, MESSAGES), timeout=0.3)
+            # Las dos peticiones en curso se cancelan, no siguen hasta completar el stream
+            leftover = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            await asyncio.gather(*leftover, return_exceptions=True)
+        gc.collect()
+        return leftover, server.calls
+
+    leftover, calls = asyncio.run(main())
+    assert calls == {PRIMARY: 2}
+    assert all(task.cancelled() for task in leftover)
+    assert not reported, reported
+
+
+class RecordingStream:
+    """Stream del SDK simulado que tarda `delay` s en dar el primer fragmento y anota si se cierra"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.closed = False
+        self._chunks = self._generate()
+
+    async def _generate(self):
+        await asyncio.sleep(self.delay)
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="Hola"))])
+
+    def __aiter__(self):
+        return self._chunks
+
+    async def close(self):
+        self.closed = True
+        await self._chunks.aclose()
+
+
+def recording_client(delays):
+    """ResilientGroq cuyas peticiones en streaming devuelven RecordingStream con esos retrasos"""
+    streams = []
+
+    async def create(model, messages, stream=False, **kwargs):
+        streams.append(RecordingStream(delays[len(streams)]))
+        return streams[-1]
+
+    async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return ResilientGroq(async_client=async_client, hedge_ms=100, max_retries=0, fallbacks={}), streams
+
+
+def test_losing_hedged_stream_is_closed():
+    client, streams = recording_client([1.0, 0.0])
+
+    async def main():
+        model, text = await read_stream(client, PRIMARY)
+        await asyncio.sleep(0.05)
+        return model, text
+
+    assert asyncio.run(main()) == (PRIMARY, "Hola")
+    # El stream del SDK que pierde se cierra (y con él su conexión), no solo el iterador de tokens
+    assert streams[0].closed
+
+
+def test_cancelled_hedged_stream_closes_both_sdk_streams():
+    client, streams = recording_client([1.0, 1.0])
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(client.aopen_stream(PRIMARY, MESSAGES), timeout=0.3)
+        leftover = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await asyncio.gather(*leftover, return_exceptions=True)
+
+    asyncio.run(main())
+    assert len(streams) == 2
+    assert all(stream.closed for stream in streams)
+
+
+def test_list_models_is_cached_for_ttl():
+    with FakeGroqServer() as server:
+        client = make_client(server, models_ttl=0.3)
+        assert set(client.list_models()) == {PRIMARY, FALLBACK}
+        client.list_models()
+        # Otra instancia con la misma URL y clave comparte la caché del proceso
+        make_client(server, models_ttl=0.3).list_models()
+        assert server.model_lists == 1
+        time.sleep(0.35)
+        client.list_models()
+        assert server.model_lists == 2
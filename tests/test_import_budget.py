@@ -0,0 +1,17 @@
+"""El arranque de la app no debe superar el presupuesto de importación en frío (import_budget.IMPORT_BUDGET_MS)."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from import_budget import IMPORT_BUDGET_MS, measure_imports  # noqa: E402
+
+
+def test_import_budget():
+    imports = measure_imports()
+    failures = [
+        f"{module}: {imports[f'{module}_ms']:.0f} ms (presupuesto {IMPORT_BUDGET_MS[module]:.0f} ms), "
+        f"dependencias pesadas: {imports['heavy_modules'][module] or 'ninguna'}"
+        for module in imports['over_budget']
+    ]
+    assert not failures, "Importación fuera de presupuesto:\n" + "\n".join(failures)
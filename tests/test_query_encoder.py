@@ -0,0 +1,42 @@
+"""QueryEncoder da exactamente el mismo vector que _preprocess_text + TfidfVectorizer.transform."""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from query_encoder import QueryEncoder  # noqa: E402
+from vector_store import VectorStore  # noqa: E402
+
+CORPUS = [
+    "Artículo 57. Expulsión del territorio. Los extranjeros podrán ser expulsados del territorio español.",
+    "Artículo 503. La prisión provisional solo podrá ser decretada cuando concurran los requisitos siguientes.",
+    "La autorización de residencia temporal y trabajo por cuenta ajena se concederá al extranjero.",
+    "Disposición adicional primera. El Gobierno aprobará el reglamento de ejecución de esta Ley Orgánica.",
+    "El juez o tribunal podrá acordar la libertad provisional del investigado, con o sin fianza.",
+]
+QUERIES = [
+    "¿Cuándo puede acordarse la prisión provisional?",
+    "expulsión de extranjeros del territorio español",
+    "Autorización de RESIDENCIA temporal; trabajo por cuenta ajena.",
+    "reglamento de ejecución de la ley",
+    "palabras que no están en el vocabulario",
+    "",
+]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_encode_matches_sklearn_transform(query):
+    store = VectorStore(analyzer="simple")
+    vectorizer = store._make_vectorizer()
+    vectorizer.fit([store._preprocess_text(text) for text in CORPUS])
+    encoder = QueryEncoder.from_vectorizer(vectorizer)
+
+    columns, weights = encoder.encode(query)
+    expected = vectorizer.transform([store._preprocess_text(query)])
+    expected.sort_indices()
+
+    np.testing.assert_array_equal(columns, expected.indices)
+    np.testing.assert_array_equal(weights, expected.data)
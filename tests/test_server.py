@@ -0,0 +1,25 @@
+"""El modo --fake-llm del servidor no escribe en la caché de respuestas del índice real."""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag_system import RetrievalEngine  # noqa: E402
+from server import DEFAULT_MODEL, build_rag  # noqa: E402
+
+
+def test_fake_llm_leaves_real_answer_cache_untouched(tmp_path, monkeypatch):
+    monkeypatch.setattr(RetrievalEngine, "initialize", lambda self: None)
+    index_path = str(tmp_path / "vector_index")
+    args = argparse.Namespace(ref=str(tmp_path / "ref"), index=index_path, fake_llm=True)
+
+    rag = build_rag(args)
+    doc = {'filename': "extranjeria.pdf", 'chunk_id': 0, 'source': "extranjeria.pdf (frag. 1)",
+           'text': "Artículo 57. Expulsión del territorio.", 'similarity_score': 1.0}
+    result = rag.answer_with_context("¿Qué dice el artículo 57?", [doc], DEFAULT_MODEL)
+
+    assert result['answer']
+    # La respuesta simulada se cachea en memoria, pero no crea ni toca el archivo del índice
+    assert rag.answer_with_context("¿Qué dice el artículo 57?", [doc], DEFAULT_MODEL).get('cached')
+    assert not os.path.exists(f"{index_path}_answers.sqlite3")
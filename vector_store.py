@@ -1,37 +1,173 @@
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from typing import List, Dict
-import pickle
+from article_index import ArticleIndex
+from chunk_store import ChunkStore
+from dense_index import DenseIndex
+from inverted_index import InvertedIndex
+from metrics import span
+from positional_index import PositionalIndex, query_weights
+from query_encoder import QueryEncoder
+from spanish_analyzer import get_analyzer
+from typing import TYPE_CHECKING, List, Dict
+import hashlib
+import json
+import logging
 import os
 import re
+import shutil
+
+if TYPE_CHECKING:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+logger = logging.getLogger(__name__)
+
+# Versión del formato en disco; al cambiarla los índices antiguos se reconstruyen
+INDEX_FORMAT_VERSION = 5
+
+
+BACKENDS = ("tfidf", "dense")
+
+
+def prepare_index_dir(filepath: str) -> str:
+    """Crea (vacío) el directorio temporal donde se escribe un índice nuevo"""
+    tmp_path = f"{filepath}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    return tmp_path
+
+
+def write_vocabulary(dirpath: str, vocabulary: Dict[str, int], idf: np.ndarray):
+    """Guarda el vocabulario ordenado por columna (un término por línea) y el idf"""
+    terms = [None] * len(vocabulary)
+    for term, column in vocabulary.items():
+        terms[column] = term
+    with open(os.path.join(dirpath, "vocabulary.txt"), 'w', encoding='utf-8') as f:
+        f.write("\n".join(terms))
+    np.save(os.path.join(dirpath, "idf.npy"), idf)
+
+
+def publish_index(tmp_path: str, filepath: str, manifest: Dict, shape, nnz: int, analyzer: str = "simple"):
+    """Escribe manifiesto y formato y sustituye el índice anterior por el temporal"""
+    with open(os.path.join(tmp_path, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # El archivo de formato se escribe el último: marca el índice como completo
+    with open(os.path.join(tmp_path, "format.json"), 'w', encoding='utf-8') as f:
+        json.dump({
+            'format_version': INDEX_FORMAT_VERSION,
+            'analyzer': analyzer,
+            'shape': [int(n) for n in shape],
+            'nnz': int(nnz),
+        }, f)
+
+    old_path = f"{filepath}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(filepath):
+        os.rename(filepath, old_path)
+    os.rename(tmp_path, filepath)
+    shutil.rmtree(old_path, ignore_errors=True)
+
 
 class VectorStore:
-    def __init__(self):
+    def __init__(self, backend: str = None, dense_index: DenseIndex = None, analyzer: str = None):
+        # Backend de búsqueda por defecto: "tfidf" (léxico) o "dense" (embeddings)
+        backend = backend or os.environ.get("RAG_BACKEND", "tfidf")
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend no soportado: {backend}")
+        self.backend = backend
+        # Análisis del texto para TF-IDF: "simple" (patrón de palabras) o "spanish" (SpanishAnalyzer)
+        self.analyzer_name = analyzer or os.environ.get("RAG_ANALYZER", "simple")
+        self.analyzer = get_analyzer(self.analyzer_name)
+        # El índice TF-IDF se construye siempre; el denso solo si se usa ese backend
+        self.dense_index = dense_index or (DenseIndex() if backend == "dense" else None)
+        self.vectorizer = self._make_vectorizer()
+        self.tfidf_matrix = None
+        self.inverted_index = None
+        # Vectorizador de consultas con el vocabulario del índice (sin sklearn por consulta)
+        self.query_encoder = None
+        # Posiciones de los términos en cada fragmento, para extraer el pasaje de cada resultado
+        self.positional_index = None
+        self._rows = None
+        self.article_index = ArticleIndex()
+        self.documents = []
+        # Manifiesto de los PDFs indexados: nombre -> {sha256, size, mtime}
+        self.manifest = {}
+        
+    @property
+    def index_version(self) -> str:
+        """Identificador del contenido indexado: cambia cuando cambia algún PDF"""
+        content = json.dumps(
+            {filename: [entry.get('sha256'), entry.get('chunking')] for filename, entry in self.manifest.items()},
+            sort_keys=True
+        )
+        key = f"{INDEX_FORMAT_VERSION}:{self.analyzer_name}:{content}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+    def _make_vectorizer(self, vocabulary: List[str] = None) -> "TfidfVectorizer":
+        """Crea el vectorizador TF-IDF, opcionalmente con un vocabulario fijo"""
+        # scikit-learn tarda en importarse: se difiere hasta crear el primer almacén
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        if self.analyzer is not None:
+            # El analizador propio tokeniza, normaliza y forma los bigramas
+            return TfidfVectorizer(max_features=5000, analyzer=self.analyzer.analyze, vocabulary=vocabulary)
         # Configurar TF-IDF con parámetros optimizados para español
-        self.vectorizer = TfidfVectorizer(
+        return TfidfVectorizer(
             max_features=5000,
             stop_words=None,  # Sin stop words por defecto
             ngram_range=(1, 2),
             lowercase=True,
-            token_pattern=r'\b[a-záéíóúüñ]+\b'  # Incluir caracteres españoles
+            token_pattern=r'\b[a-záéíóúüñ]+\b',  # Incluir caracteres españoles
+            vocabulary=vocabulary
         )
-        self.tfidf_matrix = None
-        self.documents = []
-        
-    def build_index(self, documents: List[Dict[str, str]]):
-        """Construye el índice TF-IDF con los documentos"""
+
+    def build_index(self, documents: List[Dict[str, str]], cached_vectors: List = None):
+        """Construye el índice TF-IDF (y el denso, si está activo) con los documentos"""
         if not documents:
             return
         
-        print("Generando vectores TF-IDF...")
-        texts = [self._preprocess_text(doc['text']) for doc in documents]
+        logger.info("Generando vectores TF-IDF...")
+        texts = [self._analyzer_input(doc['text']) for doc in documents]
         
         # Crear matriz TF-IDF
         self.tfidf_matrix = self.vectorizer.fit_transform(texts)
-        self.documents = documents
-        print(f"Índice construido con {len(documents)} documentos")
+        self.inverted_index = InvertedIndex.from_matrix(self.tfidf_matrix)
+        self.query_encoder = QueryEncoder.from_vectorizer(self.vectorizer, self.analyzer)
+        if self.dense_index is not None:
+            self.dense_index.build([doc['text'] for doc in documents], cached_vectors)
+        # Metadatos en columnas y textos en un blob: la lista de diccionarios se puede liberar
+        self.documents = documents if isinstance(documents, ChunkStore) else ChunkStore.from_documents(documents)
+        self.article_index = ArticleIndex.from_metadata(self.documents.iter_metadata(['filename', 'articulo']))
+        self.positional_index = PositionalIndex.build(
+            (self.documents.text(i) for i in range(len(self.documents))), self.analyzer
+        )
+        self._rows = None
+        logger.info("Índice construido con %s documentos", len(documents))
     
+    def update_documents(self, new_documents: List[Dict[str, str]], replaced_filenames: List[str]):
+        """Sustituye los fragmentos de los archivos indicados y reconstruye el índice"""
+        replaced = set(replaced_filenames)
+        filenames = self.documents.column('filename') if self.documents else []
+        kept_rows = [i for i, filename in enumerate(filenames) if filename not in replaced]
+        kept = [self.documents[i] for i in kept_rows]
+        logger.info("♻️ Reutilizando %s fragmentos, %s nuevos", len(kept), len(new_documents))
+        # Los embeddings de los fragmentos conservados no se recalculan
+        combined = kept + list(new_documents)
+        cached = [None] * len(combined)
+        if self.dense_index is not None and self.dense_index.vectors is not None and kept_rows:
+            cached[:len(kept)] = list(self.dense_index.vectors_float32(kept_rows))
+        # Orden estable por archivo, igual que DocumentProcessor.process_documents
+        order = sorted(range(len(combined)), key=lambda i: combined[i]['filename'])
+        documents = [combined[i] for i in order]
+        if documents:
+            self.build_index(documents, [cached[i] for i in order])
+        else:
+            self.tfidf_matrix = None
+            self.inverted_index = None
+            self.query_encoder = None
+            self.positional_index = None
+            self._rows = None
+            self.article_index = ArticleIndex()
+            self.documents = []
+
     def _preprocess_text(self, text: str) -> str:
         """Preprocesa el texto para mejorar la búsqueda"""
         # Convertir a minúsculas y limpiar
@@ -41,77 +177,237 @@ class VectorStore:
         # Eliminar espacios múltiples
         text = re.sub(r'\s+', ' ', text)
         return text.strip()
+
+    def _analyzer_input(self, text: str) -> str:
+        """Texto que recibe el vectorizador: el analizador español necesita la puntuación ("art.", "LO 4/2000")"""
+        return text if self.analyzer is not None else self._preprocess_text(text)
     
-    def search(self, query: str, k: int = 5) -> List[Dict]:
-        """Busca documentos similares usando TF-IDF y cosine similarity"""
-        print(f"🔍 Buscando en vector store: '{query}'")
+    def search(self, query: str, k: int = 5, prune: bool = False, backend: str = None,
+               snippets: bool = True) -> List[Dict]:
+        """Busca documentos similares con el backend indicado (por defecto, el del almacén)
+
+        Con `snippets`, cada resultado trae el pasaje que mejor casa con la
+        consulta ('snippet', 'snippet_start' y los desplazamientos a resaltar
+        en 'highlights'); quien solo busca candidatos puede omitirlo.
+        """
+        logger.debug("🔍 Buscando en vector store: '%s'", query)
+
+        if self.tfidf_matrix is None or self.inverted_index is None or not self.documents:
+            logger.error("❌ Vector store no inicializado o sin documentos")
+            return []
 
-        if self.tfidf_matrix is None or not self.documents:
-            print("❌ Vector store no inicializado o sin documentos")
+        if (backend or self.backend) == "dense":
+            with span("dense_search"):
+                top_indices, top_scores = self._dense().search(query, k)
+            logger.debug("🎯 Top %s índices (denso): %s", k, top_indices)
+            return self._build_results(top_indices, top_scores, query if snippets else None)
+
+        logger.debug("📊 Matriz TF-IDF shape: %s", self.tfidf_matrix.shape)
+        logger.debug("📚 Total documentos: %s", len(self.documents))
+
+        # Vectorizar la consulta con el vocabulario y el idf congelados
+        with span("vectorize"):
+            query_terms, query_weights = self.query_encoder.encode(query)
+        logger.debug("🔢 Términos de la consulta en el vocabulario: %s", len(query_terms))
+
+        # Filas y consulta normalizadas (L2): el producto escalar es la similitud coseno
+        top_indices, top_scores = self.inverted_index.search(query_terms, query_weights, k, prune=prune)
+        logger.debug("🎯 Top %s índices: %s", k, top_indices)
+
+        with span("materialize"):
+            return self._build_results(top_indices, top_scores, query if snippets else None)
+
+    def query_encoder_for(self, filename: str) -> QueryEncoder:
+        """Codificador con el que se comparan los fragmentos de ese archivo"""
+        return self.query_encoder
+
+    def lookup_articles(self, query: str, limit: int = 6) -> List[Dict]:
+        """Resuelve referencias explícitas ("artículo 57 LOEX"): hasta `limit` fragmentos, sin textos repetidos"""
+        positions = self.article_index.resolve(query)
+        if positions:
+            logger.debug("📌 Referencia directa a artículos: %s fragmentos", len(positions))
+        results, texts = [], set()
+        weights = self._snippet_weights(query) if positions else {}
+        for idx in positions:
+            if len(results) >= limit:
+                break
+            result = self.documents[idx]
+            if result['text'] in texts:
+                continue
+            texts.add(result['text'])
+            result['similarity_score'] = 1.0
+            result['rank'] = len(results) + 1
+            result['match'] = 'articulo'
+            self._add_snippet(result, idx, weights)
+            results.append(result)
+        return results
+
+    def search_batch(self, queries: List[str], k: int = 5, backend: str = None,
+                     snippets: bool = True) -> List[List[Dict]]:
+        """Busca varias consultas a la vez: un único transform y un producto de matrices dispersas
+
+        Cada lista de resultados tiene la misma forma que la de `search`,
+        incluido el pasaje destacado si se pide `snippets`.
+        """
+        logger.debug("🔍 Búsqueda por lotes: %s consultas", len(queries))
+
+        if self.tfidf_matrix is None or self.inverted_index is None or not self.documents:
+            logger.error("❌ Vector store no inicializado o sin documentos")
+            return [[] for _ in queries]
+        if not queries:
             return []
 
-        print(f"📊 Matriz TF-IDF shape: {self.tfidf_matrix.shape}")
-        print(f"📚 Total documentos: {len(self.documents)}")
+        if (backend or self.backend) == "dense":
+            return [self._build_results(top_indices, top_scores, query if snippets else None)
+                    for query, (top_indices, top_scores) in zip(queries, self._dense().search_batch(queries, k))]
+
+        query_matrix = self.query_encoder.encode_batch(queries)
+        # (consultas x términos) · (términos x fragmentos): similitudes coseno dispersas
+        similarities = (query_matrix @ self.tfidf_matrix.T).tocsr()
+
+        all_results = []
+        for row in range(len(queries)):
+            start, end = similarities.indptr[row], similarities.indptr[row + 1]
+            top_indices, top_scores = InvertedIndex.top_k(
+                similarities.indices[start:end], similarities.data[start:end], k
+            )
+            all_results.append(self._build_results(top_indices, top_scores, queries[row] if snippets else None))
 
-        # Preprocesar y vectorizar la consulta
-        query_processed = self._preprocess_text(query)
-        print(f"🔧 Query procesada: '{query_processed}'")
+        logger.debug("📝 Consultas resueltas: %s", len(all_results))
+        return all_results
 
-        query_vector = self.vectorizer.transform([query_processed])
-        print(f"🔢 Query vector shape: {query_vector.shape}")
+    def _dense(self) -> DenseIndex:
+        if self.dense_index is None or self.dense_index.vectors is None:
+            raise RuntimeError("El índice denso no está construido")
+        return self.dense_index
 
-        # Calcular similitudes coseno
-        similarities = cosine_similarity(query_vector, self.tfidf_matrix)[0]
-        print(f"📈 Similitudes calculadas: min={similarities.min():.3f}, max={similarities.max():.3f}")
+    def _snippet_weights(self, query: str) -> Dict[int, float]:
+        """Términos de la consulta que se resaltan en los pasajes, con su idf"""
+        if self.positional_index is None or self.query_encoder is None:
+            return {}
+        return query_weights(query, self.query_encoder)
 
-        # Obtener los k más similares
-        top_indices = np.argsort(similarities)[::-1][:k]
-        print(f"🎯 Top {k} índices: {top_indices}")
+    def _add_snippet(self, result: Dict, idx: int, weights: Dict[int, float]):
+        """Añade al resultado el pasaje que mejor casa con la consulta y lo que hay que resaltar"""
+        if self.positional_index is not None:
+            result.update(self.positional_index.snippet(idx, result['text'], weights))
 
+    def add_snippets(self, query: str, docs: List[Dict]):
+        """Añade (o rehace) el pasaje destacado de fragmentos de este almacén obtenidos por otra vía"""
+        if self.positional_index is None or not docs:
+            return
+        if self._rows is None:
+            keys = zip(self.documents.column('filename'), self.documents.column('chunk_id'))
+            self._rows = {key: row for row, key in enumerate(keys)}
+        weights = self._snippet_weights(query)
+        for doc in docs:
+            idx = self._rows.get((doc.get('filename'), doc.get('chunk_id')))
+            if idx is not None:
+                self._add_snippet(doc, idx, weights)
+
+    def _build_results(self, top_indices: np.ndarray, top_scores: np.ndarray, query: str = None) -> List[Dict]:
+        """Materializa los fragmentos del top k con su puntuación, posición y pasaje destacado"""
         results = []
-        for i, idx in enumerate(top_indices):
-            score = similarities[idx]
-            print(f"📄 Resultado {i+1}: idx={idx}, score={score:.3f}")
+        weights = self._snippet_weights(query) if query else None
+        for i, (idx, score) in enumerate(zip(top_indices, top_scores)):
+            logger.debug("📄 Resultado %s: idx=%s, score=%.3f", i+1, idx, score)
             if score > 0:  # Solo incluir resultados con similitud > 0
-                result = self.documents[idx].copy()
+                result = self.documents[idx]
                 result['similarity_score'] = score
                 result['rank'] = i + 1
+                if weights is not None:
+                    self._add_snippet(result, int(idx), weights)
                 results.append(result)
-                print(f"✅ Agregado: {result['source']}")
+                logger.debug("✅ Agregado: %s", result['source'])
 
-        print(f"📝 Total resultados retornados: {len(results)}")
+        logger.debug("📝 Total resultados retornados: %s", len(results))
         return results
     
     def save_index(self, filepath: str = "vector_index"):
-        """Guarda el índice y documentos en archivos"""
-        if self.tfidf_matrix is not None:
-            # Guardar matriz TF-IDF
-            with open(f"{filepath}_tfidf.pkl", 'wb') as f:
-                pickle.dump(self.tfidf_matrix, f)
-            # Guardar vectorizador
-            with open(f"{filepath}_vectorizer.pkl", 'wb') as f:
-                pickle.dump(self.vectorizer, f)
-            # Guardar documentos
-            with open(f"{filepath}_docs.pkl", 'wb') as f:
-                pickle.dump(self.documents, f)
-            print(f"Índice guardado en {filepath}")
+        """Guarda el índice en un directorio con arrays .npy mapeables en memoria"""
+        if self.tfidf_matrix is None:
+            return
+
+        # Escribir en un directorio temporal y sustituir al final, para que otros
+        # procesos que tengan mapeado el índice anterior no lean archivos a medias
+        tmp_path = prepare_index_dir(filepath)
+
+        # Matriz TF-IDF como arrays CSR
+        matrix = self.tfidf_matrix.tocsr()
+        np.save(os.path.join(tmp_path, "tfidf_data.npy"), matrix.data)
+        np.save(os.path.join(tmp_path, "tfidf_indices.npy"), matrix.indices)
+        np.save(os.path.join(tmp_path, "tfidf_indptr.npy"), matrix.indptr)
+        self.inverted_index.save(tmp_path)
+        self.positional_index.save(tmp_path)
+
+        write_vocabulary(tmp_path, self.vectorizer.vocabulary_, self.vectorizer.idf_)
+
+        # Textos concatenados en un blob y metadatos en columnas
+        self.documents.save(tmp_path)
+
+        if self.dense_index is not None and self.dense_index.vectors is not None:
+            self.dense_index.save(os.path.join(tmp_path, "dense"))
+
+        publish_index(tmp_path, filepath, self.manifest, matrix.shape, matrix.nnz, self.analyzer_name)
+        logger.info("Índice guardado en %s", filepath)
     
     def load_index(self, filepath: str = "vector_index") -> bool:
-        """Carga el índice y documentos desde archivos"""
+        """Carga el índice desde disco mapeando los arrays en memoria"""
         try:
-            files_needed = [f"{filepath}_tfidf.pkl", f"{filepath}_vectorizer.pkl", f"{filepath}_docs.pkl"]
-            if all(os.path.exists(f) for f in files_needed):
-                # Cargar matriz TF-IDF
-                with open(f"{filepath}_tfidf.pkl", 'rb') as f:
-                    self.tfidf_matrix = pickle.load(f)
-                # Cargar vectorizador
-                with open(f"{filepath}_vectorizer.pkl", 'rb') as f:
-                    self.vectorizer = pickle.load(f)
-                # Cargar documentos
-                with open(f"{filepath}_docs.pkl", 'rb') as f:
-                    self.documents = pickle.load(f)
-                print(f"Índice cargado desde {filepath}")
-                return True
+            format_path = os.path.join(filepath, "format.json")
+            if not os.path.exists(format_path):
+                return False
+
+            with open(format_path, 'r', encoding='utf-8') as f:
+                index_format = json.load(f)
+            if index_format.get('format_version') != INDEX_FORMAT_VERSION:
+                logger.warning("⚠️ Formato de índice %s no compatible, se reconstruirá", index_format.get('format_version'))
+                return False
+            if index_format.get('analyzer') != self.analyzer_name:
+                logger.warning("⚠️ Índice creado con el analizador %s, se reconstruirá con %s",
+                               index_format.get('analyzer'), self.analyzer_name)
+                return False
+
+            from scipy.sparse import csr_matrix
+
+            def load_array(name):
+                return np.load(os.path.join(filepath, name), mmap_mode='r')
+
+            # Matriz TF-IDF sin copiar los arrays mapeados
+            self.tfidf_matrix = csr_matrix(
+                (load_array("tfidf_data.npy"), load_array("tfidf_indices.npy"), load_array("tfidf_indptr.npy")),
+                shape=tuple(index_format['shape']),
+                copy=False
+            )
+            self.inverted_index = InvertedIndex.load(filepath, self.tfidf_matrix.shape[0])
+            self.positional_index = PositionalIndex.load(filepath)
+            self._rows = None
+
+            # Reconstruir el vectorizador a partir del vocabulario y el idf
+            with open(os.path.join(filepath, "vocabulary.txt"), 'r', encoding='utf-8') as f:
+                terms = f.read().split("\n")
+            vocabulary = {term: i for i, term in enumerate(terms)}
+            self.vectorizer = self._make_vectorizer(vocabulary=vocabulary)
+            self.vectorizer.idf_ = np.load(os.path.join(filepath, "idf.npy"))
+            self.query_encoder = QueryEncoder(vocabulary, self.vectorizer.idf_, self.vectorizer.ngram_range,
+                                              self.analyzer)
+
+            # Documentos: columnas y textos mapeados, decodificados bajo demanda
+            self.documents = ChunkStore.load(filepath)
+            self.article_index = ArticleIndex.from_metadata(self.documents.iter_metadata(['filename', 'articulo']))
+
+            # Índice denso: si se usa y falta o no coincide, se reconstruye todo
+            if self.dense_index is not None and not self.dense_index.load(os.path.join(filepath, "dense")):
+                logger.warning("⚠️ Índice denso no disponible, se reconstruirá")
+                return False
+
+            self.manifest = {}
+            manifest_path = os.path.join(filepath, "manifest.json")
+            if os.path.exists(manifest_path):
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    self.manifest = json.load(f)
+            logger.info("Índice cargado desde %s", filepath)
+            return True
         except Exception as e:
-            print(f"Error cargando índice: {e}")
-        return False
\ No newline at end of file
+            logger.error("Error cargando índice: %s", e)
+        return False